@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for the scaling of the workflow steps with the cohort size
+
+The benchmarks generate synthetic projects (sample sheet, configuration, raw data tree) with
+10 to 10,000 donors in a temporary directory.  The suites follow the conventions of `airspeed
+velocity <https://asv.readthedocs.io>`_ and can also be run directly::
+
+    $ python -m benchmarks --donors 10 100 1000
+"""
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Run the benchmarks without ``asv`` and print the timings as TSV"""
+
+import argparse
+import inspect
+import sys
+import time
+
+from .bench_workflows import DONOR_COUNTS, SUITES
+
+__author__ = "Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>"
+
+
+def run_suite(suite_class, donors, repeat):
+    """Yield ``(benchmark, seconds)`` with the best time of ``repeat`` runs of each benchmark
+
+    As with ``asv``, the suite is set up again before each run of benchmarks with ``number = 1``.
+    """
+    suite = suite_class()
+    suite.setup(donors)
+    try:
+        for name, method in inspect.getmembers(suite, inspect.ismethod):
+            if not name.startswith("time_"):
+                continue
+            timings = []
+            for i in range(repeat):
+                if i and getattr(method, "number", 0) == 1:
+                    suite.teardown(donors)
+                    suite.setup(donors)
+                start = time.perf_counter()
+                method(donors)
+                timings.append(time.perf_counter() - start)
+            yield name, min(timings)
+    finally:
+        suite.teardown(donors)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--donors",
+        type=int,
+        nargs="+",
+        default=DONOR_COUNTS,
+        help="Number of donors of the synthetic cohorts, default: %(default)s",
+    )
+    parser.add_argument(
+        "--suite",
+        dest="suites",
+        action="append",
+        choices=[suite.__name__ for suite in SUITES],
+        help="Limit to given suite(s), default is to run all",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Number of repetitions")
+    args = parser.parse_args(argv)
+
+    print("\t".join(("suite", "donors", "benchmark", "seconds")))
+    for suite_class in SUITES:
+        if args.suites and suite_class.__name__ not in args.suites:
+            continue
+        for donors in args.donors:
+            for name, seconds in run_suite(suite_class, donors, args.repeat):
+                print("\t".join((suite_class.__name__, str(donors), name, "%.6f" % seconds)))
+                sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for building the workflow step objects and evaluating their input functions
+
+For each workflow step, the benchmark times the construction of the ``BaseStep`` sub class,
+the call to ``get_result_files()``, and the evaluation of the input and argument functions of
+the main step parts for all libraries, index libraries, or tumor samples of the synthetic cohort.
+"""
+
+import os
+
+from snakemake.io import Wildcards
+
+from snappy_pipeline.workflows.ngs_mapping import NgsMappingWorkflow
+from snappy_pipeline.workflows.somatic_variant_calling import SomaticVariantCallingWorkflow
+from snappy_pipeline.workflows.variant_calling import VariantCallingWorkflow
+from snappy_pipeline.workflows.variant_filtration import VariantFiltrationWorkflow
+
+from .synthetic import SyntheticProject
+
+__author__ = "Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>"
+
+#: Cohort sizes (number of donors) to run the benchmarks for
+DONOR_COUNTS = [10, 100, 1000, 10000]
+
+
+def index_library_names(workflow):
+    """Yield names of the index DNA libraries of all pedigrees"""
+    for sheet in workflow.shortcut_sheets:
+        for pedigree in sheet.cohort.pedigrees:
+            if pedigree.index and pedigree.index.dna_ngs_library:
+                yield pedigree.index.dna_ngs_library.name
+
+
+def tumor_library_names(workflow):
+    """Yield names of the tumor DNA libraries of all sample pairs"""
+    for sheet in workflow.shortcut_sheets:
+        for sample_pair in sheet.all_sample_pairs:
+            yield sample_pair.tumor_sample.dna_ngs_library.name
+
+
+def ngs_mapping_input_calls(workflow):
+    for library_name in sorted(workflow.ngs_library_to_folder_name):
+        yield "bwa", "run", {"library_name": library_name}
+
+
+def variant_calling_input_calls(workflow):
+    for library_name in index_library_names(workflow):
+        for caller in workflow.config["tools"]:
+            yield caller, "run", {"mapper": "bwa", "index_library_name": library_name}
+
+
+def somatic_variant_calling_input_calls(workflow):
+    for library_name in tumor_library_names(workflow):
+        for caller in workflow.config["tools"]:
+            yield caller, "run", {"mapper": "bwa", "tumor_library": library_name}
+
+
+#: Names of the filter step parts and their wildcards in ``variant_filtration``
+FILTER_PARTS = (
+    ("filter_quality", "thresholds"),
+    ("filter_inheritance", "inheritance"),
+    ("filter_frequency", "frequency"),
+    ("filter_regions", "regions"),
+    ("filter_scores", "scores"),
+    ("filter_het_comp", "het_comp"),
+)
+
+
+def variant_filtration_input_calls(workflow):
+    seen = set()
+    for library_name in index_library_names(workflow):
+        for combination in workflow.config["filter_combinations"]:
+            wildcards = {"mapper": "bwa", "caller": "gatk_hc", "index_library": library_name}
+            for (step_part, key), value in zip(FILTER_PARTS, combination.split(".")):
+                wildcards[key] = value
+                if (step_part, tuple(wildcards.items())) not in seen:
+                    seen.add((step_part, tuple(wildcards.items())))
+                    yield step_part, "run", dict(wildcards)
+
+
+class _WorkflowSuite:
+    """Base class for the benchmark suites of one workflow step
+
+    The methods follow the ``asv`` conventions and can also be used through ``python -m
+    benchmarks``.
+    """
+
+    #: ``BaseStep`` sub class to benchmark
+    workflow_class = None
+    #: Data set type of the synthetic project
+    sheet_type = "germline_variants"
+    #: Function yielding ``(step_part, action, wildcards)`` for the input functions to evaluate
+    input_calls = None
+
+    params = DONOR_COUNTS
+    param_names = ["donors"]
+    timeout = 1800
+
+    def setup(self, donors):
+        self.project = SyntheticProject(donors, self.sheet_type)
+        self.cwd = os.getcwd()
+        os.chdir(self.project.step_dir)
+        # Construct once so the file system crawler cache is warm in all timings
+        self.workflow = self.project.construct(self.workflow_class)
+        self.calls = list(type(self).input_calls(self.workflow))
+        # Object without memoized results for ``time_input_functions``, constructed outside of
+        # the timing
+        self.fresh_workflow = self.project.construct(self.workflow_class)
+
+    def teardown(self, donors):
+        os.chdir(self.cwd)
+        self.project.cleanup()
+
+    def time_construct(self, donors):
+        self.project.construct(self.workflow_class)
+
+    def time_get_result_files(self, donors):
+        list(self.workflow.get_result_files())
+
+    def time_input_functions(self, donors):
+        # Use the fresh object so results memoized by earlier repetitions are not reused
+        workflow = self.fresh_workflow
+        for step_part, action, wildcards in self.calls:
+            functions = [workflow.get_input_files(step_part, action)]
+            try:
+                functions.append(workflow.get_args(step_part, action))
+            except NotImplementedError:
+                pass  # step part has no arguments
+            for func in filter(callable, functions):
+                func(Wildcards(fromdict=wildcards))
+
+    # Time one call per ``setup()`` only, such that each timing uses a fresh object
+    time_input_functions.number = 1
+    time_input_functions.warmup_time = 0
+
+
+class NgsMappingSuite(_WorkflowSuite):
+    workflow_class = NgsMappingWorkflow
+    input_calls = ngs_mapping_input_calls
+
+
+class VariantCallingSuite(_WorkflowSuite):
+    workflow_class = VariantCallingWorkflow
+    input_calls = variant_calling_input_calls
+
+
+class SomaticVariantCallingSuite(_WorkflowSuite):
+    workflow_class = SomaticVariantCallingWorkflow
+    sheet_type = "matched_cancer"
+    input_calls = somatic_variant_calling_input_calls
+
+
+class VariantFiltrationSuite(_WorkflowSuite):
+    workflow_class = VariantFiltrationWorkflow
+    input_calls = variant_filtration_input_calls
+
+
+#: All benchmark suites
+SUITES = (NgsMappingSuite, VariantCallingSuite, SomaticVariantCallingSuite, VariantFiltrationSuite)
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""Generation of synthetic projects with sample sheets and raw data for the benchmarks"""
+
+import os
+import os.path
+import shutil
+import tempfile
+import textwrap
+from unittest.mock import MagicMock
+
+import ruamel.yaml as yaml
+
+__author__ = "Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>"
+
+#: Header of the generated germline sample sheets
+GERMLINE_HEADER = (
+    "patientName",
+    "fatherName",
+    "motherName",
+    "sex",
+    "isAffected",
+    "libraryType",
+    "folderName",
+    "hpoTerms",
+)
+
+#: Header of the generated cancer sample sheets
+CANCER_HEADER = ("patientName", "sampleName", "isTumor", "libraryType", "folderName")
+
+#: Template for the configuration, ``{root}`` is replaced by the project directory
+CONFIG_TPL = r"""
+static_data_config:
+  reference:
+    path: {root}/static/ref.fa
+  dbsnp:
+    path: {root}/static/dbsnp.vcf.gz
+  cosmic:
+    path: {root}/static/cosmic.vcf.gz
+
+step_config:
+  ngs_mapping:
+    tools:
+      dna: ['bwa']
+    compute_coverage_bed: true
+    path_target_regions: {root}/static/regions.bed
+    bwa:
+      path_index: {root}/static/bwa/index.fa
+  variant_calling:
+    tools:
+    - bcftools
+    - gatk_hc
+  somatic_variant_calling:
+    tools:
+    - mutect
+  variant_filtration:
+    path_variant_annotation: ../variant_annotation
+    tools_ngs_mapping: ['bwa']
+    tools_variant_calling: ['gatk_hc']
+    filter_combinations:
+    - conservative.de_novo.dominant_freq.lifted_enhancers.all_scores.passthrough
+    - conservative.de_novo.dominant_freq.limb_tads.conserved.passthrough
+
+data_sets:
+  first_batch:
+    file: sheet.tsv
+    search_patterns:
+    - {{'left': '*/*/*_R1.fastq.gz', 'right': '*/*/*_R2.fastq.gz'}}
+    search_paths: ['{root}/raw']
+    type: {sheet_type}
+    naming_scheme: only_secondary_id
+"""
+
+
+def germline_sheet_tsv(num_donors):
+    """Return germline sample sheet TSV with ``num_donors`` donors in trios"""
+    lines = ["[Data]", "\t".join(GERMLINE_HEADER)]
+    for i in range(0, num_donors, 3):
+        index, father, mother = ("D{:05d}".format(j) for j in range(i, i + 3))
+        father, mother = (
+            p if j < num_donors else "." for j, p in ((i + 1, father), (i + 2, mother))
+        )
+        lines.append("\t".join((index, father, mother, "F", "Y", "WGS", index, ".")))
+        for parent, sex in ((father, "M"), (mother, "F")):
+            if parent != ".":
+                lines.append("\t".join((parent, ".", ".", sex, "N", "WGS", parent, ".")))
+    return "\n".join(lines) + "\n"
+
+
+def cancer_sheet_tsv(num_donors):
+    """Return cancer sample sheet TSV with ``num_donors`` donors with normal and tumor sample"""
+    lines = ["\t".join(CANCER_HEADER)]
+    for i in range(num_donors):
+        donor = "D{:05d}".format(i)
+        for sample, is_tumor in (("N1", "N"), ("T1", "Y")):
+            folder = "{}-{}-DNA1-WGS1".format(donor, sample)
+            lines.append("\t".join((donor, sample, is_tumor, "WGS", folder)))
+    return "\n".join(lines) + "\n"
+
+
+class SubWorkflowPaths(dict):
+    """Replacement for ``workflow.globals`` that returns path functions for all sub workflows"""
+
+    def __missing__(self, key):
+        prefix = key.upper() + "/"
+        return lambda path: prefix + path
+
+
+class SyntheticProject:
+    """Project directory with sample sheet, configuration, and raw data tree
+
+    The raw data tree contains one flow cell and lane directory with empty paired FASTQ files
+    for each folder name of the sample sheet.
+    """
+
+    def __init__(self, num_donors, sheet_type="germline_variants", root=None):
+        #: Number of donors
+        self.num_donors = num_donors
+        #: Data set type, ``"germline_variants"`` or ``"matched_cancer"``
+        self.sheet_type = sheet_type
+        #: Whether the directory has been created by this object and must be removed
+        self.owns_root = root is None
+        #: Root directory of the project
+        self.root = root or tempfile.mkdtemp(prefix="snappy_benchmark.")
+        #: Sample sheet TSV
+        if sheet_type == "matched_cancer":
+            self.sheet_tsv = cancer_sheet_tsv(num_donors)
+        else:
+            self.sheet_tsv = germline_sheet_tsv(num_donors)
+        #: Directory with the sheet
+        self.config_dir = os.path.join(self.root, "config")
+        #: Directory of the step, snakemake would run here
+        self.step_dir = os.path.join(self.root, "step")
+        self._write_files()
+
+    def _write_files(self):
+        os.makedirs(self.config_dir, exist_ok=True)
+        os.makedirs(self.step_dir, exist_ok=True)
+        with open(os.path.join(self.config_dir, "sheet.tsv"), "wt") as outf:
+            outf.write(self.sheet_tsv)
+        os.makedirs(os.path.join(self.root, "static", "bwa"), exist_ok=True)
+        with open(os.path.join(self.root, "static", "ref.fa.fai"), "wt") as outf:
+            outf.write("1\t249250621\t52\t60\t61\n2\t243199373\t253404903\t60\t61\n")
+        for ext in (".amb", ".ann", ".bwt", ".pac", ".sa"):
+            open(os.path.join(self.root, "static", "bwa", "index.fa" + ext), "wb").close()
+        header = self.sheet_tsv.splitlines().index("\t".join(self._header()))
+        for line in self.sheet_tsv.splitlines()[header + 1 :]:
+            folder = line.split("\t")[self._header().index("folderName")]
+            lane_dir = os.path.join(self.root, "raw", folder, "FCXXXXXX", "L001")
+            os.makedirs(lane_dir, exist_ok=True)
+            for i in (1, 2):
+                path = os.path.join(lane_dir, "{}_R{}.fastq.gz".format(folder, i))
+                open(path, "wb").close()
+
+    def _header(self):
+        if self.sheet_type == "matched_cancer":
+            return CANCER_HEADER
+        else:
+            return GERMLINE_HEADER
+
+    def load_config(self):
+        """Return freshly loaded configuration"""
+        return yaml.round_trip_load(
+            textwrap.dedent(CONFIG_TPL).format(root=self.root, sheet_type=self.sheet_type)
+        )
+
+    def construct(self, workflow_class):
+        """Construct and return ``workflow_class`` object for this project"""
+        workflow = MagicMock()
+        workflow.globals = SubWorkflowPaths()
+        return workflow_class(
+            workflow, self.load_config(), {}, [self.config_dir], [], self.step_dir
+        )
+
+    def cleanup(self):
+        """Remove the project directory if it was created by this object"""
+        if self.owns_root:
+            shutil.rmtree(self.root, ignore_errors=True)
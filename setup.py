@@ -98,7 +98,7 @@ setup(
     author="Manuel Holtgrewe",
     author_email="manuel.holtgrewe@bihealth.de",
     url="https://gitlab.bihealth.org/cubi/snappy_pipeline",
-    packages=find_packages(),
+    packages=find_packages(exclude=("benchmarks",)),
     package_dir={"snappy_wrappers": "snappy_wrappers", "snappy_pipeline": "snappy_pipeline"},
     entry_points={
         "console_scripts": list(
@@ -110,6 +110,8 @@ setup(
                     "snappy-start-step = snappy_pipeline.apps.snappy_start_step:main",
                     "snappy-refresh-step = snappy_pipeline.apps.snappy_refresh_step:main",
                     "snappy-slurm-status = snappy_pipeline.apps.snappy_slurm_status:main",
+                    "snappy-benchmark-report = snappy_pipeline.apps.snappy_benchmark_report:main",
+                    "snappy-job-telemetry = snappy_pipeline.apps.snappy_job_telemetry:main",
                 ),
                 console_scripts_entry_points(TOOLS, "tools"),
             )
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""Aggregate the Snakemake benchmark files of a project into a per-rule table
+
+The rules of the pipeline steps write ``*.benchmark.txt`` files next to their log files (see
+``BaseStepPart.get_benchmark_file()``), the file names end in
+``.{step_part}.{action}.benchmark.txt``.  This app collects all such files below a project
+directory and writes one line per step, step part, and action with the wall-clock time, memory
+usage, I/O, and CPU efficiency of the jobs.
+"""
+
+import argparse
+from collections import OrderedDict
+import os
+import sys
+
+from ..resource_model import read_benchmark_file
+
+__author__ = "Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>"
+
+#: Suffix of the benchmark files
+BENCHMARK_SUFFIX = ".benchmark.txt"
+
+#: Header of the report
+REPORT_HEADER = (
+    "step",
+    "rule",
+    "jobs",
+    "runs",
+    "total_s",
+    "mean_s",
+    "max_s",
+    "mean_max_rss_mb",
+    "max_max_rss_mb",
+    "total_io_in_mb",
+    "total_io_out_mb",
+    "cpu_efficiency",
+)
+
+
+def find_benchmark_files(path):
+    """Yield paths to the benchmark files below ``path``, skipping ``.snakemake`` directories"""
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted(d for d in dirnames if d != ".snakemake")
+        for filename in sorted(filenames):
+            if filename.endswith(BENCHMARK_SUFFIX):
+                yield os.path.join(dirpath, filename)
+
+
+def get_rule_key(project_dir, path):
+    """Return ``(step, rule)`` for benchmark file at ``path``
+
+    The step is the name of the top-level directory in ``project_dir`` (or the name of
+    ``project_dir`` itself if it is a step directory) and the rule is ``{step_part}.{action}``
+    from the file name.
+    """
+    rel_path = os.path.relpath(path, project_dir)
+    step = rel_path.split(os.sep)[0]
+    if step == "work":
+        step = os.path.basename(os.path.abspath(project_dir))
+    stem = os.path.basename(path)[: -len(BENCHMARK_SUFFIX)]
+    return step, ".".join(stem.rsplit(".", 2)[-2:])
+
+
+class RuleSummary:
+    """Aggregated benchmark values of one rule"""
+
+    def __init__(self, step, rule):
+        #: Name of the step
+        self.step = step
+        #: Name of the rule as ``{step_part}.{action}``
+        self.rule = rule
+        #: Number of jobs (benchmark files)
+        self.jobs = 0
+        #: Wall-clock seconds of all runs
+        self.seconds = []
+        #: Maximal RSS in MB of all runs
+        self.max_rss = []
+        #: Total MB read
+        self.io_in = 0.0
+        #: Total MB written
+        self.io_out = 0.0
+        #: Total CPU seconds of the runs with CPU time
+        self.cpu_time = 0.0
+        #: Total wall-clock seconds of the runs with CPU time
+        self.cpu_wall_time = 0.0
+
+    def add_job(self, records):
+        """Add the records of one benchmark file"""
+        self.jobs += 1
+        for record in records:
+            if "s" in record:
+                self.seconds.append(record["s"])
+            if "max_rss" in record:
+                self.max_rss.append(record["max_rss"])
+            self.io_in += record.get("io_in", 0.0)
+            self.io_out += record.get("io_out", 0.0)
+            if "cpu_time" in record and record.get("s"):
+                self.cpu_time += record["cpu_time"]
+                self.cpu_wall_time += record["s"]
+
+    def to_dict(self):
+        """Return ``OrderedDict`` with the values for the report
+
+        The CPU efficiency is the CPU time per wall-clock second, i.e., the mean number of busy
+        cores.
+        """
+        return OrderedDict(
+            (
+                ("step", self.step),
+                ("rule", self.rule),
+                ("jobs", self.jobs),
+                ("runs", len(self.seconds)),
+                ("total_s", sum(self.seconds)),
+                ("mean_s", _mean(self.seconds)),
+                ("max_s", max(self.seconds, default=None)),
+                ("mean_max_rss_mb", _mean(self.max_rss)),
+                ("max_max_rss_mb", max(self.max_rss, default=None)),
+                ("total_io_in_mb", self.io_in),
+                ("total_io_out_mb", self.io_out),
+                (
+                    "cpu_efficiency",
+                    self.cpu_time / self.cpu_wall_time if self.cpu_wall_time else None,
+                ),
+            )
+        )
+
+
+def _mean(values):
+    if values:
+        return sum(values) / len(values)
+    else:
+        return None
+
+
+def build_report(project_dir):
+    """Return list of ``OrderedDict`` report entries, sorted by decreasing total time"""
+    summaries = OrderedDict()
+    for path in find_benchmark_files(project_dir):
+        key = get_rule_key(project_dir, path)
+        if key not in summaries:
+            summaries[key] = RuleSummary(*key)
+        summaries[key].add_job(read_benchmark_file(path))
+    report = [summary.to_dict() for summary in summaries.values()]
+    return sorted(report, key=lambda entry: (-entry["total_s"], entry["step"], entry["rule"]))
+
+
+def write_report(report, outputf):
+    """Write report as TSV to ``outputf``"""
+    print("\t".join(REPORT_HEADER), file=outputf)
+    for entry in report:
+        print("\t".join(_format_value(entry[key]) for key in REPORT_HEADER), file=outputf)
+
+
+def _format_value(value):
+    if value is None:
+        return "."
+    elif isinstance(value, float):
+        return "%.2f" % value
+    else:
+        return str(value)
+
+
+def main(argv=None):
+    """Main entry point after parsing command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Aggregate the benchmark files of a project into a per-rule TSV table"
+    )
+    parser.add_argument(
+        "project_dir", nargs="?", default=".", help="Project or step directory, default: '.'"
+    )
+    parser.add_argument(
+        "--output",
+        type=argparse.FileType("wt"),
+        default=sys.stdout,
+        help="Path to output TSV file, default: stdout",
+    )
+    args = parser.parse_args(argv)
+
+    write_report(build_report(args.project_dir), args.output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""Record CPU, memory, and I/O telemetry of cluster jobs and collect it into a TSV table
+
+When enabled with ``snappy-snake --snappy-telemetry``, the job script starts ``snappy-job-telemetry
+sample`` in the background.  The sampler periodically reads ``/proc`` for the process tree of the
+job script and writes a JSON record when the job ends.  The record is written next to the log
+file of the rule (``{log}.telemetry.json`` with the ``.log`` suffix removed) or, for group jobs and
+jobs without log file, into the ``.snappy_telemetry`` directory.  ``snappy-job-telemetry collect``
+merges the records below a project directory into a TSV table for capacity planning.
+"""
+
+import argparse
+from collections import OrderedDict
+import json
+import os
+import signal
+import socket
+import sys
+import time
+
+from snakemake.utils import read_job_properties
+
+__author__ = "Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>"
+
+#: Directory (relative to the step directory) for records of jobs without log file
+TELEMETRY_DIR = ".snappy_telemetry"
+
+#: Suffix of the telemetry record files
+TELEMETRY_SUFFIX = ".telemetry.json"
+
+#: Default sampling interval in seconds
+DEFAULT_INTERVAL = 10.0
+
+#: Header of the collected table
+REPORT_HEADER = (
+    "path",
+    "rule",
+    "jobid",
+    "host",
+    "slurm_job_id",
+    "start_time",
+    "wall_s",
+    "cpu_s",
+    "cpu_efficiency",
+    "max_rss_mb",
+    "io_read_mb",
+    "io_write_mb",
+    "req_threads",
+    "req_mem_mb",
+    "req_time",
+    "exit_status",
+    "samples",
+)
+
+
+def get_record_path(properties):
+    """Return path to the telemetry record for the job with the given Snakemake properties"""
+    logs = [path for path in properties.get("log") or [] if not path.endswith(".md5")]
+    if properties.get("type") == "single" and logs:
+        log = logs[0]
+        if log.endswith(".log"):
+            log = log[: -len(".log")]
+        return log + TELEMETRY_SUFFIX
+    name = properties.get("rule") or "group.{}".format(properties.get("groupid"))
+    return os.path.join(
+        TELEMETRY_DIR, "{}.{}{}".format(name, properties.get("jobid"), TELEMETRY_SUFFIX)
+    )
+
+
+class ProcessTreeSampler:
+    """Sample CPU time, RSS, and I/O of a process and its descendants from ``/proc``
+
+    The CPU time of a sample is the sum of the user and system times of the live processes
+    including the times of their terminated and waited-for children, so processes that terminate
+    between samples are accounted for by their parents.  I/O is summed over the last values seen
+    for each process.
+    """
+
+    def __init__(self, root_pid, exclude_pid=None, proc_dir="/proc"):
+        #: PID of the root process
+        self.root_pid = root_pid
+        #: PID of a process to ignore with its descendants (i.e., the sampler itself)
+        self.exclude_pid = exclude_pid
+        #: Path to the ``proc`` file system
+        self.proc_dir = proc_dir
+        #: Clock ticks per second and page size for interpreting ``/proc/{pid}/stat``
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        #: Number of samples taken
+        self.samples = 0
+        #: Maximal CPU seconds of all samples
+        self.cpu_seconds = 0.0
+        #: Maximal total RSS in bytes of all samples
+        self.max_rss = 0
+        #: Last ``(read_bytes, write_bytes)`` by PID
+        self.io = {}
+
+    def _read_stat(self, pid):
+        """Return ``(ppid, cpu seconds, rss bytes)`` of process or ``None`` if it is gone"""
+        try:
+            with open(os.path.join(self.proc_dir, str(pid), "stat"), "rt") as inputf:
+                data = inputf.read()
+        except OSError:
+            return None
+        fields = data[data.rindex(")") + 2 :].split()  # the name may contain spaces
+        ticks = sum(int(x) for x in fields[11:15])  # utime, stime, cutime, cstime
+        return int(fields[1]), ticks / self.clock_ticks, int(fields[21]) * self.page_size
+
+    def _read_io(self, pid):
+        """Return ``(read_bytes, write_bytes)`` of process or ``None`` if not readable"""
+        values = {}
+        try:
+            with open(os.path.join(self.proc_dir, str(pid), "io"), "rt") as inputf:
+                for line in inputf:
+                    key, _, value = line.partition(":")
+                    values[key] = int(value)
+        except (OSError, ValueError):
+            return None
+        return values.get("read_bytes", 0), values.get("write_bytes", 0)
+
+    def get_tree(self):
+        """Return ``dict`` with ``(cpu seconds, rss bytes)`` by PID for the process tree"""
+        stats = {}
+        for name in os.listdir(self.proc_dir):
+            if name.isdigit():
+                stat = self._read_stat(int(name))
+                if stat:
+                    stats[int(name)] = stat
+        children = {}
+        for pid, (ppid, _, _) in stats.items():
+            children.setdefault(ppid, []).append(pid)
+        result, stack = {}, [self.root_pid]
+        while stack:
+            pid = stack.pop()
+            if pid in stats and pid != self.exclude_pid:
+                result[pid] = stats[pid][1:]
+                stack += children.get(pid, [])
+        return result
+
+    def sample(self):
+        """Take sample, return whether the root process still exists"""
+        tree = self.get_tree()
+        if not tree:
+            return False
+        self.samples += 1
+        self.cpu_seconds = max(self.cpu_seconds, sum(cpu for cpu, _ in tree.values()))
+        self.max_rss = max(self.max_rss, sum(rss for _, rss in tree.values()))
+        for pid in tree:
+            self.io[pid] = self._read_io(pid) or self.io.get(pid, (0, 0))
+        return True
+
+    def get_start_time(self):
+        """Return start time of the root process as seconds since the epoch or ``None``"""
+        try:
+            with open(os.path.join(self.proc_dir, "stat"), "rt") as inputf:
+                boot_time = next(
+                    int(line.split()[1]) for line in inputf if line.startswith("btime")
+                )
+            with open(os.path.join(self.proc_dir, str(self.root_pid), "stat"), "rt") as inputf:
+                data = inputf.read()
+        except (OSError, StopIteration):
+            return None
+        start_ticks = int(data[data.rindex(")") + 2 :].split()[19])
+        return boot_time + start_ticks / self.clock_ticks
+
+    def get_io(self):
+        """Return ``(read_bytes, write_bytes)`` summed over all processes seen"""
+        return tuple(sum(values) for values in zip((0, 0), *self.io.values()))
+
+
+def build_record(properties, sampler, start_time, end_time, exit_status):
+    """Return ``OrderedDict`` with telemetry record of the job"""
+    wall_seconds = end_time - start_time
+    io_read, io_write = sampler.get_io()
+    cluster = properties.get("cluster") or {}
+    return OrderedDict(
+        (
+            ("rule", properties.get("rule") or "group.{}".format(properties.get("groupid"))),
+            ("jobid", properties.get("jobid")),
+            ("host", socket.gethostname()),
+            ("slurm_job_id", os.environ.get("SLURM_JOB_ID")),
+            ("start_time", time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(start_time))),
+            ("wall_s", wall_seconds),
+            ("cpu_s", sampler.cpu_seconds),
+            ("cpu_efficiency", sampler.cpu_seconds / wall_seconds if wall_seconds else None),
+            ("max_rss_mb", sampler.max_rss / 1024 / 1024),
+            ("io_read_mb", io_read / 1024 / 1024),
+            ("io_write_mb", io_write / 1024 / 1024),
+            ("req_threads", properties.get("threads")),
+            ("req_mem_mb", cluster.get("mem")),
+            ("req_time", cluster.get("time")),
+            ("exit_status", exit_status),
+            ("samples", sampler.samples),
+        )
+    )
+
+
+def write_record(path, record):
+    """Write record to ``path`` as JSON, creating the directory if necessary"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "wt") as outputf:
+        json.dump(record, outputf, indent=2)
+        print(file=outputf)
+    os.replace(path + ".tmp", path)
+
+
+class _Stop(Exception):
+    """Raised by the signal handler for stopping the sampling"""
+
+
+def _raise_stop(signum, frame):
+    raise _Stop()
+
+
+def read_exit_status(path):
+    """Return exit status from status file written by the job script or ``None`` if not written"""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, "rt") as inputf:
+        value = inputf.read().strip()
+    return int(value) if value else None
+
+
+def run_sample(args):
+    """Sample the process tree until ``SIGTERM``, the end of the root process, or until the exit
+    status has been written, write record
+    """
+    signal.signal(signal.SIGTERM, _raise_stop)
+    properties = read_job_properties(args.jobscript) or {}
+    sampler = ProcessTreeSampler(args.pid, exclude_pid=os.getpid())
+    start_time = sampler.get_start_time() or time.time()
+    try:
+        # The job script ignores SIGTERM until the handler is installed, so a signal sent
+        # before that is lost and the status file must be checked as well.
+        while sampler.sample() and read_exit_status(args.status_file) is None:
+            time.sleep(args.interval)
+    except _Stop:
+        pass
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    sampler.sample()
+    exit_status = read_exit_status(args.status_file)
+    record = build_record(properties, sampler, start_time, time.time(), exit_status)
+    write_record(args.output or get_record_path(properties), record)
+
+
+def find_records(path):
+    """Yield paths to the telemetry records below ``path``, skipping ``.snakemake`` directories"""
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted(d for d in dirnames if d != ".snakemake")
+        for filename in sorted(filenames):
+            if filename.endswith(TELEMETRY_SUFFIX):
+                yield os.path.join(dirpath, filename)
+
+
+def run_collect(args):
+    """Write the records below the project directory as TSV table"""
+    print("\t".join(REPORT_HEADER), file=args.output)
+    for path in find_records(args.project_dir):
+        with open(path, "rt") as inputf:
+            record = json.load(inputf)
+        record["path"] = os.path.relpath(path, args.project_dir)
+        print("\t".join(_format_value(record.get(key)) for key in REPORT_HEADER), file=args.output)
+
+
+def _format_value(value):
+    if value is None:
+        return "."
+    elif isinstance(value, float):
+        return "%.2f" % value
+    else:
+        return str(value)
+
+
+def main(argv=None):
+    """Main entry point after parsing command line arguments"""
+    parser = argparse.ArgumentParser(description="Record and collect telemetry of cluster jobs")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    parser_sample = subparsers.add_parser("sample", help="Sample the job, called by job script")
+    parser_sample.add_argument("--jobscript", required=True, help="Path to the job script")
+    parser_sample.add_argument("--pid", type=int, required=True, help="PID of the job script")
+    parser_sample.add_argument("--status-file", help="File with exit status written by job script")
+    parser_sample.add_argument(
+        "--interval",
+        type=float,
+        default=DEFAULT_INTERVAL,
+        help="Sampling interval in seconds, default: %s" % DEFAULT_INTERVAL,
+    )
+    parser_sample.add_argument("--output", help="Path to record, default: next to the log file")
+    parser_sample.set_defaults(func=run_sample)
+
+    parser_collect = subparsers.add_parser("collect", help="Collect records into TSV table")
+    parser_collect.add_argument(
+        "project_dir", nargs="?", default=".", help="Project or step directory, default: '.'"
+    )
+    parser_collect.add_argument(
+        "--output",
+        type=argparse.FileType("wt"),
+        default=sys.stdout,
+        help="Path to output TSV file, default: stdout",
+    )
+    parser_collect.set_defaults(func=run_collect)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
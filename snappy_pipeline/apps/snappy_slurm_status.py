@@ -1,25 +1,203 @@
 #!/usr/bin/env python
+"""Cluster status script for Snakemake on SLURM clusters
+
+Snakemake calls the script with the job ID as the last argument once per job and poll.  Instead
+of calling ``sacct`` for each job, the states of all known (and not yet finished) jobs are
+queried with one ``sacct`` call and stored in a state file shared by all calls of the script.
+Lookups within ``--ttl`` seconds are answered from the state file.  Jobs not yet known to the
+accounting database are looked up with one ``squeue`` call.  Jobs found by neither are reported as
+running for ``UNKNOWN_MAX_AGE`` seconds before they are reported as failed.  If ``sacct`` or
+``squeue`` fail (e.g., when throttled), the jobs that could not be resolved are reported as
+running and queried again in the next call.
+"""
+
+import argparse
+import json
+import os
 import subprocess
 import sys
+import time
 
+from fasteners import InterProcessLock
 
-def main(args):
-    jobid = args[1]
+__author__ = "Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>"
 
-    output = str(
-        subprocess.check_output(
-            "sacct -j %s --format State --noheader | head -1 | awk '{print $1}'" % jobid, shell=True
-        ).strip()
-    )
+#: Default path to the state file
+DEFAULT_STATE_FILE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "snappy_pipeline",
+    "slurm_status.json",
+)
+
+#: Default number of seconds that states of running jobs are reused
+DEFAULT_TTL = 30
+
+#: Number of seconds after which finished jobs are removed from the state file
+FINISHED_MAX_AGE = 24 * 60 * 60
+
+#: Number of seconds that jobs found by neither ``sacct`` nor ``squeue`` are reported as running
+UNKNOWN_MAX_AGE = 10 * 60
+
+#: SLURM job states that are reported as "running", including ``UNKNOWN`` for jobs not found yet
+RUNNING_STATES = ("PENDING", "CONFIGURING", "COMPLETING", "RUNNING", "SUSPENDED", "UNKNOWN")
+
+#: State of jobs not found within ``UNKNOWN_MAX_AGE``, reported as "failed"
+NOT_FOUND_STATE = "NOT_FOUND"
 
-    running_status = ["PENDING", "CONFIGURING", "COMPLETING", "RUNNING", "SUSPENDED"]
-    if "COMPLETED" in output:
-        print("success")
-    elif any(r in output for r in running_status):
-        print("running")
+#: SLURM job state that is reported as "success"
+SUCCESS_STATE = "COMPLETED"
+
+
+def to_snakemake_status(state):
+    """Return Snakemake status ``"success"``, ``"running"``, or ``"failed"`` for SLURM state
+
+    The state ``None`` of jobs that could not be resolved yet is reported as ``"running"``.
+    """
+    if state is None:
+        return "running"
+    elif state == SUCCESS_STATE:
+        return "success"
+    elif state in RUNNING_STATES or state.startswith("REQUEUE"):
+        return "running"
     else:
-        print("failed")
+        return "failed"
+
+
+def parse_states(output):
+    """Parse ``{job ID: state}`` from ``JobIDRaw|State`` lines of ``sacct``/``squeue``
+
+    Only the first line for each job is considered, job steps (e.g. ``123.batch``) are skipped.
+    Suffixes such as in ``CANCELLED by 1234`` are removed.
+    """
+    result = {}
+    for line in output.splitlines():
+        if "|" not in line:
+            continue
+        job_id, state = line.strip().split("|")[:2]
+        if "." in job_id or job_id in result or not state:
+            continue
+        result[job_id] = state.split()[0].rstrip("+")
+    return result
+
+
+class SlurmStatusCache:
+    """Job states of SLURM jobs, persisted to a JSON state file"""
+
+    def __init__(self, path, ttl=DEFAULT_TTL, sacct="sacct", squeue="squeue", clock=time.time):
+        #: Path to the state file
+        self.path = path
+        #: Number of seconds that the states of unfinished jobs are reused
+        self.ttl = ttl
+        #: Command for calling ``sacct``
+        self.sacct = sacct
+        #: Command for calling ``squeue``
+        self.squeue = squeue
+        #: Function returning the current time in seconds
+        self.clock = clock
+
+    def get_state(self, job_id):
+        """Return the SLURM state of the job with the given ID"""
+        job_id = str(job_id)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with InterProcessLock(self.path + ".lock"):
+            jobs = self._load()
+            now = self.clock()
+            entry = jobs.setdefault(job_id, {"state": None, "time": None})
+            if entry["state"] is None or (
+                not self._is_finished(entry["state"]) and now - entry["time"] >= self.ttl
+            ):
+                self._update(jobs, now)
+            self._save(jobs, now)
+            return jobs[job_id]["state"]
+
+    def _update(self, jobs, now):
+        """Query the states of all unfinished jobs, at most one ``sacct`` and ``squeue`` call
+
+        Nothing is updated if ``sacct`` fails.  If ``squeue`` fails, only the jobs found by
+        ``sacct`` are updated, the others keep their state until ``UNKNOWN_MAX_AGE``.
+        """
+        job_ids = sorted(k for k, v in jobs.items() if not self._is_finished(v["state"]))
+        output = self._call(
+            self.sacct, "-j", ",".join(job_ids), "-X", "-n", "-P", "-o", "JobIDRaw,State"
+        )
+        if output is None:
+            return
+        states = parse_states(output)
+        missing = [job_id for job_id in job_ids if job_id not in states]
+        resolved = True
+        if missing:
+            output = self._call(self.squeue, "-h", "-j", ",".join(missing), "-o", "%i|%T")
+            resolved = output is not None
+            states.update(parse_states(output or ""))
+        for job_id in job_ids:
+            if job_id in states:
+                jobs[job_id] = {"state": states[job_id], "time": now}
+            else:
+                # Not found (or ``squeue`` failed), remember since when to limit the grace period
+                since = jobs[job_id].get("since", now)
+                if now - since >= UNKNOWN_MAX_AGE:
+                    jobs[job_id] = {"state": NOT_FOUND_STATE, "time": now, "since": since}
+                elif resolved:
+                    jobs[job_id] = {"state": "UNKNOWN", "time": now, "since": since}
+                else:
+                    jobs[job_id]["since"] = since
+
+    def _call(self, *args):
+        """Return output of the command or ``None`` if it failed"""
+        try:
+            return subprocess.check_output(args, universal_newlines=True)
+        except (subprocess.CalledProcessError, OSError) as e:
+            print("Call of %s failed: %s" % (args[0], e), file=sys.stderr)
+            return None
+
+    def _is_finished(self, state):
+        return state is not None and to_snakemake_status(state) != "running"
+
+    def _load(self):
+        try:
+            with open(self.path, "rt") as inputf:
+                return json.load(inputf)["jobs"]
+        except (OSError, ValueError, KeyError):
+            return {}  # missing or broken state file
+
+    def _save(self, jobs, now):
+        jobs = {
+            job_id: entry
+            for job_id, entry in jobs.items()
+            if entry["time"] is None
+            or not self._is_finished(entry["state"])
+            or now - entry["time"] < FINISHED_MAX_AGE
+        }
+        path_tmp = self.path + ".tmp"
+        with open(path_tmp, "wt") as outputf:
+            json.dump({"jobs": jobs}, outputf)
+        os.replace(path_tmp, self.path)
+
+
+def main(argv=None):
+    """Main entry point after parsing command line arguments"""
+    parser = argparse.ArgumentParser(
+        description="Print Snakemake status of SLURM job (success, running, or failed)"
+    )
+    parser.add_argument(
+        "--state-file",
+        default=os.environ.get("SNAPPY_SLURM_STATUS_FILE", DEFAULT_STATE_FILE),
+        help="Path to file with the cached job states, default: %(default)s",
+    )
+    parser.add_argument(
+        "--ttl",
+        type=float,
+        default=DEFAULT_TTL,
+        help="Number of seconds to reuse the states of running jobs, default: %(default)s",
+    )
+    parser.add_argument("--sacct", default="sacct", help="Command to use for sacct")
+    parser.add_argument("--squeue", default="squeue", help="Command to use for squeue")
+    parser.add_argument("job_id", help="ID of the SLURM job")
+    args = parser.parse_args(argv)
+
+    cache = SlurmStatusCache(args.state_file, args.ttl, args.sacct, args.squeue)
+    print(to_snakemake_status(cache.get_state(args.job_id)))
 
 
 if __name__ == "__main__":
-    sys.exit(main(sys.argv))
+    sys.exit(main())
@@ -8,6 +8,8 @@ more convenient to wrap the call to snakemake itself.
 import argparse
 import datetime
 import functools
+import importlib
+import importlib.util
 import logging
 import os
 import subprocess
@@ -18,56 +20,21 @@ import ruamel.yaml as yaml
 from snakemake import main as snakemake_main
 
 from .. import __version__
-from ..workflows import (
-    cbioportal_export,
-    gene_expression_quantification,
-    gene_expression_report,
-    hla_typing,
-    igv_session_generation,
-    ngs_data_qc,
-    ngs_mapping,
-    ngs_sanity_checking,
-    panel_of_normals,
-    roh_calling,
-    somatic_gene_fusion_calling,
-    somatic_hla_loh_calling,
-    somatic_msi_calling,
-    somatic_neoepitope_prediction,
-    somatic_ngs_sanity_checking,
-    somatic_purity_ploidy_estimate,
-    somatic_targeted_seq_cnv_calling,
-    somatic_variant_annotation,
-    somatic_variant_calling,
-    somatic_variant_checking,
-    somatic_variant_expression,
-    somatic_variant_filtration,
-    somatic_variant_signatures,
-    somatic_wgs_cnv_calling,
-    somatic_wgs_sv_calling,
-    targeted_seq_cnv_annotation,
-    targeted_seq_cnv_calling,
-    targeted_seq_cnv_export,
-    tcell_crg_report,
-    variant_annotation,
-    variant_calling,
-    variant_checking,
-    variant_combination,
-    variant_denovo_filtration,
-    variant_export,
-    variant_filtration,
-    variant_phasing,
-    wgs_cnv_annotation,
-    wgs_cnv_calling,
-    wgs_cnv_export,
-    wgs_cnv_filtration,
-    wgs_mei_annotation,
-    wgs_mei_calling,
-    wgs_mei_filtration,
-    wgs_sv_annotation,
-    wgs_sv_calling,
-    wgs_sv_export,
-    wgs_sv_filtration,
+from ..base import (
+    BATCH_LINKS_ENV_VAR,
+    CONFIG_CACHE_ENV_VAR,
+    DEFAULT_JOB_GROUP_SIZE,
+    JOB_GROUPS_ENV_VAR,
+    LOCAL_RESOURCES_ENV_VAR,
+    RESOURCE_MODEL_ENV_VAR,
+    SCRATCH_ENV_VAR,
+    STAGE_INPUTS_ENV_VAR,
+    SUB_WORKFLOW_MANIFESTS_ENV_VAR,
+    TELEMETRY_ENV_VAR,
 )
+from ..profiling import start_dag_profiling, stop_dag_profiling
+from ..resource_model import DEFAULT_MARGIN
+from .snappy_job_telemetry import DEFAULT_INTERVAL
 
 __author__ = "Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>"
 
@@ -82,59 +49,71 @@ CONFIG_FILES = ("config.yaml", "config.json")
 #: Shell to use
 SHELL = "/bin/bash"
 
-#: Mapping from step name to module
+#: Mapping from step name to dotted path of the implementing module; the modules are only
+#: imported on demand with ``import_step_module()`` to keep the start up of the apps fast
 STEP_TO_MODULE = {
-    "gene_expression_quantification": gene_expression_quantification,
-    "gene_expression_report": gene_expression_report,
-    "cbioportal_export": cbioportal_export,
-    "hla_typing": hla_typing,
-    "igv_session_generation": igv_session_generation,
-    "ngs_mapping": ngs_mapping,
-    "ngs_data_qc": ngs_data_qc,
-    "panel_of_normals": panel_of_normals,
-    "ngs_sanity_checking": ngs_sanity_checking,
-    "roh_calling": roh_calling,
-    "somatic_gene_fusion_calling": somatic_gene_fusion_calling,
-    "somatic_hla_loh_calling": somatic_hla_loh_calling,
-    "somatic_msi_calling": somatic_msi_calling,
-    "somatic_neoepitope_prediction": somatic_neoepitope_prediction,
-    "somatic_ngs_sanity_checking": somatic_ngs_sanity_checking,
-    "somatic_purity_ploidy_estimate": somatic_purity_ploidy_estimate,
-    "somatic_targeted_seq_cnv_calling": somatic_targeted_seq_cnv_calling,
-    "somatic_variant_annotation": somatic_variant_annotation,
-    "somatic_variant_calling": somatic_variant_calling,
-    "somatic_variant_checking": somatic_variant_checking,
-    "somatic_variant_expression": somatic_variant_expression,
-    "somatic_variant_filtration": somatic_variant_filtration,
-    "somatic_variant_signatures": somatic_variant_signatures,
-    "somatic_wgs_cnv_calling": somatic_wgs_cnv_calling,
-    "somatic_wgs_sv_calling": somatic_wgs_sv_calling,
-    "targeted_seq_cnv_annotation": targeted_seq_cnv_annotation,
-    "targeted_seq_cnv_calling": targeted_seq_cnv_calling,
-    "targeted_seq_cnv_export": targeted_seq_cnv_export,
-    "tcell_crg_report": tcell_crg_report,
-    "variant_annotation": variant_annotation,
-    "variant_calling": variant_calling,
-    "variant_checking": variant_checking,
-    "variant_combination": variant_combination,
-    "variant_denovo_filtration": variant_denovo_filtration,
-    "variant_export": variant_export,
-    "variant_filtration": variant_filtration,
-    "variant_phasing": variant_phasing,
-    "wgs_cnv_annotation": wgs_cnv_annotation,
-    "wgs_cnv_calling": wgs_cnv_calling,
-    "wgs_cnv_export": wgs_cnv_export,
-    "wgs_cnv_filtration": wgs_cnv_filtration,
-    "wgs_mei_annotation": wgs_mei_annotation,
-    "wgs_mei_calling": wgs_mei_calling,
-    "wgs_mei_filtration": wgs_mei_filtration,
-    "wgs_sv_annotation": wgs_sv_annotation,
-    "wgs_sv_calling": wgs_sv_calling,
-    "wgs_sv_export": wgs_sv_export,
-    "wgs_sv_filtration": wgs_sv_filtration,
+    "gene_expression_quantification": "snappy_pipeline.workflows.gene_expression_quantification",
+    "gene_expression_report": "snappy_pipeline.workflows.gene_expression_report",
+    "cbioportal_export": "snappy_pipeline.workflows.cbioportal_export",
+    "hla_typing": "snappy_pipeline.workflows.hla_typing",
+    "igv_session_generation": "snappy_pipeline.workflows.igv_session_generation",
+    "ngs_mapping": "snappy_pipeline.workflows.ngs_mapping",
+    "ngs_data_qc": "snappy_pipeline.workflows.ngs_data_qc",
+    "panel_of_normals": "snappy_pipeline.workflows.panel_of_normals",
+    "ngs_sanity_checking": "snappy_pipeline.workflows.ngs_sanity_checking",
+    "roh_calling": "snappy_pipeline.workflows.roh_calling",
+    "somatic_gene_fusion_calling": "snappy_pipeline.workflows.somatic_gene_fusion_calling",
+    "somatic_hla_loh_calling": "snappy_pipeline.workflows.somatic_hla_loh_calling",
+    "somatic_msi_calling": "snappy_pipeline.workflows.somatic_msi_calling",
+    "somatic_neoepitope_prediction": "snappy_pipeline.workflows.somatic_neoepitope_prediction",
+    "somatic_ngs_sanity_checking": "snappy_pipeline.workflows.somatic_ngs_sanity_checking",
+    "somatic_purity_ploidy_estimate": "snappy_pipeline.workflows.somatic_purity_ploidy_estimate",
+    "somatic_targeted_seq_cnv_calling": "snappy_pipeline.workflows.somatic_targeted_seq_cnv_calling",
+    "somatic_variant_annotation": "snappy_pipeline.workflows.somatic_variant_annotation",
+    "somatic_variant_calling": "snappy_pipeline.workflows.somatic_variant_calling",
+    "somatic_variant_checking": "snappy_pipeline.workflows.somatic_variant_checking",
+    "somatic_variant_expression": "snappy_pipeline.workflows.somatic_variant_expression",
+    "somatic_variant_filtration": "snappy_pipeline.workflows.somatic_variant_filtration",
+    "somatic_variant_signatures": "snappy_pipeline.workflows.somatic_variant_signatures",
+    "somatic_wgs_cnv_calling": "snappy_pipeline.workflows.somatic_wgs_cnv_calling",
+    "somatic_wgs_sv_calling": "snappy_pipeline.workflows.somatic_wgs_sv_calling",
+    "targeted_seq_cnv_annotation": "snappy_pipeline.workflows.targeted_seq_cnv_annotation",
+    "targeted_seq_cnv_calling": "snappy_pipeline.workflows.targeted_seq_cnv_calling",
+    "targeted_seq_cnv_export": "snappy_pipeline.workflows.targeted_seq_cnv_export",
+    "tcell_crg_report": "snappy_pipeline.workflows.tcell_crg_report",
+    "variant_annotation": "snappy_pipeline.workflows.variant_annotation",
+    "variant_calling": "snappy_pipeline.workflows.variant_calling",
+    "variant_checking": "snappy_pipeline.workflows.variant_checking",
+    "variant_combination": "snappy_pipeline.workflows.variant_combination",
+    "variant_denovo_filtration": "snappy_pipeline.workflows.variant_denovo_filtration",
+    "variant_export": "snappy_pipeline.workflows.variant_export",
+    "variant_filtration": "snappy_pipeline.workflows.variant_filtration",
+    "variant_phasing": "snappy_pipeline.workflows.variant_phasing",
+    "wgs_cnv_annotation": "snappy_pipeline.workflows.wgs_cnv_annotation",
+    "wgs_cnv_calling": "snappy_pipeline.workflows.wgs_cnv_calling",
+    "wgs_cnv_export": "snappy_pipeline.workflows.wgs_cnv_export",
+    "wgs_cnv_filtration": "snappy_pipeline.workflows.wgs_cnv_filtration",
+    "wgs_mei_annotation": "snappy_pipeline.workflows.wgs_mei_annotation",
+    "wgs_mei_calling": "snappy_pipeline.workflows.wgs_mei_calling",
+    "wgs_mei_filtration": "snappy_pipeline.workflows.wgs_mei_filtration",
+    "wgs_sv_annotation": "snappy_pipeline.workflows.wgs_sv_annotation",
+    "wgs_sv_calling": "snappy_pipeline.workflows.wgs_sv_calling",
+    "wgs_sv_export": "snappy_pipeline.workflows.wgs_sv_export",
+    "wgs_sv_filtration": "snappy_pipeline.workflows.wgs_sv_filtration",
 }
 
 
+def import_step_module(step):
+    """Import and return the workflow module for the given ``step``"""
+    return importlib.import_module(STEP_TO_MODULE[step])
+
+
+def step_snakefile_path(step):
+    """Return absolute path to the Snakefile of the given ``step`` without importing the module"""
+    spec = importlib.util.find_spec(STEP_TO_MODULE[step])
+    return os.path.join(os.path.dirname(os.path.abspath(spec.origin)), "Snakefile")
+
+
 def setup_logging(args):
     """Setup logger."""
     logging.basicConfig(
@@ -152,6 +131,19 @@ def binary_available(name):
     return retcode == 0
 
 
+def physical_memory_mb():
+    """Return size of the physical memory in MB"""
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+
+
+def rule_group_size(value):
+    """Parse ``RULE=SIZE`` argument of ``--snappy-job-group``"""
+    rule, _, size = value.rpartition("=")
+    if not rule or not size.isdigit():
+        raise argparse.ArgumentTypeError("expected RULE=SIZE but got %r" % value)
+    return value
+
+
 def run(wrapper_args):
     """Launch the CUBI Pipeline wrapper for the given arguments"""
     # Setup logging
@@ -159,14 +151,39 @@ def run(wrapper_args):
 
     mamba_available = binary_available("mamba")
 
-    # Map from step to module
+    # Enable persistent configuration cache, also for the Snakemake processes of cluster jobs
+    if wrapper_args.snappy_config_cache:
+        os.environ[CONFIG_CACHE_ENV_VAR] = "1"
+    # Resolve paths into upstream steps with their output manifests instead of their DAG
+    if wrapper_args.snappy_sub_workflow_manifests:
+        os.environ[SUB_WORKFLOW_MANIFESTS_ENV_VAR] = "1"
+    # Link in and out with one local in-process job each instead of one job per file
+    if wrapper_args.snappy_batch_links:
+        os.environ[BATCH_LINKS_ENV_VAR] = "1"
+    # Predict memory and running time of the jobs from the benchmark files of earlier runs
+    if wrapper_args.snappy_resource_model:
+        os.environ[RESOURCE_MODEL_ENV_VAR] = str(wrapper_args.snappy_resource_model)
+    # Bundle the jobs of short-running rules into groups of cluster jobs
+    job_groups = wrapper_args.snappy_job_group_rules
+    if wrapper_args.snappy_job_groups:
+        job_groups = [str(wrapper_args.snappy_job_groups)] + job_groups
+    if job_groups:
+        os.environ[JOB_GROUPS_ENV_VAR] = ",".join(job_groups)
+    # Put TMPDIR of the cluster jobs on node-local scratch, optionally with copies of the inputs
+    if wrapper_args.snappy_scratch or wrapper_args.snappy_stage_inputs:
+        os.environ[SCRATCH_ENV_VAR] = wrapper_args.snappy_scratch or "auto"
+    if wrapper_args.snappy_stage_inputs:
+        os.environ[STAGE_INPUTS_ENV_VAR] = "1"
+    # Record CPU, memory, and I/O telemetry of the cluster jobs
+    if wrapper_args.snappy_telemetry:
+        os.environ[TELEMETRY_ENV_VAR] = str(wrapper_args.snappy_telemetry)
+
     # Build arguments for wrapped "snakemake" call and parse arguments
-    module = STEP_TO_MODULE[wrapper_args.step]
     snakemake_argv = [
         "--directory",
         wrapper_args.directory,
         "--snakefile",
-        os.path.join(os.path.dirname(os.path.abspath(module.__file__)), "Snakefile"),
+        step_snakefile_path(wrapper_args.step),
         # Force using job script for now that overrides the TMPDIR from the cluster scheduler
         "--jobscript",
         os.path.join(os.path.dirname(os.path.abspath(__file__)), "tpls", "jobscript.sh"),
@@ -197,6 +214,11 @@ def run(wrapper_args):
         snakemake_argv.append("--reason")
     if not wrapper_args.snappy_pipeline_use_drmaa:
         snakemake_argv += ["--cores", str(wrapper_args.cores or 1)]
+        # Schedule the local jobs by their memory from the cluster configuration as well
+        if wrapper_args.snappy_local_resources is not None:
+            os.environ[LOCAL_RESOURCES_ENV_VAR] = "1"
+            mem_mb = wrapper_args.snappy_local_resources or physical_memory_mb()
+            snakemake_argv += ["--resources", "mem_mb=%d" % mem_mb]
     if wrapper_args.use_conda:
         snakemake_argv.append("--use-conda")
         if mamba_available and wrapper_args.use_mamba:
@@ -240,7 +262,16 @@ def run(wrapper_args):
         snakemake_argv.append("--cleanup-metadata")
     snakemake_argv += wrapper_args.targets
     logging.info("Executing snakemake %s", " ".join(map(repr, snakemake_argv)))
-    return snakemake_main(snakemake_argv)
+    if not wrapper_args.snappy_profile_dag:
+        return snakemake_main(snakemake_argv)
+    # Snakemake builds the DAG in this process, so the profiler sees all calls
+    start_dag_profiling()
+    try:
+        return snakemake_main(snakemake_argv)
+    finally:
+        prefix = os.path.join(wrapper_args.directory, wrapper_args.snappy_profile_dag)
+        paths = stop_dag_profiling().write_report(prefix)
+        logging.info("Wrote DAG construction profile to %s", " and ".join(paths))
 
 
 def drmaa_available():
@@ -310,6 +341,19 @@ def main(argv=None):
         "-d", "--directory", default=os.getcwd(), help="Path to directory to run in, default is cwd"
     )
     group.add_argument("--cores", type=int, help="Number of cores to use for local processing")
+    group.add_argument(
+        "--snappy-local-resources",
+        metavar="MEM_MB",
+        type=int,
+        nargs="?",
+        const=0,
+        default=None,
+        help=(
+            "Use memory and number of tasks from the cluster configuration as resource 'mem_mb' "
+            "and threads of the local jobs and run at most MEM_MB (default: size of physical "
+            "memory) worth of jobs at the same time"
+        ),
+    )
     group.add_argument(
         "--unlock", action="store_true", default=False, help="Unlock working directory"
     )
@@ -422,6 +466,115 @@ def main(argv=None):
         choices=sorted(STEP_TO_MODULE.keys()),
         help="The type of the step to run",
     )
+    group.add_argument(
+        "--snappy-profile-dag",
+        metavar="PREFIX",
+        nargs="?",
+        const="snappy_profile_dag",
+        default=None,
+        help=(
+            "Profile the input, argument, and parameter functions called while building the DAG "
+            "and write report to PREFIX.tsv and PREFIX.json (relative to --directory), default "
+            "PREFIX is 'snappy_profile_dag'"
+        ),
+    )
+    group.add_argument(
+        "--snappy-config-cache",
+        action="store_true",
+        default=False,
+        help=(
+            "Persist the resolved and merged configuration to '.snappy_config_cache' in the "
+            "step directories for reuse by later runs and cluster jobs"
+        ),
+    )
+    group.add_argument(
+        "--snappy-sub-workflow-manifests",
+        action="store_true",
+        default=False,
+        help=(
+            "Resolve paths into upstream steps with the output manifests written after their "
+            "successful runs instead of building their DAG; steps without complete manifest "
+            "fall back to Snakemake sub workflows"
+        ),
+    )
+    group.add_argument(
+        "--snappy-batch-links",
+        action="store_true",
+        default=False,
+        help=(
+            "Create the symlinks for linking in raw data and linking out results with one local "
+            "job per step instead of one job per library or file"
+        ),
+    )
+    group.add_argument(
+        "--snappy-resource-model",
+        metavar="MARGIN",
+        type=float,
+        nargs="?",
+        const=DEFAULT_MARGIN,
+        default=None,
+        help=(
+            "Predict memory and running time of the jobs from the input sizes and benchmark "
+            "files of earlier jobs of the same rule and multiply with safety margin MARGIN "
+            "(default: %s) instead of using the static cluster configuration" % DEFAULT_MARGIN
+        ),
+    )
+    group.add_argument(
+        "--snappy-job-groups",
+        metavar="SIZE",
+        type=int,
+        nargs="?",
+        const=DEFAULT_JOB_GROUP_SIZE,
+        default=None,
+        help=(
+            "Bundle the jobs of short-running rules (e.g., statistics and reports) into groups of "
+            "SIZE jobs (default: %d) that are submitted as one cluster job each"
+            % DEFAULT_JOB_GROUP_SIZE
+        ),
+    )
+    group.add_argument(
+        "--snappy-job-group",
+        metavar="RULE=SIZE",
+        dest="snappy_job_group_rules",
+        type=rule_group_size,
+        action="append",
+        default=[],
+        help="Bundle the jobs of rule RULE into groups of SIZE cluster jobs, may be given "
+        "multiple times",
+    )
+    group.add_argument(
+        "--snappy-scratch",
+        metavar="DIR",
+        nargs="?",
+        const="auto",
+        default=None,
+        help=(
+            "Put TMPDIR of the cluster jobs into a directory on node-local scratch below DIR "
+            "(default: $SLURM_TMPDIR) that is removed at the end of the job"
+        ),
+    )
+    group.add_argument(
+        "--snappy-stage-inputs",
+        action="store_true",
+        default=False,
+        help=(
+            "Copy the BAM and CRAM input files of the cluster jobs together with their indices "
+            "to node-local scratch before running the job, implies --snappy-scratch"
+        ),
+    )
+    group.add_argument(
+        "--snappy-telemetry",
+        metavar="INTERVAL",
+        type=float,
+        nargs="?",
+        const=DEFAULT_INTERVAL,
+        default=None,
+        help=(
+            "Sample CPU, memory, and I/O of the cluster jobs every INTERVAL seconds (default: "
+            "%s) and write JSON records next to their log files, collect them with "
+            "snappy-job-telemetry collect" % DEFAULT_INTERVAL
+        ),
+    )
     group.add_argument(
         "--no-use-mamba",
         dest="use_mamba",
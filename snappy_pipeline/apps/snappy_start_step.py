@@ -22,7 +22,7 @@ from .impl.fsmanip import (
 )
 from .impl.logging import LVL_ERROR, LVL_IMPORTANT, LVL_SUCCESS, log
 from .impl.yaml_utils import remove_non_required, remove_yaml_comment_lines
-from .snappy_snake import STEP_TO_MODULE
+from .snappy_snake import STEP_TO_MODULE, import_step_module
 
 #: Allowed steps
 STEPS = tuple(sorted(STEP_TO_MODULE))
@@ -157,7 +157,7 @@ class StartStepApp:
         # Load default configuration, remove comment lines and lines not marked as required;
         # preserve comments
         default_config_yaml = yaml.round_trip_load(
-            remove_yaml_comment_lines(STEP_TO_MODULE[self.step].DEFAULT_CONFIG)
+            remove_yaml_comment_lines(import_step_module(self.step).DEFAULT_CONFIG)
         )
         only_required = remove_non_required(default_config_yaml)
         if only_required:
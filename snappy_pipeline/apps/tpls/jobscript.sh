@@ -1,9 +1,59 @@
 #!/bin/bash
 
-# Force-set TMPDIR for the BIH cluster
+# Clean up at the end of the job, also when it is cancelled or times out
+snappy_job_cleanup()
+{{
+    local status=$?
+    if [[ -n "$TELEMETRY_PID" ]]; then
+        echo $status >"$TELEMETRY_STATUS"
+        kill -TERM $TELEMETRY_PID
+        wait $TELEMETRY_PID
+        rm -f "$TELEMETRY_STATUS"
+    fi
+    if [[ -n "$SCRATCH_DIR" ]]; then
+        rm -rf "$SCRATCH_DIR"
+    fi
+}}
+trap snappy_job_cleanup EXIT
+trap 'exit 143' TERM
+trap 'exit 130' INT
+
 export OLD_TMPDIR=$TMPDIR
-export TMPDIR=$HOME/scratch/tmp/$HOSTNAME/$(date +%Y%m%d)
-mkdir -p $TMPDIR
+if [[ -n "$SNAPPY_PIPELINE_SCRATCH" ]]; then
+    # Put TMPDIR on node-local scratch: the configured directory or $SLURM_TMPDIR, falling
+    # back to the TMPDIR from the cluster scheduler
+    SCRATCH_BASE=$SNAPPY_PIPELINE_SCRATCH
+    if [[ "$SCRATCH_BASE" == auto ]]; then
+        SCRATCH_BASE=$SLURM_TMPDIR
+    fi
+    if [[ -z "$SCRATCH_BASE" ]]; then
+        SCRATCH_BASE=$OLD_TMPDIR
+    fi
+    mkdir -p "$SCRATCH_BASE"
+    SCRATCH_DIR=$(mktemp -d "$SCRATCH_BASE/snappy.XXXXXX") || exit 1
+    export TMPDIR=$SCRATCH_DIR
+    # Copy large input files to the scratch directory (see snappy_pipeline.staging)
+    if [[ "$SNAPPY_PIPELINE_STAGE_INPUTS" == 1 ]]; then
+        export SNAPPY_PIPELINE_STAGE_DIR=$SCRATCH_DIR/staged_inputs
+    fi
+else
+    # Force-set TMPDIR for the BIH cluster
+    export TMPDIR=$HOME/scratch/tmp/$HOSTNAME/$(date +%Y%m%d)
+    mkdir -p $TMPDIR
+fi
+
+# Sample CPU, memory, and I/O of the job (see snappy_pipeline.apps.snappy_job_telemetry); the
+# sampler starts with SIGTERM ignored until its handler is installed and also stops once the
+# status file has been written
+if [[ -n "$SNAPPY_PIPELINE_TELEMETRY" ]]; then
+    TELEMETRY_STATUS=$(mktemp)
+    (
+        trap '' TERM
+        exec snappy-job-telemetry sample --jobscript "$0" --pid $$ \
+            --status-file "$TELEMETRY_STATUS" --interval "$SNAPPY_PIPELINE_TELEMETRY"
+    ) &
+    TELEMETRY_PID=$!
+fi
 
 # Fix the umask.
 umask ug=rwx,o=
@@ -5,7 +5,10 @@
 from collections import OrderedDict
 from collections.abc import MutableMapping
 from copy import deepcopy
+import hashlib
+import json
 import os
+import pickle
 import sys
 import warnings
 
@@ -36,6 +39,173 @@ class UnknownFiltrationSourceException(Exception):
     """Raised when user try to request an unknown filtration source."""
 
 
+#: Environment variable that enables persisting the configuration cache when set to ``1``
+CONFIG_CACHE_ENV_VAR = "SNAPPY_PIPELINE_CONFIG_CACHE"
+
+#: File name of the persisted configuration cache, written into the step directory
+CONFIG_CACHE_FILE_NAME = ".snappy_config_cache"
+
+#: Environment variable that enables resolving sub workflow paths using the output manifests
+#: of the upstream steps when set to ``1``
+SUB_WORKFLOW_MANIFESTS_ENV_VAR = "SNAPPY_PIPELINE_SUB_WORKFLOW_MANIFESTS"
+
+#: Environment variable that enables linking in and out in batches when set to ``1``
+BATCH_LINKS_ENV_VAR = "SNAPPY_PIPELINE_BATCH_LINKS"
+
+#: Environment variable with the safety margin factor (e.g., ``1.5``) that enables predicting
+#: memory and running time of the jobs with the ``ResourceModel``
+RESOURCE_MODEL_ENV_VAR = "SNAPPY_PIPELINE_RESOURCE_MODEL"
+
+#: Environment variable that enables declaring memory and number of tasks from the cluster
+#: configuration as resources ``mem_mb`` and threads of the jobs when set to ``1``
+LOCAL_RESOURCES_ENV_VAR = "SNAPPY_PIPELINE_LOCAL_RESOURCES"
+
+#: Environment variable that enables bundling the jobs of short-running rules into groups of
+#: cluster jobs, see ``parse_job_groups()`` for the format
+JOB_GROUPS_ENV_VAR = "SNAPPY_PIPELINE_JOB_GROUPS"
+
+#: Default number of jobs per cluster job group
+DEFAULT_JOB_GROUP_SIZE = 20
+
+#: Environment variable that makes the job script put ``TMPDIR`` of the cluster jobs on
+#: node-local scratch, the value is the scratch directory or ``auto`` for ``$SLURM_TMPDIR``
+SCRATCH_ENV_VAR = "SNAPPY_PIPELINE_SCRATCH"
+
+#: Environment variable that makes the job script stage large input files to node-local scratch
+#: when set to ``1``
+STAGE_INPUTS_ENV_VAR = "SNAPPY_PIPELINE_STAGE_INPUTS"
+
+#: Environment variable with the staging directory, set by the job script in cluster jobs
+STAGE_DIR_ENV_VAR = "SNAPPY_PIPELINE_STAGE_DIR"
+
+#: Environment variable with the sampling interval in seconds that makes the job script record
+#: the telemetry of the cluster jobs
+TELEMETRY_ENV_VAR = "SNAPPY_PIPELINE_TELEMETRY"
+
+
+def parse_job_groups(value):
+    """Parse value of the ``SNAPPY_PIPELINE_JOB_GROUPS`` environment variable
+
+    The value is a comma-separated list of entries ``SIZE`` (group size for the rules marked as
+    short-running by the step parts) or ``RULE=SIZE`` (group size for the given rule).  Returns
+    ``(size, sizes)`` with the group size for the marked rules (``None`` if not given) and the
+    ``dict`` of group sizes by rule name.
+    """
+    size, sizes = None, {}
+    for entry in filter(None, (x.strip() for x in value.split(","))):
+        rule, sep, rule_size = entry.rpartition("=")
+        if sep:
+            sizes[rule] = int(rule_size)
+        else:
+            size = int(rule_size)
+    return size, sizes
+
+
+#: ``ConfigCache`` objects by path of the persisted cache file (``None`` for in-memory only)
+_CONFIG_CACHES = {}
+
+
+class ConfigCache:
+    """Content-addressed cache of resolved and merged configurations
+
+    The keys must contain hashes of all inputs of the computation (see ``hash_data()``).  Each
+    entry additionally records the hashes of the files it was computed from (e.g., the files
+    included with ``"$ref"``) and is recomputed when one of them changed.  The values are stored
+    pickled, so each lookup returns a fresh copy that the caller may modify.
+
+    When a ``path`` is given, the entries are loaded from and saved to this file, so they can be
+    reused by the Snakemake processes of cluster jobs and later runs.
+    """
+
+    #: Maximal number of entries to keep, the oldest ones are dropped first
+    max_entries = 64
+
+    def __init__(self, path=None):
+        #: Path to the persisted cache file, ``None`` for in-memory only
+        self.path = path
+        #: Entries ``(file hashes, pickled value)`` by key
+        self.entries = self._load()
+
+    def _load(self):
+        if self.path:
+            try:
+                with open(self.path, "rb") as f:
+                    entries = pickle.load(f)
+                if isinstance(entries, OrderedDict):
+                    return entries
+            except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+                pass  # no or unreadable cache file, will be overwritten
+        return OrderedDict()
+
+    def get(self, key, factory):
+        """Return value for ``key``, computed with ``factory()`` on cache misses
+
+        ``factory()`` must return a pair of the value and the paths of the files it depends on.
+        """
+        entry = self.entries.get(key)
+        if entry is not None and self._is_current(entry):
+            return pickle.loads(entry[1])
+        value, paths = factory()
+        self.entries[key] = (hash_files(paths), pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self._save()
+        return value
+
+    @staticmethod
+    def _is_current(entry):
+        """Return whether all files of ``entry`` are readable and unchanged"""
+        file_hashes = entry[0]
+        if any(digest is None for _, digest in file_hashes):
+            return False
+        return file_hashes == hash_files(path for path, _ in file_hashes)
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(self.entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass  # e.g., read-only directory, just recompute next time
+
+
+def get_config_cache(directory):
+    """Return ``ConfigCache`` for the step in ``directory``
+
+    The cache is only persisted into ``directory`` if the environment variable
+    ``SNAPPY_PIPELINE_CONFIG_CACHE`` is set to ``1``, otherwise it lives in memory only.
+    """
+    if os.environ.get(CONFIG_CACHE_ENV_VAR) == "1":
+        path = os.path.join(os.path.abspath(directory), CONFIG_CACHE_FILE_NAME)
+    else:
+        path = None
+    if path not in _CONFIG_CACHES:
+        _CONFIG_CACHES[path] = ConfigCache(path)
+    return _CONFIG_CACHES[path]
+
+
+def hash_data(data):
+    """Return SHA256 hex digest of the JSON-like ``data``, respecting the order of dict keys"""
+    dumped = json.dumps(data, default=repr, separators=(",", ":"))
+    return hashlib.sha256(dumped.encode("utf-8")).hexdigest()
+
+
+def hash_files(paths):
+    """Return tuple of pairs of path and SHA256 hex digest (``None`` if unreadable)"""
+    result = []
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                result.append((path, hashlib.sha256(f.read()).hexdigest()))
+        except OSError:
+            result.append((path, None))
+    return tuple(result)
+
+
 def expand_ref(config_path, dict_data, lookup_paths=None, dict_class=OrderedDict):
     """Expand "$ref" in JSON-like data ``dict_data``
 
@@ -44,8 +214,30 @@ def expand_ref(config_path, dict_data, lookup_paths=None, dict_class=OrderedDict
     - path to resolved file
     - paths containing included config files
     - config files included
+
+    The result is cached with ``ConfigCache`` and only recomputed when ``dict_data`` or one of
+    the included files changed.
     """
     lookup_paths = lookup_paths or [os.getcwd()]
+    key = (
+        "expand_ref",
+        os.path.abspath(config_path),
+        os.getcwd(),
+        tuple(lookup_paths),
+        dict_class.__name__,
+        hash_data(dict_data),
+    )
+
+    def factory():
+        result = _expand_ref(config_path, dict_data, lookup_paths, dict_class)
+        return result, result[2]
+
+    cache = get_config_cache(os.path.dirname(os.path.abspath(config_path)))
+    return cache.get(key, factory)
+
+
+def _expand_ref(config_path, dict_data, lookup_paths, dict_class):
+    """Implementation of ``expand_ref()`` without caching"""
     resolver = RefResolver(lookup_paths=lookup_paths, dict_class=dict_class)
     # Perform resolution
     resolved = resolver.resolve("file://" + config_path, dict_data)
@@ -3,16 +3,23 @@
 """
 
 from collections import OrderedDict
-from fnmatch import fnmatch
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from fnmatch import translate
+from functools import lru_cache
 import json
 import logging
 import os
+import re
 import sys
+import zlib
 
 from fasteners import InterProcessLock
 
 __author__ = "Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>"
 
+#: Magic first line of the crawler cache files
+CACHE_MAGIC = b"snappy-path-cache\n"
+
 
 class FileNamesTooDifferent(Exception):
     """Raised when two file names are too different to be PE reads"""
@@ -82,32 +89,156 @@ class FileSystemCrawlerResult:
         return str(self)
 
 
+@lru_cache(maxsize=None)
+def _compile_pattern(pattern):
+    """Return ``match`` function of regular expression equivalent to the glob ``pattern``"""
+    return re.compile(translate(pattern)).match
+
+
+def _join_rel(root_dir, rel_dir):
+    """Join ``root_dir`` and the relative path ``rel_dir`` which may be empty"""
+    return os.path.join(root_dir, rel_dir) if rel_dir else root_dir
+
+
+def _try_getmtime(path):
+    """Return modification time of ``path`` or ``None`` if it does not exist"""
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def _drop_sub_tree(rel_dir, files_by_dir, dir_mtimes):
+    """Remove entries for ``rel_dir`` and all directories below from the dicts"""
+
+    def in_sub_tree(d):
+        return not rel_dir or d == rel_dir or d.startswith(rel_dir + "/")
+
+    for d in list(filter(in_sub_tree, dir_mtimes)):
+        dir_mtimes.pop(d)
+    for d in list(filter(in_sub_tree, files_by_dir)):
+        files_by_dir.pop(d)
+
+
+def _ancestor_ids(root_dir, rel_dir):
+    """Return ``frozenset`` of ``(st_dev, st_ino)`` pairs of ``root_dir`` and the directories
+    between ``root_dir`` and ``rel_dir`` below it, i.e., the ancestors of ``rel_dir`` in a walk
+    from ``root_dir``
+
+    Directories that cannot be accessed are ignored.
+    """
+    result = set()
+    parts = rel_dir.split("/") if rel_dir else []
+    for i in range(len(parts)):
+        try:
+            stat = os.stat(_join_rel(root_dir, "/".join(parts[:i])))
+        except OSError:
+            continue
+        result.add((stat.st_dev, stat.st_ino))
+    return frozenset(result)
+
+
+def _scan_dir(path, ancestors):
+    """List directory ``path`` for ``walk_dirs()``
+
+    Returns ``None`` if ``path`` cannot be listed or is one of ``ancestors`` (given as set of
+    ``(st_dev, st_ino)`` pairs), i.e., reached through a symlink cycle.  Otherwise, returns tuple
+    ``(path, mtime, file_names, sub_dir_names, ancestors)`` with ``path`` added to ``ancestors``.
+    """
+    try:
+        stat = os.stat(path)
+        if (stat.st_dev, stat.st_ino) in ancestors:
+            return None
+        files, sub_dirs = [], []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()  # follows symlinks
+                except OSError:
+                    is_dir = False
+                (sub_dirs if is_dir else files).append(entry.name)
+    except OSError:
+        return None  # ignore as os.walk() does
+    return path, stat.st_mtime, files, sub_dirs, ancestors | {(stat.st_dev, stat.st_ino)}
+
+
+def walk_dirs(top, num_threads=1, ancestors=frozenset()):
+    """Crawl directory ``top`` recursively, following symlinks
+
+    Directories are listed with ``os.scandir()`` using a pool of ``num_threads`` threads, which
+    helps on network file systems where crawling is bound by metadata latency.  Directories
+    reached through symlink cycles are skipped, including cycles to the ``ancestors`` of ``top``
+    (given as set of ``(st_dev, st_ino)`` pairs) when continuing an outer crawl.  Returns list of
+    ``(dir_path, mtime, file_names)`` tuples sorted by ``dir_path``.
+    """
+    result = []
+    with ThreadPoolExecutor(max_workers=max(1, num_threads)) as executor:
+        pending = {executor.submit(_scan_dir, top, ancestors)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                scanned = future.result()
+                if scanned is None:
+                    continue
+                path, mtime, files, sub_dirs, ancestors = scanned
+                result.append((path, mtime, files))
+                for name in sub_dirs:
+                    pending.add(executor.submit(_scan_dir, os.path.join(path, name), ancestors))
+    return sorted(result)
+
+
 class FileSystemCrawler:
     """Crawl the file system
 
     - start crawling the file system from a given directory
     - look for files matching a given ``PatternSet``
     - that are below a directory with a given name
+
+    The cache stores the paths of all files below each root directory together with the
+    modification times of all directories.  When the cache is older than any of the
+    ``invalidation_paths``, only the directories whose modification time changed are crawled
+    again instead of dropping the whole cache.
+
+    The cache file starts with ``CACHE_MAGIC`` and a JSON header line with the offset and length
+    of the compressed entry of each root directory.  Entries are only read and decompressed when
+    their root directory is queried.
     """
 
-    cache_version = 1
+    cache_version = 3
 
-    def __init__(self, cache_path, invalidation_paths, lock_timeout=60):
+    def __init__(self, cache_path, invalidation_paths, lock_timeout=60, num_threads=1):
         #: The logger to use.
         self.logger = logging.getLogger("file_crawler")
-        #: Path to cache (will be stored in JSON format)
+        #: Path to cache file
         self.cache_path = cache_path
         #: Path to files to use for checking invalidation.
         self.invalidation_paths = invalidation_paths
         #: The actual dict with the cache, loaded from path to ``cache_path`` if the cache file
-        #: exists.
+        #: exists.  Only contains the root directories used so far.
         self.cache = None
+        #: Offset and length of the compressed cache entries in ``cache_file`` of root directories
+        #: not used so far
+        self.blobs = {}
+        #: Cache file as loaded, kept open for reading ``blobs`` even if replaced in the meantime
+        self.cache_file = None
         #: Flag whether cache has been modified and needs saving
         self.cache_dirty = False
+        #: Root directories whose cache entries have been modified and need saving
+        self.dirty_root_dirs = set()
+        #: Flag whether the cache has been saved already
+        self.cache_saved = False
         #: Flag whether cache has been invalidated already.
         self.cache_invalidated = False
+        #: Root directories that must be checked for changed directories before their next use.
+        self.stale_root_dirs = set()
         #: Timeout for obtaining file system lock on the file system
         self.lock_timeout = lock_timeout
+        #: Number of threads to use for crawling directories
+        self.num_threads = num_threads
+        #: In-memory index of the cached paths for each root directory, maps each path component
+        #: to the list of ``(path, idx)`` pairs with ``idx`` being the component's first position.
+        #: Built lazily on first query of a root directory and not persisted.
+        self.path_index = {}
         if os.path.exists(self.cache_path):
             self.cache_invalidated = False
             self.cache = self._load_cache()
@@ -118,7 +249,16 @@ class FileSystemCrawler:
         """Set cache to a fresh state."""
         self.cache_invalidated = True
         self.cache_dirty = True
-        self.cache = {"cache_version": self.__class__.cache_version, "root_dirs": {}}
+        self.cache = {
+            "cache_version": self.__class__.cache_version,
+            "root_dirs": {},
+            "dir_mtimes": {},
+        }
+        self.stale_root_dirs = set()
+        self.dirty_root_dirs = set()
+        self.blobs = {}
+        self._close_cache_file()
+        self.path_index = {}
 
     def run(self, root_dir, dir_name, pattern_sets, allow_empty_right):
         """Perform the file system crawling from a root directory given a query pattern set
@@ -128,31 +268,38 @@ class FileSystemCrawler:
         """
         matches = {}  # path => pattern set idx => pattern idx => [path]
         returned = 0  # from {0, 1, 2}; how many patterns matched?
-        # Invalidate cache fully if the cache file is older than any one of self.invalidation_paths
+        # Mark cache as stale if the cache file is older than any one of self.invalidation_paths
         self._perform_cache_invalidation()
-        # Ensure that cache entry with crawling results of all files exists
+        # Ensure that cache entry with crawling results of all files exists and is up to date
+        self._load_root_dir(root_dir)
         if root_dir not in self.cache["root_dirs"]:
-            self.cache_dirty = True
-            self.cache["root_dirs"][root_dir] = tuple(sorted(self._build_cache(root_dir)))
-        # Now, crawl over this structure and match against all pattern sets
+            self._build_cache(root_dir)
+        elif root_dir in self.stale_root_dirs:
+            self._update_cache(root_dir)
+        self.stale_root_dirs.discard(root_dir)
+        # Now, look up the paths below dir_name in the index and match against all pattern sets
         self.logger.debug('Crawling "%s" for dir_name "%s"', root_dir, dir_name)
         for i, pattern_set in enumerate(pattern_sets):
             self.logger.debug("  patterns in pattern set #%d: %s", i, pattern_set.patterns)
-        for path in self.cache["root_dirs"][root_dir]:
-            if dir_name not in path:
-                continue
-            idx = path.index(dir_name)
-            left, right = path[: idx + 1], path[idx + 1 :]
-            for i, pattern_set in enumerate(pattern_sets):
-                for j, pattern in enumerate(pattern_set.patterns):
-                    does_match = fnmatch("/".join(right), pattern)
+        compiled = [
+            [_compile_pattern(pattern) for pattern in pattern_set.patterns]
+            for pattern_set in pattern_sets
+        ]
+        for path, idx in self._get_path_index(root_dir).get(dir_name, ()):
+            left, right = "/".join(path[: idx + 1]), "/".join(path[idx + 1 :])
+            for i, matchers in enumerate(compiled):
+                for j, matcher in enumerate(matchers):
+                    does_match = matcher(right) is not None
                     self.logger.debug(
-                        'does "%s" match "%s" match? => %s', "/".join(right), pattern, does_match
+                        'does "%s" match "%s" match? => %s',
+                        right,
+                        pattern_sets[i].patterns[j],
+                        does_match,
                     )
                     if does_match:
-                        matches.setdefault("/".join(left), {}).setdefault(i, {}).setdefault(
-                            j, []
-                        ).append("/".join(right))
+                        matches.setdefault(left, {}).setdefault(i, {}).setdefault(j, []).append(
+                            right
+                        )
         # Go over results and check whether they are conforming.
         for path, path_matches in matches.items():
             for set_idx, set_matches in path_matches.items():
@@ -196,6 +343,25 @@ class FileSystemCrawler:
                         base_path, files, pattern_sets[set_idx].names[:returned]
                     )
 
+    def _get_path_index(self, root_dir):
+        """Return index from path component to ``(path, idx)`` pairs for ``root_dir``
+
+        The index is built once per root directory, such that a lookup only costs the number of
+        paths below the directory of the given name rather than the number of all cached paths.
+        """
+        if root_dir not in self.path_index:
+            self.logger.debug("Building file system crawler index for %s", root_dir)
+            index = {}
+            for path in self.cache["root_dirs"][root_dir]:
+                path = tuple(path)
+                seen = set()
+                for idx, component in enumerate(path):
+                    if component not in seen:
+                        seen.add(component)
+                        index.setdefault(component, []).append((path, idx))
+            self.path_index[root_dir] = index
+        return self.path_index[root_dir]
+
     def _perform_cache_invalidation(self):
         """Check whether the cache needs to be invalidated and do so if necessary."""
         if self.cache_invalidated:
@@ -208,7 +374,8 @@ class FileSystemCrawler:
             path_mtime = os.path.getmtime(path)
             if path_mtime > cache_ctime:
                 self.logger.info("Invalidating cache because of %s", path)
-                self._set_fresh_cache()
+                self.cache_invalidated = True
+                self.stale_root_dirs = set(self.cache["root_dirs"]) | set(self.blobs)
                 return
         self.logger.debug(" => no, not invalidating cache")
 
@@ -231,29 +398,239 @@ class FileSystemCrawler:
                     )
 
     def _build_cache(self, root_dir):
+        """Crawl all of ``root_dir`` and store the result in the cache"""
         self.logger.info("Building file system crawler cache from %s", root_dir)
-        for root, _, files in os.walk(root_dir, followlinks=True):
+        files_by_dir = {}
+        dir_mtimes = {}
+        self._walk_into(root_dir, "", files_by_dir, dir_mtimes)
+        self._store_root_dir(root_dir, files_by_dir, dir_mtimes)
+
+    def _update_cache(self, root_dir):
+        """Crawl the directories below ``root_dir`` whose modification time changed
+
+        Only the changed directories are listed again.  Sub directories that appeared are crawled
+        completely and the cache entries of sub directories that disappeared are removed.  Root
+        directories without stored modification times (e.g., from a version 1 cache) are crawled
+        completely.
+        """
+        if root_dir not in self.cache["dir_mtimes"]:
+            self._build_cache(root_dir)
+            return
+        self.logger.debug("Checking for changed directories below %s", root_dir)
+        dir_mtimes = dict(self.cache["dir_mtimes"][root_dir])
+        changed = [
+            rel_dir
+            for rel_dir, mtime in dir_mtimes.items()
+            if _try_getmtime(_join_rel(root_dir, rel_dir)) != mtime
+        ]
+        if not changed:
+            return  # nothing to do
+        files_by_dir = {}
+        for path in self.cache["root_dirs"][root_dir]:
+            files_by_dir.setdefault("/".join(path[:-1]), []).append(path[-1])
+        for rel_dir in sorted(changed):
+            if rel_dir not in dir_mtimes:
+                continue  # removed together with a parent directory before
+            self.logger.info("Updating file system crawler cache for %s", rel_dir or root_dir)
+            full_dir = _join_rel(root_dir, rel_dir)
+            scanned = _scan_dir(full_dir, _ancestor_ids(root_dir, rel_dir))
+            if scanned is None:
+                _drop_sub_tree(rel_dir, files_by_dir, dir_mtimes)
+                continue
+            _, dir_mtimes[rel_dir], files_by_dir[rel_dir], names, _ = scanned
+            sub_dirs = {os.path.join(rel_dir, name) for name in names}
+            old_sub_dirs = {d for d in dir_mtimes if d != rel_dir and os.path.dirname(d) == rel_dir}
+            for sub_dir in old_sub_dirs - sub_dirs:
+                _drop_sub_tree(sub_dir, files_by_dir, dir_mtimes)
+            for sub_dir in sorted(sub_dirs - old_sub_dirs):
+                self._walk_into(root_dir, sub_dir, files_by_dir, dir_mtimes)
+        self._store_root_dir(root_dir, files_by_dir, dir_mtimes)
+
+    def _walk_into(self, root_dir, rel_dir, files_by_dir, dir_mtimes):
+        """Crawl ``rel_dir`` below ``root_dir``, store files and directory modification times
+
+        Symlink cycles to the directories between ``root_dir`` and ``rel_dir`` are skipped as in
+        a crawl of ``root_dir``.
+        """
+        top = _join_rel(root_dir, rel_dir)
+        ancestors = _ancestor_ids(root_dir, rel_dir)
+        for root, mtime, files in walk_dirs(top, self.num_threads, ancestors):
             self.logger.debug("Caching for directory %s", root)
-            base = root[len(root_dir) + 1 :].split("/") or ["."]
-            yield from (tuple(base + [f]) for f in files)
+            key = root[len(root_dir) + 1 :]
+            files_by_dir[key] = files
+            dir_mtimes[key] = mtime
+
+    def _store_root_dir(self, root_dir, files_by_dir, dir_mtimes):
+        """Store crawling result for ``root_dir`` in the cache and mark it as dirty"""
+        self.cache_dirty = True
+        self.dirty_root_dirs.add(root_dir)
+        self.cache["root_dirs"][root_dir] = tuple(
+            sorted(
+                tuple(key.split("/") + [f]) for key, files in files_by_dir.items() for f in files
+            )
+        )
+        self.cache["dir_mtimes"][root_dir] = dir_mtimes
+        self.path_index.pop(root_dir, None)
 
     def save_cache(self, cache_path=None):
-        """Save cache, ``cache_path`` overriding ``self.cache_path``"""
+        """Save cache, ``cache_path`` overriding ``self.cache_path``
+
+        Root directories written by other processes since loading the cache are kept.  The cache
+        file is replaced atomically, such that only writing requires the inter-process lock.
+        """
         if not (self.cache_dirty or self.cache_invalidated):
             return  # don't save if unchanged
+        if self.cache_saved and not self.dirty_root_dirs:
+            return  # no change since last save
         cache_path = cache_path or self.cache_path
         with InterProcessLock(self.cache_path + ".lock"):
             self.logger.debug("Saving file system crawler cache to %s", cache_path)
-            with open(cache_path, "wt") as f:
-                json.dump(self.cache, f)
+            disk_file, disk_blobs, disk_stale = None, {}, set()
+            if os.path.exists(cache_path):
+                disk_file = open(cache_path, "rb")
+                header, blobs, stale = self._read_cache_header(disk_file)
+                if header is not None:  # else legacy JSON cache, migrated on loading
+                    disk_blobs, disk_stale = blobs, stale
+            try:
+                blobs = {}
+                stale = set()
+                for root_dir in sorted(
+                    set(disk_blobs) | set(self.blobs) | set(self.cache["root_dirs"])
+                ):
+                    if root_dir in self.dirty_root_dirs:
+                        blobs[root_dir] = self._encode_root_dir(root_dir)
+                    elif root_dir in disk_blobs:
+                        blobs[root_dir] = self._read_blob(disk_file, disk_blobs[root_dir])
+                        if root_dir in disk_stale:
+                            stale.add(root_dir)
+                    elif root_dir in self.blobs:
+                        blobs[root_dir] = self._read_blob(self.cache_file, self.blobs[root_dir])
+                    else:
+                        blobs[root_dir] = self._encode_root_dir(root_dir)
+                    if root_dir in self.stale_root_dirs:
+                        # Root directories not queried since invalidation must be checked next time
+                        stale.add(root_dir)
+            finally:
+                if disk_file is not None:
+                    disk_file.close()
+            header = {"cache_version": self.__class__.cache_version, "root_dirs": {}}
+            offset = 0
+            for root_dir, blob in blobs.items():
+                header["root_dirs"][root_dir] = [offset, len(blob), root_dir in stale]
+                offset += len(blob)
+            tmp_path = cache_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(CACHE_MAGIC)
+                f.write(json.dumps(header).encode("utf-8") + b"\n")
+                for blob in blobs.values():
+                    f.write(blob)
+            os.replace(tmp_path, cache_path)
+        self.cache_saved = True
+        self.dirty_root_dirs = set()
+
+    def _encode_root_dir(self, root_dir):
+        """Return compressed cache entry for ``root_dir``"""
+        entry = {
+            "paths": ["/".join(path) for path in self.cache["root_dirs"][root_dir]],
+            "dir_mtimes": self.cache["dir_mtimes"].get(root_dir),
+        }
+        return zlib.compress(json.dumps(entry).encode("utf-8"))
+
+    def _load_root_dir(self, root_dir):
+        """Decompress the cache entry for ``root_dir`` if it has not been used yet"""
+        if root_dir not in self.blobs:
+            return
+        self.logger.debug("Loading file system crawler cache for %s", root_dir)
+        blob = self._read_blob(self.cache_file, self.blobs.pop(root_dir))
+        if not self.blobs:
+            self._close_cache_file()
+        entry = json.loads(zlib.decompress(blob).decode("utf-8"))
+        self.cache["root_dirs"][root_dir] = tuple(tuple(p.split("/")) for p in entry["paths"])
+        if entry["dir_mtimes"] is not None:
+            self.cache["dir_mtimes"][root_dir] = entry["dir_mtimes"]
+
+    @classmethod
+    def _read_cache_header(cls, f):
+        """Read header of the cache file ``f`` opened in binary mode
+
+        Returns triple with the header ``dict``, a ``dict`` with the offset and length of the
+        compressed cache entry for each root directory in ``f``, and the ``set`` of stale root
+        directories.  Only the header is read, the entries are read with ``_read_blob()``.  The
+        header is ``None`` for legacy JSON cache files.
+        """
+        if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+            return None, {}, set()
+        line = f.readline()
+        if not line.endswith(b"\n"):
+            raise ValueError("Invalid cache file {}".format(f.name))  # pragma: no cover
+        header = json.loads(line.decode("utf-8"))
+        start = len(CACHE_MAGIC) + len(line)
+        blobs = {}
+        stale = set()
+        for root_dir, (offset, length, is_stale) in header["root_dirs"].items():
+            blobs[root_dir] = (start + offset, length)
+            if is_stale:
+                stale.add(root_dir)
+        return header, blobs, stale
+
+    @staticmethod
+    def _read_blob(f, location):
+        """Return compressed cache entry at ``location``, pair of offset and length, in ``f``"""
+        offset, length = location
+        f.seek(offset)
+        blob = f.read(length)
+        if len(blob) != length:
+            raise ValueError("Truncated cache file {}".format(f.name))  # pragma: no cover
+        return blob
+
+    def _close_cache_file(self):
+        """Close ``self.cache_file`` if open"""
+        if self.cache_file is not None:
+            self.cache_file.close()
+            self.cache_file = None
 
     def _load_cache(self):
-        with InterProcessLock(self.cache_path + ".lock"):
-            self.logger.info("Loading file system crawler cache from %s", self.cache_path)
-            with open(self.cache_path, "rt") as f:
-                result = json.loads(f.read(), object_pairs_hook=OrderedDict)
-        if result["cache_version"] != self.__class__.cache_version:
+        """Load the cache header; the cache entries are read and decompressed on first use"""
+        self.logger.info("Loading file system crawler cache from %s", self.cache_path)
+        f = open(self.cache_path, "rb")
+        header, blobs, stale = self._read_cache_header(f)
+        if header is None:
+            with f:
+                f.seek(0)
+                return self._migrate_cache_json(json.load(f, object_pairs_hook=OrderedDict))
+        if header["cache_version"] != self.__class__.cache_version:
+            f.close()
             raise ValueError(  # pragma: no cover
-                "Invalid cache version {}".format(result["cache_version"])
+                "Invalid cache version {}".format(header["cache_version"])
             )
-        return result
+        if blobs:
+            self.cache_file = f
+        else:
+            f.close()
+        self.blobs = blobs
+        self.stale_root_dirs = stale
+        return {"cache_version": header["cache_version"], "root_dirs": {}, "dir_mtimes": {}}
+
+    def _migrate_cache_json(self, cache):
+        """Migrate version 1 or 2 cache in JSON format to the current version
+
+        Version 1 caches did not store directory modification times, such that the root
+        directories will be crawled completely on the next invalidation.
+        """
+        if cache["cache_version"] not in (1, 2):
+            raise ValueError(  # pragma: no cover
+                "Invalid cache version {}".format(cache["cache_version"])
+            )
+        self.logger.info(
+            "Migrating file system crawler cache from version %d", cache["cache_version"]
+        )
+        self.cache_dirty = True
+        self.stale_root_dirs = set(cache.get("stale_root_dirs", ()))
+        self.dirty_root_dirs = set(cache["root_dirs"])
+        return {
+            "cache_version": self.__class__.cache_version,
+            "root_dirs": {
+                root_dir: tuple(map(tuple, paths)) for root_dir, paths in cache["root_dirs"].items()
+            },
+            "dir_mtimes": cache.get("dir_mtimes", {}),
+        }
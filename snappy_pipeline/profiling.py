@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""Profiling of the functions called by Snakemake while building the job DAG
+
+When enabled (e.g., through ``snappy-snake --snappy-profile-dag``), ``BaseStep`` wraps the
+functions returned from ``get_input_files()``, ``get_args()``, and ``get_params()`` such that
+call counts and cumulative wall-clock time are recorded for each step part and action.  At the
+end, a report sorted by the time spent is written as TSV and JSON file.
+"""
+
+from collections import OrderedDict
+import functools
+import json
+import time
+
+__author__ = "Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>"
+
+#: Header of the TSV report
+REPORT_HEADER = (
+    "step",
+    "step_part",
+    "action",
+    "function",
+    "calls",
+    "repeated_calls",
+    "cache_hits",
+    "total_seconds",
+    "mean_seconds",
+)
+
+#: The currently active ``DagProfiler``, ``None`` if profiling is disabled
+_active_profiler = None
+
+
+class DagProfilerRecord:
+    """Counters for one wrapped function"""
+
+    def __init__(self, step, step_part, action, function):
+        #: Name of the workflow step
+        self.step = step
+        #: Name of the step part
+        self.step_part = step_part
+        #: Name of the action
+        self.action = action
+        #: Name of the ``BaseStep`` function that returned the wrapped function
+        self.function = function
+        #: Number of calls
+        self.calls = 0
+        #: Number of calls with wildcards that the function was called with before already
+        self.repeated_calls = 0
+        #: Number of cache hits (e.g., in ``LinkInPathGenerator``) recorded during the calls
+        self.cache_hits = 0
+        #: Cumulative wall-clock time spent in the calls
+        self.total_seconds = 0.0
+        #: Wildcards seen so far
+        self.seen_wildcards = set()
+
+    def to_dict(self):
+        """Return ``OrderedDict`` with the values for the report"""
+        return OrderedDict(
+            (
+                ("step", self.step),
+                ("step_part", self.step_part),
+                ("action", self.action),
+                ("function", self.function),
+                ("calls", self.calls),
+                ("repeated_calls", self.repeated_calls),
+                ("cache_hits", self.cache_hits),
+                ("total_seconds", self.total_seconds),
+                ("mean_seconds", self.total_seconds / self.calls if self.calls else 0.0),
+            )
+        )
+
+
+class DagProfiler:
+    """Collect timings of the input, argument, and parameter functions"""
+
+    def __init__(self, clock=time.perf_counter):
+        #: Function returning the current time in seconds
+        self.clock = clock
+        #: Records by ``(step, step_part, action, function)``
+        self.records = OrderedDict()
+        #: Stack of the records of the currently running wrapped functions
+        self.stack = []
+
+    def wrap(self, step, step_part, action, function, func):
+        """Return wrapper of ``func`` that records its calls
+
+        The wrapper uses ``functools.wraps()`` so Snakemake still sees the signature of ``func``
+        when deciding which auxiliary parameters (e.g., ``input`` or ``threads``) to pass.
+        """
+        key = (step, step_part, action, function)
+        if key not in self.records:
+            self.records[key] = DagProfilerRecord(*key)
+        record = self.records[key]
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            wildcards_key = _wildcards_key(args)
+            if wildcards_key in record.seen_wildcards:
+                record.repeated_calls += 1
+            else:
+                record.seen_wildcards.add(wildcards_key)
+            self.stack.append(record)
+            start = self.clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record.total_seconds += self.clock() - start
+                record.calls += 1
+                self.stack.pop()
+
+        return wrapper
+
+    def record_cache_hit(self):
+        """Record a cache hit for the innermost currently running wrapped function"""
+        if self.stack:
+            self.stack[-1].cache_hits += 1
+
+    def get_report(self):
+        """Return list of ``OrderedDict`` objects, sorted by decreasing total time"""
+        records = sorted(
+            self.records.values(), key=lambda r: (-r.total_seconds, -r.calls, r.step_part)
+        )
+        return [record.to_dict() for record in records]
+
+    def write_report(self, prefix):
+        """Write report to ``{prefix}.tsv`` and ``{prefix}.json``, return the paths"""
+        report = self.get_report()
+        path_tsv = prefix + ".tsv"
+        with open(path_tsv, "wt") as outf:
+            print("\t".join(REPORT_HEADER), file=outf)
+            for entry in report:
+                print("\t".join(_format_value(entry[key]) for key in REPORT_HEADER), file=outf)
+        path_json = prefix + ".json"
+        with open(path_json, "wt") as outf:
+            json.dump(report, outf, indent=2)
+            print(file=outf)
+        return path_tsv, path_json
+
+
+def _wildcards_key(args):
+    """Return hashable key for the wildcards (first positional argument) of a call"""
+    if not args:
+        return None
+    try:
+        return tuple(args[0].items())
+    except (AttributeError, TypeError):
+        return repr(args[0])
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return "%.6f" % value
+    else:
+        return str(value)
+
+
+def start_dag_profiling(**kwargs):
+    """Enable DAG profiling and return the new active ``DagProfiler``"""
+    global _active_profiler
+    _active_profiler = DagProfiler(**kwargs)
+    return _active_profiler
+
+
+def stop_dag_profiling():
+    """Disable DAG profiling and return the previously active ``DagProfiler``"""
+    global _active_profiler
+    result, _active_profiler = _active_profiler, None
+    return result
+
+
+def get_dag_profiler():
+    """Return active ``DagProfiler`` or ``None`` if DAG profiling is disabled"""
+    return _active_profiler
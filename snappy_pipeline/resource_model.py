@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""History-based model of the memory and running time requirements of the rules
+
+When enabled (e.g., through ``snappy-snake --snappy-resource-model``), ``BaseStep`` asks the
+``ResourceModel`` for the memory and running time of each job instead of using the static
+values from ``update_cluster_config()``.  The model records the total input size of the jobs
+together with the path to their benchmark file (see ``BaseStepPart.get_benchmark_file()``) in a
+history file in the step directory.  On later runs, the maximal RSS and wall-clock time from the
+benchmark files of the finished jobs are fitted linearly against the input size for each rule.
+The prediction for a job is the fitted value plus the largest positive residual, multiplied with
+a safety margin.  Rules with too few records keep their static values.
+"""
+
+from collections import OrderedDict
+import os
+
+__author__ = "Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>"
+
+#: Name of the history file in the step directory
+HISTORY_FILE_NAME = ".snappy_resource_history.tsv"
+
+#: Default safety margin factor
+DEFAULT_MARGIN = 1.5
+
+#: Minimal number of finished jobs of a rule for fitting the model
+MIN_RECORDS = 3
+
+#: Minimal memory in MB to predict
+MIN_MEM_MB = 256
+
+#: Minimal running time in seconds to predict
+MIN_SECONDS = 5 * 60
+
+
+def read_benchmark_file(path):
+    """Return list of ``dict`` objects with the ``float`` values of the benchmark file's rows
+
+    Missing values (``-`` or ``NA``) are not included in the ``dict`` objects.
+    """
+    with open(path, "rt") as inputf:
+        lines = [line.rstrip("\n").split("\t") for line in inputf if line.strip()]
+    if not lines:
+        return []
+    header, rows = lines[0], lines[1:]
+    result = []
+    for row in rows:
+        record = {}
+        for key, value in zip(header, row):
+            try:
+                record[key] = float(value)
+            except ValueError:
+                pass  # missing value or "h:m:s"
+        result.append(record)
+    return result
+
+
+def fit_linear(xs, ys):
+    """Return ``(intercept, slope, max_residual)`` of least squares fit of ``ys`` against ``xs``
+
+    Falls back to a constant model if all ``xs`` are equal.
+    """
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    if var_x:
+        slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x
+    else:
+        slope = 0.0
+    intercept = mean_y - slope * mean_x
+    max_residual = max(y - (intercept + slope * x) for x, y in zip(xs, ys))
+    return intercept, slope, max(max_residual, 0.0)
+
+
+def parse_time(value):
+    """Return number of seconds for cluster configuration time (``[D-]H:MM[:SS]``)"""
+    days, _, value = str(value).rpartition("-")
+    parts = [int(x) for x in value.split(":")] + [0]
+    return int(days or 0) * 86400 + parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+
+def format_time(seconds):
+    """Return ``H:MM:SS`` string for the number of seconds"""
+    seconds = int(seconds + 0.5)
+    return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class ResourceModel:
+    """Predict memory and running time of jobs from the benchmark files of earlier jobs"""
+
+    def __init__(self, work_dir, margin=DEFAULT_MARGIN, min_records=MIN_RECORDS):
+        #: Directory of the step, benchmark paths are relative to it
+        self.work_dir = work_dir
+        #: Safety margin factor for the predictions
+        self.margin = margin
+        #: Minimal number of finished jobs for fitting a rule
+        self.min_records = min_records
+        #: Path to the history file
+        self.history_path = os.path.join(work_dir, HISTORY_FILE_NAME)
+        #: Static cluster configuration values by rule name and key (``"mem"``/``"time"``)
+        self.fallback = {}
+        #: ``(rule name, input bytes)`` by benchmark file path, loaded on first use
+        self._history = None
+        #: Whether there are records that have not been written to the history file yet
+        self._dirty = False
+        #: Fits by rule name and key, ``None`` if the rule has too few records
+        self._fits = {}
+
+    def set_fallback(self, rule, key, value):
+        """Register static cluster configuration value of the rule"""
+        self.fallback.setdefault(rule, {})[key] = value
+
+    def get_fallback(self, rule, key):
+        """Return static value of the rule, falls back to the ``"__default__"`` rule"""
+        result = self.fallback.get(rule, {}).get(key)
+        if result is None:
+            result = self.fallback.get("__default__", {}).get(key)
+        return result
+
+    def get_history(self):
+        """Return ``OrderedDict`` mapping benchmark path to ``(rule name, input bytes)``"""
+        if self._history is None:
+            self._history = OrderedDict()
+            if os.path.exists(self.history_path):
+                with open(self.history_path, "rt") as inputf:
+                    for line in inputf:
+                        arr = line.rstrip("\n").split("\t")
+                        if len(arr) == 3 and arr[2].isdigit():
+                            self._history[arr[1]] = (arr[0], int(arr[2]))
+        return self._history
+
+    def add_record(self, rule, benchmark, input_bytes):
+        """Record the input size of the job with the given benchmark file"""
+        history = self.get_history()
+        if history.get(benchmark) != (rule, input_bytes):
+            history[benchmark] = (rule, input_bytes)
+            self._dirty = True
+
+    def save_history(self):
+        """Write history file if there are new records"""
+        if not self._dirty:
+            return
+        path_tmp = self.history_path + ".tmp"
+        with open(path_tmp, "wt") as outputf:
+            for benchmark, (rule, input_bytes) in self.get_history().items():
+                print("\t".join((rule, benchmark, str(input_bytes))), file=outputf)
+        os.replace(path_tmp, self.history_path)
+        self._dirty = False
+
+    def get_fit(self, rule, key):
+        """Return ``(intercept, slope, max_residual)`` for the rule and key or ``None``
+
+        The key is ``"mem"`` (MB, from ``max_rss``) or ``"time"`` (seconds, from ``s``).
+        """
+        if rule not in self._fits:
+            self._fits[rule] = self._fit_rule(rule)
+        return self._fits[rule].get(key)
+
+    def _fit_rule(self, rule):
+        points = {"mem": ([], []), "time": ([], [])}
+        for benchmark, (record_rule, input_bytes) in self.get_history().items():
+            path = os.path.join(self.work_dir, benchmark)
+            if record_rule != rule or not os.path.exists(path):
+                continue
+            runs = read_benchmark_file(path)
+            for key, column in (("mem", "max_rss"), ("time", "s")):
+                values = [run[column] for run in runs if column in run]
+                if values:
+                    points[key][0].append(input_bytes)
+                    points[key][1].append(max(values))
+        return {
+            key: fit_linear(xs, ys)
+            for key, (xs, ys) in points.items()
+            if len(xs) >= self.min_records
+        }
+
+    def predict(self, rule, key, input_bytes):
+        """Return predicted memory in MB (``int``) or time (``H:MM:SS``), static value if no fit"""
+        fit = self.get_fit(rule, key)
+        if fit is None or input_bytes is None:
+            return self.get_fallback(rule, key)
+        intercept, slope, max_residual = fit
+        value = (intercept + slope * input_bytes + max_residual) * self.margin
+        if key == "mem":
+            return max(int(value + 0.5), MIN_MEM_MB)
+        else:
+            return format_time(max(value, MIN_SECONDS))
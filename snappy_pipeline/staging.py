@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Staging of large input files to node-local scratch in cluster jobs
+
+When enabled (e.g., through ``snappy-snake --snappy-stage-inputs``), the job script creates a
+directory on node-local scratch and exports its path in the environment variable
+``SNAPPY_PIPELINE_STAGE_DIR``.  The Snakemake process of the cluster job then evaluates the input
+functions of the rules again, and ``BaseStep.get_input_files()`` replaces the paths to BAM and
+CRAM files by paths to local copies, together with their indices.  The job script removes the
+directory when the job ends.
+"""
+
+import functools
+import os
+import shutil
+
+__author__ = "Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>"
+
+#: Suffixes of the input files to stage
+STAGED_SUFFIXES = (".bam", ".cram")
+
+#: Suffixes of the index files that are copied along with the input files
+INDEX_SUFFIXES = {".bam": (".bam.bai", ".bai", ".bam.csi"), ".cram": (".cram.crai", ".crai")}
+
+
+def get_staged_path(path, stage_dir):
+    """Return path of the local copy of ``path`` in ``stage_dir``
+
+    The absolute path is mirrored below ``stage_dir`` so the file name is kept and files with
+    the same name in different directories do not collide.
+    """
+    return os.path.join(stage_dir, os.path.abspath(path).lstrip(os.sep))
+
+
+def get_index_paths(path):
+    """Return paths to the index files of the BAM or CRAM file at ``path`` that exist"""
+    for suffix, index_suffixes in INDEX_SUFFIXES.items():
+        if path.endswith(suffix):
+            stem = path[: -len(suffix)]
+            return [stem + x for x in index_suffixes if os.path.exists(stem + x)]
+    return []
+
+
+def stage_file(path, stage_dir):
+    """Copy the file at ``path`` and its index files to ``stage_dir``, return path of the copy
+
+    Paths without staged suffix and paths to files that do not exist are returned unchanged.
+    Files copied before (with the same size) are not copied again.
+    """
+    if not str(path).endswith(STAGED_SUFFIXES) or not os.path.exists(path):
+        return path  # keep flags of Snakemake's path objects
+    path = str(path)
+    for src_path in [path] + get_index_paths(path):
+        dest_path = get_staged_path(src_path, stage_dir)
+        if os.path.exists(dest_path) and os.path.getsize(dest_path) == os.path.getsize(src_path):
+            continue
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        shutil.copy2(src_path, dest_path + ".tmp")  # copy atomically
+        os.replace(dest_path + ".tmp", dest_path)
+    return get_staged_path(path, stage_dir)
+
+
+def stage_files(value, stage_dir):
+    """Return ``value`` (path, list or ``dict`` of paths) with paths replaced by local copies"""
+    if isinstance(value, dict):
+        return {key: stage_files(entry, stage_dir) for key, entry in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [stage_files(entry, stage_dir) for entry in value]
+    elif isinstance(value, str):
+        return stage_file(value, stage_dir)
+    else:
+        return value
+
+
+def wrap_input_function(func, stage_dir):
+    """Return wrapper of input function ``func`` that stages the input files to ``stage_dir``"""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return stage_files(func(*args, **kwargs), stage_dir)
+
+    return wrapper
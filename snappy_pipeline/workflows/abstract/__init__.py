@@ -4,16 +4,21 @@
 from collections import OrderedDict
 from collections.abc import MutableMapping
 from fnmatch import fnmatch
-from functools import lru_cache
+from functools import lru_cache, partial
+import hashlib
 from io import StringIO
 import itertools
+import json
+import logging
 import os
 import os.path
+import pickle
+import re
 import sys
 
+import biomedsheets
 from biomedsheets import io_tsv
 from biomedsheets.io import SheetBuilder, json_loads_ordered
-from biomedsheets.models import SecondaryIDNotFoundException
 from biomedsheets.naming import NAMING_SCHEMES, NAMING_SECONDARY_ID_PK, name_generator_for_scheme
 from biomedsheets.ref_resolver import RefResolver
 from biomedsheets.shortcuts import (
@@ -22,17 +27,29 @@ from biomedsheets.shortcuts import (
     write_pedigrees_to_ped,
 )
 import ruamel.yaml as yaml
-from snakemake.io import touch
+from snakemake.io import regex, touch
 
 from snappy_pipeline.base import (
+    BATCH_LINKS_ENV_VAR,
+    JOB_GROUPS_ENV_VAR,
+    LOCAL_RESOURCES_ENV_VAR,
+    RESOURCE_MODEL_ENV_VAR,
+    STAGE_DIR_ENV_VAR,
+    SUB_WORKFLOW_MANIFESTS_ENV_VAR,
     MissingConfiguration,
+    get_config_cache,
+    hash_data,
     merge_dicts,
     merge_kwargs,
+    parse_job_groups,
     print_config,
     print_sample_sheets,
     snakefile_path,
 )
 from snappy_pipeline.find_file import FileSystemCrawler, PatternSet
+from snappy_pipeline.profiling import get_dag_profiler
+from snappy_pipeline.resource_model import ResourceModel, format_time, parse_time
+from snappy_pipeline.staging import wrap_input_function
 from snappy_pipeline.utils import dictify, listify
 
 #: String constant with bash command for redirecting stderr to ``{log}`` file
@@ -59,6 +76,10 @@ class BaseStepPart:
 
     name = "<base step>"
 
+    #: Actions whose jobs only run for a short time, these can be bundled into groups of cluster
+    #: jobs (see ``get_bundled_rules()``)
+    bundle_actions = ()
+
     def __init__(self, parent):
         self.name = self.__class__.name
         self.parent = parent
@@ -104,6 +125,30 @@ class BaseStepPart:
                 "Log file name generation not implemented!"
             )  # pragma: no cover
 
+    def get_benchmark_file(self, action):
+        """Return path to benchmark file
+
+        The default implementation derives the path from the one returned by
+        ``self.get_log_file()`` (the ``"log"`` entry in the case of a ``dict``) by replacing the
+        ``.log`` suffix with ``.{step_part}.{action}.benchmark.txt``.
+        """
+        log_file = self.get_log_file(action)
+        if isinstance(log_file, dict):
+            log_file = log_file.get("log") or next(iter(log_file.values()))
+        if log_file.endswith(".log"):
+            log_file = log_file[: -len(".log")]
+        return "{}.{}.{}.benchmark.txt".format(log_file, self.name, action)
+
+    def get_bundled_rules(self):
+        """Return names of the rules whose jobs can be bundled into groups of cluster jobs
+
+        The default implementation returns ``{step}_{step_part}_{action}`` for the actions in
+        ``self.bundle_actions``, override if the rules are named differently.
+        """
+        return [
+            "{}_{}_{}".format(self.parent.name, self.name, action) for action in self.bundle_actions
+        ]
+
     def get_shell_cmd(self, action, wildcards):  # NOSONAR
         """Return shell command for the given action of the sub step and the given wildcards"""
         raise ImplementationUnavailableError(
@@ -205,11 +250,35 @@ class WritePedigreeStepPart(BaseStepPart):
             )
 
 
+def symlink_files(pairs):
+    """Create relative symlinks for the ``(src_path, link_path)`` pairs in this process
+
+    This is equivalent to ``mkdir -p $(dirname link_path) && { test -h link_path || ln -sr
+    src_path link_path; }`` for each pair but without spawning processes.  Existing symlinks are
+    kept.  Returns number of created symlinks.
+    """
+    real_dirs = {}  # created directories with their real paths
+    result = 0
+    for src_path, link_path in pairs:
+        dirname = os.path.dirname(link_path) or "."
+        if dirname not in real_dirs:
+            os.makedirs(dirname, exist_ok=True)
+            real_dirs[dirname] = os.path.realpath(dirname)
+        if os.path.islink(link_path):
+            continue
+        os.symlink(os.path.relpath(os.path.realpath(src_path), real_dirs[dirname]), link_path)
+        result += 1
+    return result
+
+
 class LinkOutStepPart(BaseStepPart):
     """Generically link out
 
     This is for output files that are created unconditionally, i.e., for output files where the
     output name is the same as for the work file.
+
+    Besides the per-file ``"run"`` action, the ``"batch"`` action links out all result files of
+    the step matching the output pattern at once, see ``BaseStep.use_batch_links``.
     """
 
     name = "link_out"
@@ -223,9 +292,27 @@ class LinkOutStepPart(BaseStepPart):
         #: specialized link out step part, e.g., for the case of alignment where realignment is
         #: performed or not, depending on the configuration.
         self.disable_patterns = list(disable_patterns or [])
+        #: Pairs of work and output path for the ``"batch"`` action, built on first use
+        self._batch_pairs = None
+
+    def get_batch_pairs(self):
+        """Return list of ``(work path, output path)`` pairs for linking out all result files"""
+        if self._batch_pairs is None:
+            pattern = re.compile(regex(self.base_pattern_out))
+            self._batch_pairs = []
+            for path in OrderedDict.fromkeys(self.parent.get_result_files()):
+                match = pattern.match(path)
+                if not match:
+                    continue
+                path_in = self.base_path_in.format(**match.groupdict())
+                if not any(fnmatch(path_in, disabled) for disabled in self.disable_patterns):
+                    self._batch_pairs.append((path_in, path))
+        return self._batch_pairs
 
     def get_input_files(self, action):
         """Return input file pattern"""
+        if action == "batch":
+            return [path_in for path_in, _ in self.get_batch_pairs()]
 
         def input_function(wildcards):
             """Helper wrapper function"""
@@ -240,6 +327,8 @@ class LinkOutStepPart(BaseStepPart):
 
     def get_output_files(self, action):
         """Return output file pattern"""
+        if action == "batch":
+            return [path_out for _, path_out in self.get_batch_pairs()]
         assert action == "run", "Unsupported action"
         return self.base_pattern_out
 
@@ -251,6 +340,11 @@ class LinkOutStepPart(BaseStepPart):
         out = self.base_path_out.replace("{", "{wildcards.")
         return tpl.format(in_=in_, out=out)
 
+    def run(self, action, wildcards):
+        """Link out all result files in this process for the ``"batch"`` action"""
+        assert action == "batch", "Unsupported action"
+        symlink_files(self.get_batch_pairs())
+
 
 @lru_cache()
 def _cached_read_cancer_tsv_sheet(path_abs, path_rel, naming_scheme):
@@ -279,6 +373,171 @@ def _cached_yaml_round_trip_load_str(str_value):
     return yaml.round_trip_load(StringIO(str_value))
 
 
+#: Objects of the persistent sheet caches loaded so far, by cache file path and key
+_SHEET_CACHE_ENTRIES = {}
+
+
+class SheetCacheFile:
+    """Persistent cache of objects parsed from a sample sheet file
+
+    The objects (the ``Sheet`` and its shortcut sheets) are pickled into a hidden file next to
+    the sheet file.  The cache is keyed by the hash of the sheet file's contents, the biomedsheets
+    version, and the parameters used for parsing, such that parsing is only repeated after one
+    of them changed.  Within a process, the objects are shared between all users of a cache file.
+    """
+
+    def __init__(self, path, key):
+        #: Path to the cache file
+        self.path = path
+        #: Key for validating the cache file contents
+        self.key = key
+        #: The cached objects, by name
+        self.entries = self._load()
+
+    @classmethod
+    def for_sheet(cls, sheet_path, params):
+        """Return cache for the sheet file at ``sheet_path`` parsed with ``params``
+
+        Returns ``None`` for sheets with references to other files as changes in these cannot be
+        detected.
+        """
+        with open(sheet_path, "rb") as f:
+            contents = f.read()
+        if b'"$ref"' in contents:
+            return None
+        path = os.path.join(
+            os.path.dirname(sheet_path), ".{}.snappy_cache".format(os.path.basename(sheet_path))
+        )
+        key = (hashlib.sha256(contents).hexdigest(), biomedsheets.__version__) + tuple(params)
+        return cls(path, key)
+
+    def _load(self):
+        if (self.path, self.key) not in _SHEET_CACHE_ENTRIES:
+            entries = {}
+            try:
+                with open(self.path, "rb") as f:
+                    key, loaded = pickle.load(f)
+                if key == self.key:
+                    entries = loaded
+            except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+                pass  # no or unreadable cache file, will be overwritten
+            _SHEET_CACHE_ENTRIES[(self.path, self.key)] = entries
+        return _SHEET_CACHE_ENTRIES[(self.path, self.key)]
+
+    def get(self, name, factory):
+        """Return object ``name``, create with ``factory()`` and save cache if missing"""
+        if name not in self.entries:
+            self.entries[name] = factory()
+            self._save()
+        return self.entries[name]
+
+    def _save(self):
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump((self.key, self.entries), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass  # e.g., read-only sheet directory, just parse again next time
+
+
+class OutputManifest:
+    """Machine-readable list of the result files of a step with their modification times
+
+    The manifest is written as JSON file into the step directory after each successful run and
+    allows downstream steps to resolve paths into the step without building its DAG (see
+    ``ManifestSubWorkflow``).
+    """
+
+    #: Name of the manifest file in the step directory
+    file_name = ".snappy_output_manifest.json"
+
+    #: Version of the manifest file format
+    manifest_version = 1
+
+    def __init__(self, step, files, complete):
+        #: Name of the step
+        self.step = step
+        #: Modification times of the existing result files, by path relative to step directory
+        self.files = files
+        #: Whether all result files existed when writing the manifest
+        self.complete = complete
+
+    @classmethod
+    def from_result_files(cls, step, result_files, directory="."):
+        """Build manifest for the given result file paths relative to ``directory``"""
+        files = OrderedDict()
+        complete = True
+        for path in result_files:
+            try:
+                files[path] = os.path.getmtime(os.path.join(directory, path))
+            except OSError:
+                complete = False
+        return cls(step, files, complete)
+
+    @classmethod
+    def load(cls, directory):
+        """Load manifest from ``directory``, return ``None`` if missing or unreadable"""
+        try:
+            with open(os.path.join(directory, cls.file_name), "rt") as f:
+                data = json.load(f)
+            if data["manifest_version"] != cls.manifest_version:
+                return None
+            return cls(data["step"], data["files"], data["complete"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, directory):
+        """Write manifest into ``directory``"""
+        path = os.path.join(directory, self.file_name)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wt") as f:
+            json.dump(
+                OrderedDict(
+                    (
+                        ("manifest_version", self.manifest_version),
+                        ("step", self.step),
+                        ("complete", self.complete),
+                        ("files", self.files),
+                    )
+                ),
+                f,
+                indent=1,
+            )
+        os.replace(tmp_path, path)
+
+
+class ManifestSubWorkflow:
+    """Resolve paths into an upstream step using its ``OutputManifest``
+
+    Replacement for the function that ``workflow.subworkflow()`` registers.  The paths are made
+    absolute as Snakemake does, but Snakemake does not load the upstream Snakefile or build its
+    DAG, so the upstream step is not checked for being up to date.
+    """
+
+    def __init__(self, name, workdir, manifest):
+        #: Name of the sub workflow
+        self.name = name
+        #: Absolute path to the step directory of the sub workflow
+        self.workdir = workdir
+        #: The ``OutputManifest`` of the sub workflow
+        self.manifest = manifest
+        #: Paths that were requested but are not listed in the manifest
+        self.unknown_paths = set()
+        #: The logger to use
+        self.logger = logging.getLogger("manifest_sub_workflow")
+
+    def __call__(self, paths):
+        if isinstance(paths, str):
+            if paths not in self.manifest.files and paths not in self.unknown_paths:
+                self.unknown_paths.add(paths)
+                self.logger.warning(
+                    "Path %s not in output manifest of sub workflow %s", paths, self.name
+                )
+            return os.path.join(self.workdir, paths)
+        return [self(path) for path in paths]
+
+
 class DataSetInfo:
     """Information on a DataSet"""
 
@@ -359,6 +618,8 @@ class DataSetInfo:
         self.naming_scheme = naming_scheme
         #: Whether or not mixing SE and PE data sets is allowed.
         self.mixed_se_pe = mixed_se_pe
+        #: Persistent cache of the objects parsed from the sheet, ``None`` if not cacheable
+        self.sheet_cache = None
         #: The BioMed SampleSheet
         self.sheet = self._load_sheet()
         #: The UUID of the corresponding SODAR project.
@@ -377,40 +638,26 @@ class DataSetInfo:
                 continue
             if self.sheet_path.endswith(".tsv"):
                 if self.sheet_type == "matched_cancer":
-                    return self._set_is_background(
-                        _cached_read_cancer_tsv_sheet(fname, self.sheet_path, self.naming_scheme),
-                        self.is_background,
-                    )
+                    read_sheet = _cached_read_cancer_tsv_sheet
                 elif self.sheet_type == "germline_variants":
-                    return self._set_is_background(
-                        _cached_read_germline_tsv_sheet(fname, self.sheet_path, self.naming_scheme),
-                        self.is_background,
-                    )
+                    read_sheet = _cached_read_germline_tsv_sheet
                 elif self.sheet_type == "generic":
-                    return self._set_is_background(
-                        _cached_read_generic_tsv_sheet(fname, self.sheet_path, self.naming_scheme),
-                        self.is_background,
-                    )
+                    read_sheet = _cached_read_generic_tsv_sheet
                 else:
                     raise ValueError("Invalid sheet type {}".format(self.sheet_type))
+                read_sheet = partial(read_sheet, fname, self.sheet_path, self.naming_scheme)
             elif self.sheet_path.endswith(".json"):
-                with open(fname, "rt") as f:
-                    sheet_json = json_loads_ordered(f.read())
-                resolver = RefResolver(
-                    lookup_paths=os.path.dirname(os.path.abspath(self.sheet_path)),
-                    dict_class=OrderedDict,
-                )
-                resolved_json = resolver.resolve("file://" + self.sheet_path, sheet_json)
-                return self._set_is_background(
-                    SheetBuilder(resolved_json).run(
-                        name_generator=name_generator_for_scheme(self.naming_scheme)
-                    ),
-                    self.is_background,
-                )
+                read_sheet = partial(self._read_json_sheet, fname)
             else:
                 raise ValueError(  # pragma: no cover
                     "Invalid sheet file type of {}".format(self.sheet_path)
                 )
+            self.sheet_cache = SheetCacheFile.for_sheet(
+                fname, (self.sheet_type, self.naming_scheme, self.is_background)
+            )
+            return self._get_cached(
+                "sheet", lambda: self._set_is_background(read_sheet(), self.is_background)
+            )
         # Raise problem if we could not find the sample sheet
         raise ValueError(  # pragma: no cover
             "Could not find sample sheet file {} in the lookup paths {}".format(
@@ -418,6 +665,35 @@ class DataSetInfo:
             )
         )
 
+    def _read_json_sheet(self, fname):
+        """Read and resolve JSON sheet from ``fname``"""
+        with open(fname, "rt") as f:
+            sheet_json = json_loads_ordered(f.read())
+        resolver = RefResolver(
+            lookup_paths=os.path.dirname(os.path.abspath(self.sheet_path)),
+            dict_class=OrderedDict,
+        )
+        resolved_json = resolver.resolve("file://" + self.sheet_path, sheet_json)
+        return SheetBuilder(resolved_json).run(
+            name_generator=name_generator_for_scheme(self.naming_scheme)
+        )
+
+    def _get_cached(self, name, factory):
+        """Return object ``name`` from ``self.sheet_cache``, create with ``factory`` if missing"""
+        if self.sheet_cache is None:
+            return factory()
+        return self.sheet_cache.get(name, factory)
+
+    def get_shortcut_sheet(self, klass, args, kwargs):
+        """Return shortcut sheet ``klass(self.sheet, *args, **kwargs)``
+
+        The shortcut sheet is stored in the persistent sheet cache.
+        """
+        name = "shortcut:{}.{}:{!r}:{!r}".format(
+            klass.__module__, klass.__qualname__, tuple(args), sorted(kwargs.items())
+        )
+        return self._get_cached(name, lambda: klass(self.sheet, *args, **kwargs))
+
     @classmethod
     def _set_is_background(cls, sheet, flag):
         """Override "is_background" flag"""
@@ -498,6 +774,19 @@ class BaseStep:
         self.config = self.w_config["step_config"].get(self.name, OrderedDict())
         #: Cluster configuration dict
         self.cluster_config = cluster_config
+        #: ``ResourceModel`` for predicting the memory and running time of the jobs, enabled by
+        #: setting environment variable ``SNAPPY_PIPELINE_RESOURCE_MODEL`` to the safety margin
+        self.resource_model = None
+        if os.environ.get(RESOURCE_MODEL_ENV_VAR):
+            margin = float(os.environ[RESOURCE_MODEL_ENV_VAR])
+            self.resource_model = ResourceModel(self.work_dir, margin)
+            self._register_resource_model()
+        if os.environ.get(LOCAL_RESOURCES_ENV_VAR) == "1":
+            self._register_local_resources()
+        #: Number of jobs per cluster job group by rule name, set up in
+        #: ``register_sub_step_classes()`` if environment variable ``SNAPPY_PIPELINE_JOB_GROUPS``
+        #: is set
+        self.job_groups = {}
         #: Paths with configuration paths, important for later retrieving sample sheet files
         self.config_lookup_paths = config_lookup_paths
         self.sub_steps = {}
@@ -516,16 +805,51 @@ class BaseStep:
         #: Shortcut sheets
         self.shortcut_sheets = []
         klass = self.__class__.sheet_shortcut_class
-        for sheet, kwargs in zip(self.sheets, sheet_kwargs_list):
+        for info, kwargs in zip(self.data_set_infos, sheet_kwargs_list):
             kwargs = kwargs or {}
             kwargs = {k: v for k, v in kwargs.items() if k in klass.supported_kwargs}
             self.shortcut_sheets.append(
-                klass(sheet, *(self.__class__.sheet_shortcut_args or []), **kwargs)
+                info.get_shortcut_sheet(klass, self.__class__.sheet_shortcut_args or [], kwargs)
             )
         # Setup onstart/onerror/onsuccess hooks
         self._setup_hooks()
         #: Functions from sub workflows, can be used to generate output paths into these workflows
         self.sub_workflows = {}
+        #: ``LinkInPathGenerator`` shared by all step parts, created on first use
+        self._link_in_path_generator = None
+        #: Index from NGS library name to its ``folderName`` extra info (``None`` if missing)
+        self.ngs_library_to_folder_name = build_ngs_library_folder_name_index(self.sheets)
+        #: Whether the Snakefile should link in and out with one in-process job each (the
+        #: ``"batch"`` actions of ``LinkInStep`` and ``LinkOutStepPart``) instead of one shell
+        #: job per library or file, enabled with environment variable
+        #: ``SNAPPY_PIPELINE_BATCH_LINKS=1``.  The rules are defined in ``batch_links.rules``.
+        self.use_batch_links = os.environ.get(BATCH_LINKS_ENV_VAR) == "1"
+
+    def get_ngs_library_folder_name(self, library_name):
+        """Return folder name of the NGS library with the given name
+
+        Looks up ``self.ngs_library_to_folder_name`` instead of traversing the sheets.
+        """
+        try:
+            folder_name = self.ngs_library_to_folder_name[library_name]
+        except KeyError:
+            raise ValueError("Found no folders for NGS library of name {}".format(library_name))
+        if folder_name is None:
+            raise ValueError("No folderName extraInfos entry for {}".format(library_name))
+        return folder_name
+
+    @property
+    def link_in_path_generator(self):
+        """Return ``LinkInPathGenerator`` shared by all step parts of this workflow step
+
+        Sharing the generator means sharing its file system crawler cache and its memoized
+        results for each folder name.
+        """
+        if self._link_in_path_generator is None:
+            self._link_in_path_generator = LinkInPathGenerator(
+                self.work_dir, self.data_set_infos, self.config_lookup_paths
+            )
+        return self._link_in_path_generator
 
     def _setup_hooks(self):
         """Setup Snakemake workflow hooks for start/end/error"""
@@ -533,6 +857,7 @@ class BaseStep:
         # don't use them
         def on_start(_):
             """Print configuration and sample sheets on start"""
+            self._save_resource_history()
             verbose = False
             if verbose:
                 # Print configuration back to the user after merging workflow step-specific
@@ -543,6 +868,8 @@ class BaseStep:
 
         def on_error(_):
             """Error handler, print message"""
+            self._log_link_in_cache_stats()
+            self._save_resource_history()
             msg = "Oh no! Something went wrong."
             print("\n" + "*" * len(msg), file=sys.stderr)
             print(msg, file=sys.stderr)
@@ -550,6 +877,9 @@ class BaseStep:
 
         def on_success(_):
             """Success handler, print message"""
+            self._log_link_in_cache_stats()
+            self._write_output_manifest()
+            self._save_resource_history()
             msg = "All done; have a nice day!"
             print("\n" + "*" * len(msg), file=sys.stderr)
             print(msg, file=sys.stderr)
@@ -559,16 +889,44 @@ class BaseStep:
         self.workflow.onerror(on_error)
         self.workflow.onsuccess(on_success)
 
+    def _write_output_manifest(self):
+        """Write ``OutputManifest`` for the result files into the step directory"""
+        manifest = OutputManifest.from_result_files(
+            self.name, self.get_result_files(), self.work_dir
+        )
+        try:
+            manifest.save(self.work_dir)
+        except OSError as e:
+            logging.getLogger("output_manifest").warning("Could not write output manifest: %s", e)
+
+    def _log_link_in_cache_stats(self):
+        """Log hit/miss statistics of the link-in path cache, if used"""
+        if self._link_in_path_generator is not None:
+            self._link_in_path_generator.log_cache_stats()
+
     def _update_config(self, config):
         """Update configuration config with the configuration returned by subclass'
         ``default_config_yaml()`` and return
+
+        The result is cached by the contents of ``config`` and the default configurations of
+        the step class chain, see ``get_config_cache()``.
         """
-        result = OrderedDict()
-        for cls in itertools.chain([self.__class__], self.previous_steps):
-            result = merge_dicts(
-                result, _cached_yaml_round_trip_load_str(cls.default_config_yaml())
-            )
-        return merge_dicts(result, config)
+        classes = tuple(itertools.chain([self.__class__], self.previous_steps))
+        default_configs = tuple(cls.default_config_yaml() for cls in classes)
+        key = (
+            "update_config",
+            tuple("{}.{}".format(cls.__module__, cls.__qualname__) for cls in classes),
+            hash_data(default_configs),
+            hash_data(config),
+        )
+
+        def factory():
+            result = OrderedDict()
+            for default_config in default_configs:
+                result = merge_dicts(result, _cached_yaml_round_trip_load_str(default_config))
+            return merge_dicts(result, config), ()
+
+        return get_config_cache(self.work_dir).get(key, factory)
 
     def _check_config(self):
         """Internal method, checks step and sub step configurations"""
@@ -648,12 +1006,129 @@ class BaseStep:
             obj.update_cluster_config(self.cluster_config)
             obj.check_config()
             self.sub_steps[klass.name] = obj
+        if os.environ.get(JOB_GROUPS_ENV_VAR):
+            self._register_job_groups(*parse_job_groups(os.environ[JOB_GROUPS_ENV_VAR]))
+        if self.resource_model is not None:
+            self._apply_resource_model()
+
+    def _register_job_groups(self, size, sizes):
+        """Bundle the jobs of short-running rules into Snakemake job groups
+
+        The rules from the sub steps' ``get_bundled_rules()`` are bundled into groups of ``size``
+        jobs (if not ``None``), ``sizes`` gives the group sizes of further rules by name.  The
+        group of each rule is named after the rule such that the group jobs are submitted with
+        the rule's cluster configuration.  As the jobs of a group may run one after another, the
+        running time is multiplied with the group size.
+        """
+        groups = {}
+        if size:
+            for sub_step in self.sub_steps.values():
+                groups.update((rule, size) for rule in sub_step.get_bundled_rules())
+        groups.update(sizes)
+        for rule, rule_size in groups.items():
+            if rule_size < 2 or rule in self.job_groups:
+                continue  # no bundling or registered in earlier call
+            self.workflow.overwrite_groups[rule] = rule
+            self.workflow.group_components[rule] = rule_size
+            entry = dict(self.cluster_config.get("__default__", {}))
+            entry.update(self.cluster_config.get(rule, {}))
+            if entry.get("time"):
+                entry["time"] = format_time(parse_time(entry["time"]) * rule_size)
+            self.cluster_config[rule] = entry
+            self.job_groups[rule] = rule_size
+
+    def _register_resource_model(self):
+        """Register default resources ``snappy_mem`` and ``snappy_time`` for all rules
+
+        The values are predicted by ``self.resource_model`` from the input files of each job.
+        The Snakefiles create the ``BaseStep`` object before the rules so all rules pick them up.
+        """
+
+        def snappy_mem(wildcards, input, rulename):
+            return self._predict_resource(rulename, "mem", wildcards, input)
+
+        def snappy_time(wildcards, input, rulename):
+            return self._predict_resource(rulename, "time", wildcards, input)
+
+        self.workflow.default_resources.parsed["snappy_mem"] = snappy_mem
+        self.workflow.default_resources.parsed["snappy_time"] = snappy_time
+
+    def _register_local_resources(self):
+        """Register default resources ``mem_mb`` and threads for all rules
+
+        The values are taken from ``mem`` and ``ntasks`` of the rule's cluster configuration such
+        that the local Snakemake scheduler can pack the jobs by memory and cores.  Rules with a
+        ``threads`` directive keep their number of threads.
+        """
+
+        def mem_mb(wildcards, input, rulename):
+            return self._get_cluster_resource(rulename, "mem", wildcards, input)
+
+        def threads(wildcards, input, rulename):
+            return self._get_cluster_resource(rulename, "ntasks", wildcards, input)
+
+        self.workflow.default_resources.parsed["mem_mb"] = mem_mb
+        self.workflow.default_resources.parsed["_cores"] = threads
+
+    def _get_cluster_resource(self, rule_name, key, wildcards, input_files):
+        """Return ``int`` value of the rule's cluster configuration (or ``"__default__"``)"""
+        entry = dict(self.cluster_config.get("__default__", {}))
+        entry.update(self.cluster_config.get(rule_name, {}))
+        value = entry.get(key, 1)
+        if self.resource_model is not None and value == "{resources.snappy_%s}" % key:
+            value = self._predict_resource(rule_name, key, wildcards, input_files)
+        return int(value)
+
+    def _apply_resource_model(self):
+        """Replace ``mem`` and ``time`` in the cluster configuration by the predicted resources
+
+        The static values are kept in the ``ResourceModel`` as the fallback for rules without
+        sufficient history.  Rules bundled into job groups keep their static values as the group
+        jobs are submitted with the configuration of the group.
+        """
+        for rule, entry in list(self.cluster_config.items()):
+            entry = dict(entry)  # entries may be shared between rules
+            for key in ("mem", "time"):
+                placeholder = "{resources.snappy_%s}" % key
+                if entry.get(key) is not None and entry[key] != placeholder:
+                    self.resource_model.set_fallback(rule, key, entry[key])
+                    if rule not in self.job_groups:
+                        entry[key] = placeholder
+            self.cluster_config[rule] = entry
+
+    def _predict_resource(self, rule_name, key, wildcards, input_files):
+        """Return predicted resource, record input size of the job if all input files exist"""
+        if rule_name in self.job_groups:
+            # String resources must be equal for all jobs of a group
+            return self.resource_model.get_fallback(rule_name, key)
+        try:
+            input_bytes = sum(os.path.getsize(path) for path in input_files)
+        except OSError:
+            input_bytes = None  # input files not created yet
+        rule = self.workflow.get_rule(rule_name)
+        if input_bytes is not None and rule.benchmark:
+            benchmark = str(rule.benchmark.apply_wildcards(wildcards))
+            self.resource_model.add_record(rule_name, benchmark, input_bytes)
+        return self.resource_model.predict(rule_name, key, input_bytes)
+
+    def _save_resource_history(self):
+        """Write the input sizes of the jobs to the history file of the ``ResourceModel``"""
+        if self.resource_model is None:
+            return
+        try:
+            self.resource_model.save_history()
+        except OSError as e:
+            logging.getLogger("resource_model").warning("Could not write history: %s", e)
 
     def register_sub_workflow(self, step_name, workdir, sub_workflow_name=None):
         """Register workflow with given pipeline ``step_name`` and in the given ``workdir``.
 
         Optionally, the sub workflow name can be given separate from ``step_name`` (the default)
         value for it.
+
+        If the environment variable ``SNAPPY_PIPELINE_SUB_WORKFLOW_MANIFESTS`` is set to ``1``
+        and the sub workflow has a complete ``OutputManifest``, paths are resolved with a
+        ``ManifestSubWorkflow`` instead of a Snakemake sub workflow.
         """
         sub_workflow_name = sub_workflow_name or step_name
         if sub_workflow_name in self.sub_workflows:
@@ -662,6 +1137,17 @@ class BaseStep:
             abs_workdir = workdir
         else:
             abs_workdir = os.path.realpath(os.path.join(os.getcwd(), workdir))
+        if os.environ.get(SUB_WORKFLOW_MANIFESTS_ENV_VAR) == "1":
+            manifest = OutputManifest.load(abs_workdir)
+            if manifest and manifest.complete:
+                self.sub_workflows[sub_workflow_name] = ManifestSubWorkflow(
+                    sub_workflow_name, abs_workdir, manifest
+                )
+                return
+            logging.getLogger("manifest_sub_workflow").info(
+                "No complete output manifest in %s, falling back to Snakemake sub workflow",
+                abs_workdir,
+            )
         self.workflow.subworkflow(
             sub_workflow_name,
             workdir=abs_workdir,
@@ -675,14 +1161,21 @@ class BaseStep:
 
         Delegates to the sub step object's get_input_files function
         """
-        return self._get_sub_step(sub_step).get_args(action)
+        return self._profile_dag(
+            sub_step, action, "get_args", self._get_sub_step(sub_step).get_args(action)
+        )
 
     def get_input_files(self, sub_step, action):
         """Return input files for action of substep with given wildcards
 
-        Delegates to the sub step object's get_input_files function
+        Delegates to the sub step object's get_input_files function.  In cluster jobs with input
+        staging enabled (environment variable ``SNAPPY_PIPELINE_STAGE_DIR`` set by the job
+        script), input functions are wrapped for copying BAM and CRAM files to local scratch.
         """
-        return self._get_sub_step(sub_step).get_input_files(action)
+        result = self._get_sub_step(sub_step).get_input_files(action)
+        if os.environ.get(STAGE_DIR_ENV_VAR) and callable(result):
+            result = wrap_input_function(result, os.environ[STAGE_DIR_ENV_VAR])
+        return self._profile_dag(sub_step, action, "get_input_files", result)
 
     def get_output_files(self, sub_step, action):
         """Return list of strings with output files/patterns
@@ -696,7 +1189,16 @@ class BaseStep:
 
         Delegates to the sub step object's get_params function
         """
-        return self.substep_dispatch(sub_step, "get_params", action)
+        return self._profile_dag(
+            sub_step, action, "get_params", self.substep_dispatch(sub_step, "get_params", action)
+        )
+
+    def _profile_dag(self, sub_step, action, function, result):
+        """Wrap ``result`` for recording timings if it is callable and DAG profiling is enabled"""
+        profiler = get_dag_profiler()
+        if profiler is None or not callable(result):
+            return result
+        return profiler.wrap(self.name, sub_step, action, function, result)
 
     def get_log_file(self, sub_step, action):
         """Return path to the log file
@@ -705,6 +1207,13 @@ class BaseStep:
         """
         return self.substep_dispatch(sub_step, "get_log_file", action)
 
+    def get_benchmark_file(self, sub_step, action):
+        """Return path to the benchmark file
+
+        Delegates to the sub step object's get_benchmark_file function
+        """
+        return self.substep_dispatch(sub_step, "get_benchmark_file", action)
+
     def get_shell_cmd(self, sub_step, action, wildcards):
         """Return shell command for the pipeline sub step
 
@@ -771,7 +1280,12 @@ class LinkInPathGenerator:
     """Helper class for generating paths to link in"""
 
     def __init__(
-        self, work_dir, data_set_infos, config_paths, cache_file_name=".snappy_path_cache"
+        self,
+        work_dir,
+        data_set_infos,
+        config_paths,
+        cache_file_name=".snappy_path_cache",
+        crawler_threads=8,
     ):
         #: Working directory
         self.work_dir = work_dir
@@ -781,18 +1295,48 @@ class LinkInPathGenerator:
         self.config_paths = config_paths
         #: Name of cache file to create
         self.cache_file_name = cache_file_name
+        #: The logger to use.
+        self.logger = logging.getLogger("link_in_path_generator")
+        #: Memoized results of ``run()``, by ``(folder_name, pattern_set_keys)``
+        self.results = {}
+        #: Number of ``run()`` calls answered from ``self.results``
+        self.cache_hits = 0
+        #: Number of ``run()`` calls that required crawling
+        self.cache_misses = 0
         #: File system crawler to use
         invalidate_paths_list = self._merge_cache_invalidate_paths(data_set_infos)
         invalidate_paths_list += config_paths
         self.crawler = FileSystemCrawler(
-            os.path.join(self.work_dir, self.cache_file_name), invalidate_paths_list
+            os.path.join(self.work_dir, self.cache_file_name),
+            invalidate_paths_list,
+            num_threads=crawler_threads,
         )
 
     def run(self, folder_name, pattern_set_keys=("left", "right", "bam")):
         """Yield (src_path, path_infix, filename) one-by-one
 
-        Cache is saved after the last iteration
+        The results are memoized per ``folder_name`` and ``pattern_set_keys``.  The crawler cache
+        is saved after crawling for a new folder name.
         """
+        key = (folder_name, tuple(pattern_set_keys))
+        if key in self.results:
+            self.cache_hits += 1
+            profiler = get_dag_profiler()
+            if profiler:
+                profiler.record_cache_hit()
+        else:
+            self.cache_misses += 1
+            self.results[key] = tuple(self._run(folder_name, pattern_set_keys))
+        yield from self.results[key]
+
+    def log_cache_stats(self):
+        """Log hit/miss statistics of the memoized ``run()`` results"""
+        self.logger.info(
+            "Link-in path cache: %d hits, %d misses", self.cache_hits, self.cache_misses
+        )
+
+    def _run(self, folder_name, pattern_set_keys):
+        """Crawl for the files of ``folder_name``, saves the cache after the last iteration"""
         # Iterate over data set infos and crawl file system
         filenames = set([])
         # TODO: crawling the actual data sheet of the current data set is enough!
@@ -897,30 +1441,32 @@ class LinkInPathGenerator:
         return None
 
 
-def get_ngs_library_folder_name(sheets, library_name):
-    """Return library's folder name
+def build_ngs_library_folder_name_index(sheets):
+    """Return ``dict`` mapping NGS library names to their folder name
 
-    The library is searched for based on the ``library_name``.  In the case of
-    multiple NGS library matches, the first one is returned.
+    The folder name is ``None`` for NGS libraries without ``folderName`` extra info.  In the
+    case of multiple NGS libraries with the same name, the first one is used.
     """
+    result = {}
     for sheet in sheets:
-        try:
-            ngs_library = sheet.crawl(sheet.name_generator.inverse(library_name))
-        except SecondaryIDNotFoundException:
-            continue  # skip, not in this sheet
-        if ngs_library:
-            try:
-                return ngs_library.extra_infos["folderName"]
-            except AttributeError:
-                raise ValueError("No folderName extraInfos entry for {}".format(ngs_library.name))
-    raise ValueError("Found no folders for NGS library of name {}".format(library_name))
+        for bio_entity in sheet.bio_entities.values():
+            for bio_sample in bio_entity.bio_samples.values():
+                for test_sample in bio_sample.test_samples.values():
+                    for ngs_library in test_sample.ngs_libraries.values():
+                        result.setdefault(
+                            ngs_library.name, ngs_library.extra_infos.get("folderName")
+                        )
+    return result
 
 
 # TODO: Rename to LinkInStepPart
 class LinkInStep(BaseStepPart):
     """Link in the raw files, e.g. FASTQ files
 
-    Depending on the configuration, the files are linked out after postprocessing
+    Depending on the configuration, the files are linked out after postprocessing.
+
+    Besides the per-library ``"run"`` action, the ``"batch"`` action links in the files of all
+    NGS libraries with raw files at once, see ``BaseStep.use_batch_links``.
     """
 
     name = "link_in"
@@ -929,9 +1475,9 @@ class LinkInStep(BaseStepPart):
         super().__init__(parent)
         self.base_pattern_out = "work/input_links/{library_name}/.done"
         # Path generator.
-        self.path_gen = LinkInPathGenerator(
-            self.parent.work_dir, self.parent.data_set_infos, self.parent.config_lookup_paths
-        )
+        self.path_gen = self.parent.link_in_path_generator
+        #: Pairs of source and link path, by library name, built on first use
+        self._links = {}
 
     def get_input_files(self, action):
         """Return required input files"""
@@ -939,6 +1485,13 @@ class LinkInStep(BaseStepPart):
 
     def get_output_files(self, action):
         """Return output files that are generated by snappy-gatk_post_bam"""
+        if action == "batch":
+            return touch(
+                [
+                    self.base_pattern_out.format(library_name=library_name)
+                    for library_name in self._get_batch_library_names()
+                ]
+            )
         assert action == "run", "Unsupported action"
         return touch(self.base_pattern_out)
 
@@ -949,31 +1502,18 @@ class LinkInStep(BaseStepPart):
         intact.
         """
         assert action == "run", "Unsupported action"
-        # Get base out path
-        out_path = os.path.dirname(self.base_pattern_out.format(**wildcards))
-        # Get folder name of first library candidate
-        folder_name = get_ngs_library_folder_name(self.parent.sheets, wildcards.library_name)
-        # Perform the command generation
-        lines = []
         tpl = (
-            "mkdir -p {out_path}/{path_infix} && "
-            "{{{{ test -h {out_path}/{path_infix}/{filename} || "
-            "ln -sr {src_path}/{filename} {out_path}/{path_infix}; }}}}"
+            "mkdir -p {out_path} && "
+            "{{{{ test -h {out_path}/{filename} || ln -sr {src_path} {out_path}; }}}}"
         )
-        filenames = {}  # generated so far
-        for src_path, path_infix, filename in self.path_gen.run(folder_name):
-            new_path = os.path.join(out_path, path_infix, filename)
-            if new_path in filenames:
-                if filenames[new_path] == src_path:
-                    continue  # ignore TODO: better correct this
-                msg = "WARNING: Detected double output path {}"
-                print(msg.format(filename), file=sys.stderr)
-            filenames[new_path] = src_path
-            lines.append(
-                tpl.format(
-                    src_path=src_path, out_path=out_path, path_infix=path_infix, filename=filename
-                )
+        lines = [
+            tpl.format(
+                src_path=src_path,
+                out_path=os.path.dirname(link_path),
+                filename=os.path.basename(link_path),
             )
+            for src_path, link_path in self._get_links(wildcards.library_name)
+        ]
         if not lines:
             msg = "Found no files to link in for {}".format(dict(**wildcards))
             print(msg, file=sys.stderr)
@@ -981,9 +1521,45 @@ class LinkInStep(BaseStepPart):
         return "\n".join(lines)
 
     def run(self, action, wildcards):
-        raise ImplementationUnavailableError(
-            "run() not implemented for linking in reads"
-        )  # pragma: no cover
+        """Link in the files of all libraries in this process for the ``"batch"`` action"""
+        if action != "batch":
+            raise ImplementationUnavailableError(
+                "run() not implemented for linking in reads"
+            )  # pragma: no cover
+        symlink_files(
+            itertools.chain.from_iterable(
+                self._get_links(library_name) for library_name in self._get_batch_library_names()
+            )
+        )
+
+    def _get_batch_library_names(self):
+        """Return names of the NGS libraries with folder name and files to link in"""
+        return [
+            library_name
+            for library_name, folder_name in self.parent.ngs_library_to_folder_name.items()
+            if folder_name is not None and self._get_links(library_name)
+        ]
+
+    def _get_links(self, library_name):
+        """Return list of ``(src_path, link_path)`` pairs for the library's files"""
+        if library_name not in self._links:
+            # Get base out path
+            out_path = os.path.dirname(self.base_pattern_out.format(library_name=library_name))
+            # Get folder name of first library candidate
+            folder_name = self.parent.get_ngs_library_folder_name(library_name)
+            links = []
+            filenames = {}  # generated so far
+            for src_path, path_infix, filename in self.path_gen.run(folder_name):
+                new_path = os.path.join(out_path, path_infix, filename)
+                if new_path in filenames:
+                    if filenames[new_path] == src_path:
+                        continue  # ignore TODO: better correct this
+                    msg = "WARNING: Detected double output path {}"
+                    print(msg.format(filename), file=sys.stderr)
+                filenames[new_path] = src_path
+                links.append((os.path.join(src_path, filename), new_path))
+            self._links[library_name] = links
+        return self._links[library_name]
 
 
 class InputFilesStepPartMixin:
@@ -56,10 +56,8 @@ from snappy_pipeline.utils import dictify, listify
 from snappy_pipeline.workflows.abstract import (
     BaseStep,
     BaseStepPart,
-    LinkInPathGenerator,
     LinkInStep,
     LinkOutStepPart,
-    get_ngs_library_folder_name,
 )
 from snappy_pipeline.workflows.ngs_mapping import NgsMappingWorkflow
 
@@ -158,9 +156,7 @@ class SalmonStepPart(BaseStepPart):
         ):
             self.extensions["gene_sf"] = ".gene.sf"
             self.extensions["gene_sf_md5"] = ".gene.sf.md5"
-        self.path_gen = LinkInPathGenerator(
-            self.parent.work_dir, self.parent.data_set_infos, self.parent.config_lookup_paths
-        )
+        self.path_gen = self.parent.link_in_path_generator
 
     @classmethod
     @dictify
@@ -216,7 +212,7 @@ class SalmonStepPart(BaseStepPart):
 
         Yields paths to right reads if prefix=='right-'
         """
-        folder_name = get_ngs_library_folder_name(self.parent.sheets, wildcards.library_name)
+        folder_name = self.parent.get_ngs_library_folder_name(wildcards.library_name)
         pattern_set_keys = ("right",) if prefix.startswith("right-") else ("left",)
         for _, path_infix, filename in self.path_gen.run(folder_name, pattern_set_keys):
             yield os.path.join(self.base_path_in, path_infix, filename).format(**wildcards)
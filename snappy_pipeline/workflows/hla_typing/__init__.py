@@ -64,10 +64,8 @@ from snappy_pipeline.utils import dictify, listify
 from snappy_pipeline.workflows.abstract import (
     BaseStep,
     BaseStepPart,
-    LinkInPathGenerator,
     LinkInStep,
     LinkOutStepPart,
-    get_ngs_library_folder_name,
 )
 
 #: Extensions of files to create as main payload
@@ -110,9 +108,7 @@ class OptiTypeStepPart(BaseStepPart):
         self.base_path_out = "work/optitype.{{library_name}}/out/optitype.{{library_name}}{ext}"
         self.extensions = EXT_VALUES
         #: Path generator for linking in
-        self.path_gen = LinkInPathGenerator(
-            self.parent.work_dir, self.parent.data_set_infos, self.parent.config_lookup_paths
-        )
+        self.path_gen = self.parent.link_in_path_generator
 
     @classmethod
     @dictify
@@ -162,7 +158,7 @@ class OptiTypeStepPart(BaseStepPart):
 
         Yields paths to right reads if prefix=='right-'
         """
-        folder_name = get_ngs_library_folder_name(self.parent.sheets, wildcards.library_name)
+        folder_name = self.parent.get_ngs_library_folder_name(wildcards.library_name)
         pattern_set_keys = ("right",) if prefix.startswith("right-") else ("left",)
         for _, path_infix, filename in self.path_gen.run(folder_name, pattern_set_keys):
             yield os.path.join(self.base_path_in, path_infix, filename).format(**wildcards)
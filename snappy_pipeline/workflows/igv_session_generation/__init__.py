@@ -94,6 +94,10 @@ class WriteIgvSessionFileStepPart(BaseStepPart):
                 for donor in pedigree.donors:
                     self.ngs_library_to_pedigree[donor.dna_ngs_library.name] = pedigree
 
+    def get_bundled_rules(self):
+        """Return name of the session file rule, its jobs only write a small XML file"""
+        return ["igv_session_generation_write_igv_session_file"]
+
     def _get_path_bam(self, wildcards, donor):
         ngs_mapping = self.parent.sub_workflows["ngs_mapping"]
         return ngs_mapping(
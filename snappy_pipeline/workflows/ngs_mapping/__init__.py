@@ -286,10 +286,8 @@ from snappy_pipeline.workflows.abstract import (
     STDERR_TO_LOG_FILE,
     BaseStep,
     BaseStepPart,
-    LinkInPathGenerator,
     LinkInStep,
     LinkOutStepPart,
-    get_ngs_library_folder_name,
 )
 
 __author__ = "Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>"
@@ -420,9 +418,7 @@ class ReadMappingStepPart(BaseStepPart):
         self.base_path_out = "work/{mapper}.{{library_name}}/out/{mapper}.{{library_name}}{ext}"
         self.extensions = EXT_VALUES
         #: Path generator for linking in
-        self.path_gen = LinkInPathGenerator(
-            self.parent.work_dir, self.parent.data_set_infos, self.parent.config_lookup_paths
-        )
+        self.path_gen = self.parent.link_in_path_generator
 
     def get_args(self, action):
         """Return function that maps wildcards to dict for input files"""
@@ -499,7 +495,7 @@ class ReadMappingStepPart(BaseStepPart):
 
         Yields paths to right reads if prefix=='right-'
         """
-        folder_name = get_ngs_library_folder_name(self.parent.sheets, wildcards.library_name)
+        folder_name = self.parent.get_ngs_library_folder_name(wildcards.library_name)
         pattern_set_keys = ("right",) if prefix.startswith("right-") else ("left",)
         seen = []
         for _, path_infix, filename in self.path_gen.run(folder_name, pattern_set_keys):
@@ -671,7 +667,7 @@ class ExternalStepPart(ReadMappingStepPart):
     @listify
     def _collect_bams(self, wildcards, library_name):
         """Yield the path to bam files"""
-        folder_name = get_ngs_library_folder_name(self.parent.sheets, wildcards.library_name)
+        folder_name = self.parent.get_ngs_library_folder_name(wildcards.library_name)
         for _, path_infix, filename in self.path_gen.run(folder_name, ("bam",)):
             yield os.path.join(self.base_path_in, path_infix, filename).format(**wildcards)
 
@@ -864,6 +860,7 @@ class TargetCoverageReportStepPart(BaseStepPart):
 
     name = "target_coverage_report"
     actions = ("run", "collect")
+    bundle_actions = ("run",)
 
     def __init__(self, parent):
         super().__init__(parent)
@@ -45,10 +45,8 @@ from snappy_pipeline.utils import dictify, listify
 from snappy_pipeline.workflows.abstract import (
     BaseStep,
     BaseStepPart,
-    LinkInPathGenerator,
     LinkInStep,
     LinkOutStepPart,
-    get_ngs_library_folder_name,
 )
 
 __author__ = "Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>"
@@ -88,9 +86,7 @@ class SomaticGeneFusionCallingStepPart(BaseStepPart):
         self.base_path_in = "work/input_links/{library_name}"
         self.base_path_out = "work/{name}.{{library_name}}/out/.done".format(name=self.name)
         # Path generator for linking in
-        self.path_gen = LinkInPathGenerator(
-            self.parent.work_dir, self.parent.data_set_infos, self.parent.config_lookup_paths
-        )
+        self.path_gen = self.parent.link_in_path_generator
 
     @dictify
     def get_input_files(self, action):
@@ -116,7 +112,7 @@ class SomaticGeneFusionCallingStepPart(BaseStepPart):
 
         Yields paths to right reads if prefix=='right-'
         """
-        folder_name = get_ngs_library_folder_name(self.parent.sheets, wildcards.library_name)
+        folder_name = self.parent.get_ngs_library_folder_name(wildcards.library_name)
         pattern_set_keys = ("right",) if prefix.startswith("right-") else ("left",)
         for _, path_infix, filename in self.path_gen.run(folder_name, pattern_set_keys):
             yield os.path.join(self.base_path_in, path_infix, filename).format(**wildcards)
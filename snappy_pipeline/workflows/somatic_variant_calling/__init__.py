@@ -215,6 +215,8 @@ step_config:
       drmaa_snippet: ''          # value to pass in as additional DRMAA arguments
       num_cores: 2               # number of cores to use locally
       window_length: 3500000     # split input into windows of this size, each triggers a job
+      window_balancing: ''       # balance windows by cost: '', gaps, targets, bam_index
+      window_balancing_bed: ''   # BED file with gaps or targets for window_balancing
       num_jobs: 500              # number of windows to process in parallel
       use_drmaa: true            # use drmaa for parallel processing
       restart_times: 5           # number of times to re-launch jobs in case of failure
@@ -222,8 +224,13 @@ step_config:
       max_status_checks_per_second: 10   # throttling of status checks
       debug_trunc_tokens: 0      # truncation to first N tokens (0 for none)
       keep_tmpdir: never         # keep temporary directory, {always, never, onerror}
+      resumable: false           # keep work dir next to output, re-run only missing chunks
       job_mult_memory: 1         # memory multiplier
       job_mult_time: 1           # running time multiplier
+      job_retry_mult_memory: 1   # memory multiplier for each retry of a chunk
+      job_retry_mult_time: 1     # running time multiplier for each retry of a chunk
+      job_retry_max_memory: 0    # cap for escalated memory in GiB, 0 for no cap
+      job_retry_max_time: 0      # cap for escalated running time in hours, 0 for no cap
       merge_mult_memory: 1       # memory multiplier for merging
       merge_mult_time: 1         # running time multiplier for merging
       ignore_chroms:             # patterns of chromosome names to ignore
@@ -242,6 +249,8 @@ step_config:
       drmaa_snippet: ''         # value to pass in as additional DRMAA arguments
       num_cores: 2              # number of cores to use locally
       window_length: 50000000   # split input into windows of this size, each triggers a job
+      window_balancing: ''      # balance windows by cost: '', gaps, targets, bam_index
+      window_balancing_bed: ''  # BED file with gaps or targets for window_balancing
       num_jobs: 500             # number of windows to process in parallel
       use_drmaa: true           # use DRMAA for parallel processing
       restart_times: 5          # number of times to re-launch jobs in case of failure
@@ -249,8 +258,13 @@ step_config:
       max_status_checks_per_second: 10   # throttling of status checks
       debug_trunc_tokens: 0     # truncation to first N tokens (0 for none)
       keep_tmpdir: never        # keep temporary directory, {always, never, onerror}
+      resumable: false          # keep work dir next to output, re-run only missing chunks
       job_mult_memory: 1        # memory multiplier
       job_mult_time: 1          # running time multiplier
+      job_retry_mult_memory: 1  # memory multiplier for each retry of a chunk
+      job_retry_mult_time: 1    # running time multiplier for each retry of a chunk
+      job_retry_max_memory: 0   # cap for escalated memory in GiB, 0 for no cap
+      job_retry_max_time: 0     # cap for escalated running time in hours, 0 for no cap
       merge_mult_memory: 1      # memory multiplier for merging
       merge_mult_time: 1        # running time multiplier for merging
       ignore_chroms:            # patterns of chromosome names to ignore
@@ -271,6 +285,8 @@ step_config:
       drmaa_snippet: ''         # value to pass in as additional DRMAA arguments
       num_cores: 2              # number of cores to use locally
       window_length: 50000000   # split input into windows of this size, each triggers a job
+      window_balancing: ''      # balance windows by cost: '', gaps, targets, bam_index
+      window_balancing_bed: ''  # BED file with gaps or targets for window_balancing
       num_jobs: 500             # number of windows to process in parallel
       use_drmaa: true           # use DRMAA for parallel processing
       restart_times: 5          # number of times to re-launch jobs in case of failure
@@ -278,8 +294,13 @@ step_config:
       max_status_checks_per_second: 10   # throttling of status checks
       debug_trunc_tokens: 0     # truncation to first N tokens (0 for none)
       keep_tmpdir: never        # keep temporary directory, {always, never, onerror}
+      resumable: false          # keep work dir next to output, re-run only missing chunks
       job_mult_memory: 1        # memory multiplier
       job_mult_time: 1          # running time multiplier
+      job_retry_mult_memory: 1  # memory multiplier for each retry of a chunk
+      job_retry_mult_time: 1    # running time multiplier for each retry of a chunk
+      job_retry_max_memory: 0   # cap for escalated memory in GiB, 0 for no cap
+      job_retry_max_time: 0     # cap for escalated running time in hours, 0 for no cap
       merge_mult_memory: 1      # memory multiplier for merging
       merge_mult_time: 1        # running time multiplier for merging
       ignore_chroms:            # patterns of chromosome names to ignore
@@ -311,6 +332,8 @@ step_config:
       drmaa_snippet: ''         # value to pass in as additional DRMAA arguments
       num_cores: 2              # number of cores to use locally
       window_length: 50000000   # split input into windows of this size, each triggers a job
+      window_balancing: ''      # balance windows by cost: '', gaps, targets, bam_index
+      window_balancing_bed: ''  # BED file with gaps or targets for window_balancing
       num_jobs: 500             # number of windows to process in parallel
       use_drmaa: true           # use DRMAA for parallel processing
       restart_times: 5          # number of times to re-launch jobs in case of failure
@@ -318,8 +341,13 @@ step_config:
       max_status_checks_per_second: 10   # throttling of status checks
       debug_trunc_tokens: 0     # truncation to first N tokens (0 for none)
       keep_tmpdir: never        # keep temporary directory, {always, never, onerror}
+      resumable: false          # keep work dir next to output, re-run only missing chunks
       job_mult_memory: 1        # memory multiplier
       job_mult_time: 1          # running time multiplier
+      job_retry_mult_memory: 1  # memory multiplier for each retry of a chunk
+      job_retry_mult_time: 1    # running time multiplier for each retry of a chunk
+      job_retry_max_memory: 0   # cap for escalated memory in GiB, 0 for no cap
+      job_retry_max_time: 0     # cap for escalated running time in hours, 0 for no cap
       merge_mult_memory: 1      # memory multiplier for merging
       merge_mult_time: 1        # running time multiplier for merging
       ignore_chroms:            # patterns of chromosome names to ignore
@@ -352,6 +380,8 @@ step_config:
       drmaa_snippet: ''         # value to pass in as additional DRMAA arguments
       num_cores: 2              # number of cores to use locally
       window_length: 5000000    # split input into windows of this size, each triggers a job
+      window_balancing: ''      # balance windows by cost: '', gaps, targets, bam_index
+      window_balancing_bed: ''  # BED file with gaps or targets for window_balancing
       num_jobs: 500             # number of windows to process in parallel
       use_drmaa: true           # use drmaa for parallel processing
       restart_times: 5          # number of times to re-launch jobs in case of failure
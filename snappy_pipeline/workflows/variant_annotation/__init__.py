@@ -210,8 +210,13 @@ step_config:
     max_status_checks_per_second: 10   # throttling of status checks
     debug_trunc_tokens: 0     # truncation to first N tokens (0 for none)
     keep_tmpdir: never        # keep temporary directory, {always, never, onerror}
+    resumable: false          # keep work dir next to output, re-run only missing chunks
     job_mult_memory: 1        # memory multiplier
     job_mult_time: 1          # running time multiplier
+    job_retry_mult_memory: 1  # memory multiplier for each retry of a chunk
+    job_retry_mult_time: 1    # running time multiplier for each retry of a chunk
+    job_retry_max_memory: 0   # cap for escalated memory in GiB, 0 for no cap
+    job_retry_max_time: 0     # cap for escalated running time in hours, 0 for no cap
     merge_mult_memory: 1      # memory multiplier for merging
     merge_mult_time: 1        # running time multiplier for merging
     ignore_chroms:            # patterns of chromosome names to ignore
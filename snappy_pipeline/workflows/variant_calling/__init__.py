@@ -220,6 +220,8 @@ step_config:
       drmaa_snippet: ''         # value to pass in as additional DRMAA arguments
       num_threads: 2            # number of cores to use locally
       window_length: 5000000    # split input into windows of this size, each triggers a job
+      window_balancing: ''      # balance windows by cost: '', gaps, targets, bam_index
+      window_balancing_bed: ''  # BED file with gaps or targets for window_balancing
       num_jobs: 500             # number of windows to process in parallel
       use_drmaa: true           # use DRMAA for parallel processing
       restart_times: 0          # number of times to re-launch jobs in case of failure
@@ -227,8 +229,13 @@ step_config:
       max_status_checks_per_second: 10  # throttling of status jobs
       debug_trunc_tokens: 0     # truncation to first N tokens (0 for none)
       keep_tmpdir: never        # keep temporary directory, {always, never, onerror}
+      resumable: false          # keep work dir next to output, re-run only missing chunks
       job_mult_memory: 1        # memory multiplier
       job_mult_time: 1          # running time multiplier
+      job_retry_mult_memory: 1  # memory multiplier for each retry of a chunk
+      job_retry_mult_time: 1    # running time multiplier for each retry of a chunk
+      job_retry_max_memory: 0   # cap for escalated memory in GiB, 0 for no cap
+      job_retry_max_time: 0     # cap for escalated running time in hours, 0 for no cap
       merge_mult_memory: 1      # memory multiplier for merging
       merge_mult_time: 1        # running time multiplier for merging
       ignore_chroms:            # patterns of chromosome names to ignore
@@ -263,6 +270,8 @@ step_config:
       drmaa_snippet: ''         # value to pass in as additional DRMAA arguments
       num_threads: 2            # number of cores to use locally
       window_length: 5000000    # split input into windows of this size, each triggers a job
+      window_balancing: ''      # balance windows by cost: '', gaps, targets, bam_index
+      window_balancing_bed: ''  # BED file with gaps or targets for window_balancing
       num_jobs: 500             # number of windows to process in parallel
       num_jobs_combine_gvcf_cort: 0
       num_jobs_genotype_cohort: 0
@@ -298,6 +307,8 @@ step_config:
       drmaa_snippet: ''         # value to pass in as additional DRMAA arguments
       num_threads: 2            # number of cores to use locally
       window_length: 5000000    # split input into windows of this size, each triggers a job
+      window_balancing: ''      # balance windows by cost: '', gaps, targets, bam_index
+      window_balancing_bed: ''  # BED file with gaps or targets for window_balancing
       num_jobs: 500             # number of windows to process in parallel
       use_drmaa: true           # use DRMAA for parallel processing
       restart_times: 0          # number of times to re-launch jobs in case of failure
@@ -305,8 +316,13 @@ step_config:
       max_status_checks_per_second: 10  # throttling of status jobs
       debug_trunc_tokens: 0     # truncation to first N tokens (0 for none)
       keep_tmpdir: never        # keep temporary directory, {always, never, onerror}
+      resumable: false          # keep work dir next to output, re-run only missing chunks
       job_mult_memory: 1        # memory multiplier
       job_mult_time: 1          # running time multiplier
+      job_retry_mult_memory: 1  # memory multiplier for each retry of a chunk
+      job_retry_mult_time: 1    # running time multiplier for each retry of a chunk
+      job_retry_max_memory: 0   # cap for escalated memory in GiB, 0 for no cap
+      job_retry_max_time: 0     # cap for escalated running time in hours, 0 for no cap
       merge_mult_memory: 1      # memory multiplier for merging
       merge_mult_time: 1        # running time multiplier for merging
       ignore_chroms:            # patterns of chromosome names to ignore
@@ -347,6 +363,8 @@ step_config:
       drmaa_snippet: ''         # value to pass in as additional DRMAA arguments
       num_threads: 2            # number of cores to use locally
       window_length: 5000000    # split input into windows of this size, each triggers a job
+      window_balancing: ''      # balance windows by cost: '', gaps, targets, bam_index
+      window_balancing_bed: ''  # BED file with gaps or targets for window_balancing
       num_jobs: 500             # number of windows to process in parallel
       use_drmaa: true           # use drmaa for parallel processing
       restart_times: 0          # number of times to re-launch jobs in case of failure
@@ -354,8 +372,13 @@ step_config:
       max_status_checks_per_second: 10  # throttling of status jobs
       debug_trunc_tokens: 0     # truncation to first N tokens (0 for none)
       keep_tmpdir: never        # keep temporary directory, {always, never, onerror}
+      resumable: false          # keep work dir next to output, re-run only missing chunks
       job_mult_memory: 1        # memory multiplier
       job_mult_time: 1          # running time multiplier
+      job_retry_mult_memory: 1  # memory multiplier for each retry of a chunk
+      job_retry_mult_time: 1    # running time multiplier for each retry of a chunk
+      job_retry_max_memory: 0   # cap for escalated memory in GiB, 0 for no cap
+      job_retry_max_time: 0     # cap for escalated running time in hours, 0 for no cap
       merge_mult_memory: 1      # memory multiplier for merging
       merge_mult_time: 1        # running time multiplier for merging
       ignore_chroms:            # patterns of chromosome names to ignore
@@ -787,6 +810,10 @@ class BcftoolsStatsStepPart(BaseStepPart):
         for sheet in self.parent.shortcut_sheets:
             self.index_ngs_library_to_pedigree.update(sheet.index_ngs_library_to_pedigree)
 
+    def get_bundled_rules(self):
+        """Return name of the report rule, its jobs only run for a short time"""
+        return ["variant_calling_{}_report".format(self.name)]
+
     @dictify
     def get_input_files(self, action):
         """Return path to input files"""
@@ -841,6 +868,10 @@ class JannovarStatisticsStepPart(BaseStepPart):
         for sheet in self.parent.shortcut_sheets:
             self.index_ngs_library_to_pedigree.update(sheet.index_ngs_library_to_pedigree)
 
+    def get_bundled_rules(self):
+        """Return name of the report rule, its jobs only run for a short time"""
+        return ["variant_calling_{}_report".format(self.name)]
+
     @dictify
     def get_input_files(self, action):
         """Return path to input files"""
@@ -6,11 +6,21 @@ Usage::
     $ snappy-genome_windows --fai-file FILE.fa.fai
 
     $ snappy-genome_windows --fai-file FILE.fa.fai --format bed --output-file OUT.bed
+
+    $ snappy-genome_windows --fai-file FILE.fa.fai --balance-by bam_index --balance-file IN.bam
+
+With ``--balance-by``, the windows are cut such that they have roughly equal estimated cost
+instead of equal length, see ``yield_balanced_regions()``.
 """
 
 import argparse
 import csv
 import fnmatch
+import gzip
+import math
+import os
+import re
+import struct
 import sys
 
 from snappy_wrappers.genome_regions import GenomeRegion
@@ -25,6 +35,22 @@ DEFAULT_FORMAT = "regions"
 #: Allowed values for ``--format``
 CHOICES_FORMAT = ("regions", "bed")
 
+#: Allowed values for ``--balance-by``: gaps from FASTA or BED file, target BED file, or BAM index
+CHOICES_BALANCE_BY = ("gaps", "targets", "bam_index")
+
+#: Resolution of the cost profile for balanced windows, the size of the smallest BAI bins
+COST_BIN_SIZE = 16384
+
+#: Cost of an off-target base relative to a target base
+OFF_TARGET_COST = 0.01
+
+#: Fraction of the target cost by which the cost of a balanced window may deviate for cutting
+#: in a cheaper bin, e.g., in an assembly gap
+BALANCE_SLACK = 0.2
+
+#: Regular expression for runs of ``N`` characters in FASTA sequence lines
+GAP_RE = re.compile("[Nn]+")
+
 
 def matches_any(query, patterns):
     for pattern in patterns:
@@ -71,12 +97,230 @@ def yield_regions(fai_file, window_size, subtract_end=0, ignore_chroms=None, pad
             begin = end
 
 
+def open_text(path):
+    """Open text file at ``path`` for reading, gzip-compressed if ending in ``.gz``"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt")
+    else:
+        return open(path, "rt")
+
+
+def yield_fai_contigs(fai_file, ignore_chroms=None):
+    """Yield ``(chrom, length)`` for the contigs in the FAI file"""
+    for record in csv.reader(fai_file, delimiter="\t"):
+        if not matches_any(record[0], ignore_chroms or []):
+            yield record[0], int(record[1])
+
+
+def yield_bed_intervals(bed_file):
+    """Yield ``(chrom, begin, end)`` from BED file, skipping header lines"""
+    for line in bed_file:
+        if line.startswith(("#", "track", "browser")) or not line.strip():
+            continue
+        arr = line.split("\t")
+        yield arr[0], int(arr[1]), int(arr[2])
+
+
+def yield_fasta_gaps(fasta_file):
+    """Yield ``(chrom, begin, end)`` of the runs of ``N`` characters in FASTA file"""
+    chrom, pos, gap = None, 0, None
+    for line in fasta_file:
+        if line.startswith(">"):
+            if gap:
+                yield (chrom,) + gap
+            chrom, pos, gap = line[1:].split()[0], 0, None
+            continue
+        line = line.rstrip()
+        for match in GAP_RE.finditer(line):
+            begin, end = pos + match.start(), pos + match.end()
+            if gap and gap[1] == begin:
+                gap = (gap[0], end)  # continued from previous line
+            else:
+                if gap:
+                    yield (chrom,) + gap
+                gap = (begin, end)
+        pos += len(line)
+    if gap:
+        yield (chrom,) + gap
+
+
+def _read_bam_ref_names(bam_file):
+    """Return list of reference names from header of BAM file opened with ``gzip``"""
+    magic, l_text = struct.unpack("<4si", bam_file.read(8))
+    if magic != b"BAM\1":
+        raise ValueError("Not a BAM file")
+    bam_file.read(l_text)
+    (n_ref,) = struct.unpack("<i", bam_file.read(4))
+    result = []
+    for _ in range(n_ref):
+        (l_name,) = struct.unpack("<i", bam_file.read(4))
+        result.append(bam_file.read(l_name)[:-1].decode())
+        bam_file.read(4)
+    return result
+
+
+def yield_bam_index_costs(bam_path):
+    """Yield ``(chrom, begin, end, cost)`` for the smallest bins of the BAI or CSI index of BAM
+
+    The cost of a bin is the number of compressed bytes of the BAM file in the bin's chunks, a
+    proxy for the number of reads starting in the bin.  Reads in larger bins (i.e., reads
+    crossing bin boundaries) are not counted.
+    """
+    for suffix in (".bai", ".csi"):
+        for index_path in (bam_path + suffix, os.path.splitext(bam_path)[0] + suffix):
+            if os.path.exists(index_path):
+                break
+        else:
+            continue
+        break
+    else:
+        raise ValueError("No BAI or CSI index for BAM file {}".format(bam_path))
+    with gzip.open(bam_path, "rb") as bam_file:
+        ref_names = _read_bam_ref_names(bam_file)
+    with open(index_path, "rb") as index_file:
+        if index_file.read(2) == b"\x1f\x8b":  # CSI files are BGZF compressed
+            index_file = gzip.open(index_path, "rb")
+        else:
+            index_file.seek(0)
+        with index_file:
+            yield from _yield_index_costs(index_file, ref_names)
+
+
+def _yield_index_costs(index_file, ref_names):
+    def read(fmt):
+        return struct.unpack(fmt, index_file.read(struct.calcsize(fmt)))
+
+    (magic,) = read("<4s")
+    if magic == b"BAI\1":
+        min_shift, depth = 14, 5
+    elif magic == b"CSI\1":
+        min_shift, depth, l_aux = read("<3i")
+        index_file.read(l_aux)
+    else:
+        raise ValueError("Not a BAI or CSI file")
+    first_leaf = ((1 << (3 * depth)) - 1) // 7
+    pseudo_bin = ((1 << (3 * depth + 3)) - 1) // 7 + 1
+    (n_ref,) = read("<i")
+    for ref_name in ref_names[:n_ref]:
+        (n_bin,) = read("<i")
+        for _ in range(n_bin):
+            if magic == b"BAI\1":
+                bin_no, n_chunk = read("<Ii")
+            else:
+                bin_no, _, n_chunk = read("<IQi")
+            cost = 0.0
+            for _ in range(n_chunk):
+                beg, end = read("<QQ")
+                cost += (end >> 16) - (beg >> 16) + ((end & 0xFFFF) - (beg & 0xFFFF)) / 4.0
+            if first_leaf <= bin_no < pseudo_bin and cost > 0:
+                begin = (bin_no - first_leaf) << min_shift
+                yield ref_name, begin, begin + (1 << min_shift), cost
+        if magic == b"BAI\1":
+            (n_intv,) = read("<i")
+            index_file.read(8 * n_intv)
+
+
+def build_cost_bins(contigs, balance_by, paths, bin_size=COST_BIN_SIZE):
+    """Return ``dict`` mapping contig name to list of costs of its bins of size ``bin_size``
+
+    ``contigs`` is a list of ``(chrom, length)`` pairs.  Depending on ``balance_by``, ``paths``
+    are the FASTA or BED files with the gaps (``"gaps"``, cost is the number of non-gap bases),
+    the BED files with the targets (``"targets"``, cost is the number of target bases plus
+    ``OFF_TARGET_COST`` per base), or the BAM files (``"bam_index"``, cost from the BAM index).
+    """
+    weight = {"gaps": 1.0, "targets": OFF_TARGET_COST, "bam_index": 0.0}[balance_by]
+    lengths = dict(contigs)
+    result = {
+        chrom: [weight * min(bin_size, length - i) for i in range(0, length, bin_size)]
+        for chrom, length in contigs
+    }
+
+    def add(chrom, begin, end, value):
+        """Add ``value`` per base of the interval to the bins"""
+        if chrom not in result:
+            return
+        begin, end = max(begin, 0), min(end, lengths[chrom])
+        for i in range(begin // bin_size, (end - 1) // bin_size + 1):
+            overlap = min(end, (i + 1) * bin_size) - max(begin, i * bin_size)
+            if overlap > 0:
+                result[chrom][i] += value * overlap
+
+    for path in paths:
+        if balance_by == "bam_index":
+            for chrom, begin, end, cost in yield_bam_index_costs(path):
+                add(chrom, begin, end, cost / (end - begin))
+            continue
+        with open_text(path) as inputf:
+            if balance_by == "gaps" and ".bed" not in os.path.basename(path):
+                intervals = yield_fasta_gaps(inputf)
+            else:
+                intervals = yield_bed_intervals(inputf)
+            for chrom, begin, end in intervals:
+                add(chrom, begin, end, -1.0 if balance_by == "gaps" else 1.0)
+    return result
+
+
+def split_balanced(length, bins, bin_size, target_cost, slack=BALANCE_SLACK):
+    """Yield ``(begin, end)`` windows of a contig with roughly ``target_cost`` each
+
+    A window is closed once its cost exceeds ``(1 + slack) * target_cost``.  It is cut in the
+    middle of the cheapest bin (e.g., an assembly gap) from the ones where its cost lies within
+    ``slack`` of ``target_cost``, preferring bins closer to ``target_cost``.
+    """
+    begin, begin_cost, cost, best = 0, 0.0, 0.0, None
+    for i, bin_cost in enumerate(bins):
+        bin_length = min(bin_size, length - i * bin_size)
+        middle_cost = cost + bin_cost / 2
+        cost += bin_cost
+        if middle_cost - begin_cost >= (1 - slack) * target_cost:
+            key = (bin_cost / bin_length, abs(middle_cost - begin_cost - target_cost))
+            if best is None or key < best[0]:
+                best = (key, i * bin_size + bin_length // 2, middle_cost)
+        if cost - begin_cost > (1 + slack) * target_cost and best:
+            _, cut, cut_cost = best
+            if begin < cut < length:
+                yield begin, cut
+                begin, begin_cost = cut, cut_cost
+            best = None
+    yield begin, length
+
+
+def yield_balanced_regions(
+    fai_file, window_size, cost_bins, ignore_chroms=None, padding=0, bin_size=COST_BIN_SIZE
+):
+    """Yield GenomeRegion objects of roughly equal cost
+
+    The number of windows is approximately the one of ``yield_regions()`` with ``window_size``
+    but the windows are cut by the costs in ``cost_bins`` (see ``build_cost_bins()``) such that
+    each window has about the same cost.  Contigs cheaper than this are not split.
+    """
+    contigs = list(yield_fai_contigs(fai_file, ignore_chroms))
+    num_windows = sum(math.ceil(length / window_size) for _, length in contigs)
+    total_cost = sum(sum(cost_bins.get(chrom, [])) for chrom, _ in contigs)
+    for chrom, length in contigs:
+        if total_cost > 0 and chrom in cost_bins:
+            windows = split_balanced(length, cost_bins[chrom], bin_size, total_cost / num_windows)
+        else:
+            windows = ((b, min(b + window_size, length)) for b in range(0, length, window_size))
+        for begin, end in windows:
+            yield GenomeRegion(chrom, max(begin - padding, 0), min(end + padding, length))
+
+
 def run(args):
     """Main entry point after parsing command line arguments"""
     yielded = 0
-    for region in yield_regions(
-        args.fai_file, args.window_size, args.subtract_end, args.ignore_chroms
-    ):
+    if args.balance_by:
+        contigs = list(yield_fai_contigs(args.fai_file, args.ignore_chroms))
+        args.fai_file.seek(0)
+        cost_bins = build_cost_bins(contigs, args.balance_by, args.balance_files)
+        regions = yield_balanced_regions(
+            args.fai_file, args.window_size, cost_bins, args.ignore_chroms
+        )
+    else:
+        regions = yield_regions(
+            args.fai_file, args.window_size, args.subtract_end, args.ignore_chroms
+        )
+    for region in regions:
         if args.format == "regions":
             print(region.human_readable(), file=args.output_file)
         else:  # args.format == 'bed'
@@ -127,6 +371,21 @@ def create_parser():
     parser.add_argument(
         "--count", default=0, type=int, help="Number of windows to limit to, if any"
     )
+    parser.add_argument(
+        "--balance-by",
+        choices=CHOICES_BALANCE_BY,
+        help="Cut windows of roughly equal estimated cost instead of equal length",
+    )
+    parser.add_argument(
+        "--balance-file",
+        dest="balance_files",
+        default=[],
+        action="append",
+        help=(
+            "FASTA or BED file with gaps, BED file with targets, or indexed BAM file for "
+            "--balance-by, can be given multiple times"
+        ),
+    )
     return parser
 
 
@@ -135,6 +394,8 @@ def main(argv=None):
     parser = create_parser()
     args = parser.parse_args(argv)
     args.ignore_chroms = [item for sublist in args.ignore_chroms for item in sublist]
+    if args.balance_by and not args.balance_files:
+        parser.error("--balance-by requires --balance-file")
     run(args)
 
 
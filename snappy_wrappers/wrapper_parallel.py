@@ -9,10 +9,13 @@ from collections.abc import MutableMapping, MutableSequence
 import contextlib
 import datetime
 import functools
+import glob
+import hashlib
 import itertools
 import json
 import logging
 import os
+import resource
 import shlex
 import shutil
 import sys
@@ -21,10 +24,20 @@ import textwrap
 
 from snakemake import snakemake
 
-from snappy_wrappers.tools.genome_windows import yield_regions
+from snappy_wrappers.genome_regions import GenomeRegion
+from snappy_wrappers.tools.genome_windows import (
+    build_cost_bins,
+    yield_balanced_regions,
+    yield_fai_contigs,
+    yield_regions,
+)
 
 __author__ = "Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>"
 
+#: Number of file handles to keep free when limiting the fan-in of the merge tree by the open
+#: file limit
+MERGE_RESERVED_FILES = 24
+
 
 @contextlib.contextmanager
 def in_working_dir(path, print_chdir=False):
@@ -142,9 +155,24 @@ def days(num):
 
 
 class ResourceUsage:
-    """Representation of resource usage for a job"""
+    """Representation of resource usage for a job
+
+    On each retry of the job, memory and duration are multiplied by ``retry_mult_memory`` and
+    ``retry_mult_time``, up to ``max_memory`` and ``max_duration`` (if given).
+    """
 
-    def __init__(self, cores=1, memory=mib(100), duration=hours(1), nodes=1, more={}):
+    def __init__(
+        self,
+        cores=1,
+        memory=mib(100),
+        duration=hours(1),
+        nodes=1,
+        more={},
+        retry_mult_memory=1,
+        retry_mult_time=1,
+        max_memory=None,
+        max_duration=None,
+    ):
         #: number of cores to reserve
         self.cores = cores
         #: maximal memory to use in total (in bytes)
@@ -155,6 +183,26 @@ class ResourceUsage:
         self.nodes = nodes
         #: other resource usages
         self.more = dict(more)
+        #: multiplier for memory on each retry
+        self.retry_mult_memory = retry_mult_memory
+        #: multiplier for duration on each retry
+        self.retry_mult_time = retry_mult_time
+        #: cap for the memory of retries (in bytes), ``None`` for no cap
+        self.max_memory = max_memory
+        #: cap for the duration of retries, ``None`` for no cap
+        self.max_duration = max_duration
+
+    def for_attempt(self, attempt):
+        """Return ``ResourceUsage`` with memory and duration escalated for the given attempt
+        (starting at 1).
+        """
+        memory = int(self.memory * self.retry_mult_memory ** (attempt - 1))
+        duration = self.duration * self.retry_mult_time ** (attempt - 1)
+        if self.max_memory:
+            memory = max(self.memory, min(memory, self.max_memory))
+        if self.max_duration:
+            duration = max(self.duration, min(duration, self.max_duration))
+        return ResourceUsage(self.cores, memory, duration, self.nodes, self.more)
 
     def __str__(self):
         tpl = "ResourceUsage(cores={}, memory={}, duration={}, " "nodes={}, more={})"
@@ -174,10 +222,14 @@ class ResourceUsageConverter:
         #: resource usage to convert
         self.res_usage = res_usage
 
-    def to_res_dict(self):
-        """Convert ResourceUsage into a dict for usage in Snakefiles"""
+    def to_res_dict(self, attempt=1):
+        """Convert ResourceUsage for the given attempt into a dict for usage in Snakefiles"""
         raise NotImplementedError()
 
+    def to_res_dicts(self, num_attempts):
+        """Return list with the result of ``to_res_dict()`` for each of ``num_attempts``"""
+        return [self.to_res_dict(attempt) for attempt in range(1, num_attempts + 1)]
+
 
 class SgeResourceUsageConverter(ResourceUsageConverter):
     """Converter for Slurm"""
@@ -191,18 +243,19 @@ class SgeResourceUsageConverter(ResourceUsageConverter):
             "--mem=%s" % int(res["mem"]),
         ]
 
-    def to_res_dict(self):
+    def to_res_dict(self, attempt=1):
+        res_usage = self.res_usage.for_attempt(attempt)
         res = {
-            "ntasks": self.res_usage.cores,
-            "time": self._format_duration(),
-            "mem": int(self.res_usage.memory / 1024 / 1024),  # in MiB
+            "ntasks": res_usage.cores,
+            "time": self._format_duration(res_usage.duration),
+            "mem": int(res_usage.memory / 1024 / 1024),  # in MiB
         }
-        res.update(self.res_usage.more)
+        res.update(res_usage.more)
         res["mem"] = int(res["mem"])
         return res
 
-    def _format_duration(self):
-        total_seconds = self.res_usage.duration.total_seconds()
+    def _format_duration(self, duration):
+        total_seconds = duration.total_seconds()
         hours = int(total_seconds // 60 // 60)
         total_seconds -= hours * 60 * 60
         minutes = int(total_seconds // 60)
@@ -211,6 +264,27 @@ class SgeResourceUsageConverter(ResourceUsageConverter):
         return "{:0>2}:{:0>2}".format(hours, minutes)
 
 
+def attempt_resource(res_dicts, key, rule_name):
+    """Return Snakemake resource function selecting ``key`` from ``res_dicts`` by attempt.
+
+    ``res_dicts`` contains the result of ``ResourceUsageConverter.to_res_dict()`` for each
+    attempt, the last entry is used for further attempts.  Escalations are logged once per job.
+    """
+    logged = set()
+
+    def func(wildcards, attempt):
+        value = res_dicts[min(attempt, len(res_dicts)) - 1][key]
+        job = "{} ({})".format(rule_name, ", ".join("%s=%s" % kv for kv in wildcards.items()))
+        if value != res_dicts[0][key] and (job, attempt) not in logged:
+            logged.add((job, attempt))
+            logging.getLogger(__name__).info(
+                "Escalating %s of %s to %s on attempt %d", key, job, value, attempt
+            )
+        return value
+
+    return func
+
+
 class SnakemakeExecutionFailed(Exception):
     """Raised when nested snakemake execution failed"""
 
@@ -223,6 +297,7 @@ def run_snakemake(
     max_status_checks_per_second=0,
     job_name_token="",
     drmaa_snippet="",
+    rerun_incomplete=False,
 ):
     """Given a pipeline step's configuration, launch sequential or parallel Snakemake"""
     if config["use_drmaa"]:
@@ -231,7 +306,7 @@ def run_snakemake(
                 num_jobs=config["num_jobs"], cwd=os.getcwd()
             )
         )
-        os.mkdir(os.path.join(os.getcwd(), "slurm_log"))
+        os.makedirs(os.path.join(os.getcwd(), "slurm_log"), exist_ok=True)
         values = {"cwd": os.getcwd(), "drmaa_snippet": drmaa_snippet}
         drmaa_string = (
             " --mem={cluster.mem} --time={cluster.time} "
@@ -270,7 +345,8 @@ def run_snakemake(
                                 max_status_checks_per_second
                                 or config["max_status_checks_per_second"]
                             ),
-                        ],
+                        ]
+                        + (["--rerun-incomplete"] if rerun_incomplete else []),
                     )
                 ),
                 file=f_call,
@@ -287,6 +363,7 @@ def run_snakemake(
             max_status_checks_per_second=max_status_checks_per_second
             or config["max_status_checks_per_second"],
             restart_times=config["restart_times"],
+            force_incomplete=rerun_incomplete,
             verbose=True,
             use_conda=False,  # has to be done externally (no locking if True here) and is!
         )
@@ -302,6 +379,7 @@ def run_snakemake(
             max_jobs_per_second=config["max_jobs_per_second"],
             max_status_checks_per_second=config["max_status_checks_per_second"],
             restart_times=config["restart_times"],
+            force_incomplete=rerun_incomplete,
             verbose=True,
             use_conda=False,  # has to be done externally (no locking if True here) and is!
         )
@@ -321,6 +399,66 @@ def to_plain_python(obj):
         return obj
 
 
+def get_file_md5(path):
+    """Return hex MD5 sum of the file at ``path``"""
+    md5 = hashlib.md5()
+    with open(path, "rb") as inputf:
+        for block in iter(lambda: inputf.read(1024 * 1024), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def _get_chunk_files(chunk_dir, manifest_path):
+    """Return ``dict`` with paths (relative to ``chunk_dir``) and sizes of the chunk's files"""
+    result = {}
+    for dirpath, dirnames, filenames in os.walk(chunk_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            if os.path.abspath(path) != os.path.abspath(manifest_path):
+                result[os.path.relpath(path, chunk_dir)] = os.path.getsize(path)
+    return result
+
+
+def write_chunk_manifest(path, region, chunk_params):
+    """Write manifest of the completed chunk whose files are in the directory of ``path``
+
+    The manifest records the size and MD5 sum of each file together with the chunk's entry of
+    the region table and the params shared by all chunks.
+    """
+    chunk_dir = os.path.dirname(path)
+    files = {
+        name: {"size": size, "md5": get_file_md5(os.path.join(chunk_dir, name))}
+        for name, size in _get_chunk_files(chunk_dir, path).items()
+    }
+    manifest = {"region": region, "chunk_params": chunk_params, "files": files}
+    with open(path + ".tmp", "wt") as outputf:
+        json.dump(manifest, outputf, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def check_chunk_manifest(path, region, chunk_params):
+    """Return whether the chunk with the manifest at ``path`` is complete and up to date
+
+    This is the case if the manifest exists, was written for the same region table entry and
+    chunk params, and all files of the chunk have the recorded size and MD5 sum.
+    """
+    if not os.path.exists(path):
+        return False
+    with open(path, "rt") as inputf:
+        manifest = json.load(inputf)
+    if manifest["region"] != region or manifest["chunk_params"] != chunk_params:
+        return False
+    chunk_dir = os.path.dirname(path)
+    sizes = _get_chunk_files(chunk_dir, path)
+    if sizes != {name: entry["size"] for name, entry in manifest["files"].items()}:
+        return False
+    return all(
+        get_file_md5(os.path.join(chunk_dir, name)) == entry["md5"]
+        for name, entry in manifest["files"].items()
+    )
+
+
 class ParallelBaseWrapper:
     """Base class for parallel wrapper classes.
 
@@ -424,6 +562,39 @@ class ParallelBaseWrapper:
     def get_job_mult_time(self):
         return self._get_config().get("job_mult_time", 1)
 
+    def get_job_retry_mult_memory(self):
+        return self._get_config().get("job_retry_mult_memory", 1)
+
+    def get_job_retry_mult_time(self):
+        return self._get_config().get("job_retry_mult_time", 1)
+
+    def get_job_retry_max_memory(self):
+        """Return cap for the escalated memory of chunks in GiB, ``0`` for no cap"""
+        return self._get_config().get("job_retry_max_memory", 0)
+
+    def get_job_retry_max_time(self):
+        """Return cap for the escalated running time of chunks in hours, ``0`` for no cap"""
+        return self._get_config().get("job_retry_max_time", 0)
+
+    def get_chunk_resources(self):
+        """Return ``job_resources`` with the escalation on retries from the configuration."""
+        return ResourceUsage(
+            cores=self.job_resources.cores,
+            memory=self.job_resources.memory,
+            duration=self.job_resources.duration,
+            nodes=self.job_resources.nodes,
+            more=self.job_resources.more,
+            retry_mult_memory=self.get_job_retry_mult_memory(),
+            retry_mult_time=self.get_job_retry_mult_time(),
+            max_memory=gib(self.get_job_retry_max_memory()) or None,
+            max_duration=hours(self.get_job_retry_max_time()) or None,
+        )
+
+    def get_chunk_res_dicts(self):
+        """Return resource dicts of the ``chunk`` rule for the first attempt and each restart."""
+        num_attempts = self._get_config().get("restart_times", 0) + 1
+        return self.res_converter(self.get_chunk_resources()).to_res_dicts(num_attempts)
+
     def get_merge_mult_memory(self):
         return self._get_config().get("merge_mult_memory", 1)
 
@@ -436,24 +607,77 @@ class ParallelBaseWrapper:
     def get_ignore_chroms(self):
         return self._get_config()["ignore_chroms"]
 
+    def get_window_balancing(self):
+        """Return the cost proxy for balancing the windows (see ``CHOICES_BALANCE_BY`` in
+        ``snappy_wrappers.tools.genome_windows``) or ``None`` for windows of fixed length
+        """
+        return self._get_config().get("window_balancing") or None
+
+    def get_balancing_files(self):
+        """Return paths to the files to compute the window costs from.
+
+        This is the BED file from the configuration (``window_balancing_bed``) if any, otherwise
+        the reference FASTA for ``"gaps"`` and the input BAM files for ``"bam_index"``.
+        """
+        balance_by = self.get_window_balancing()
+        if self._get_config().get("window_balancing_bed"):
+            return [self._get_config()["window_balancing_bed"]]
+        elif balance_by == "gaps":
+            return [self.snakemake.config["static_data_config"]["reference"]["path"]]
+        elif balance_by == "bam_index":
+            return [path for path in self.snakemake.input if str(path).endswith(".bam")]
+        else:
+            raise ValueError("window_balancing_bed must be set for balancing by %s" % balance_by)
+
     @functools.lru_cache(maxsize=16)
     def get_regions(self):
-        """Return regions to process.
+        """Return regions to process, the windows of ``get_core_regions()`` padded by
+        ``window_padding``.
+        """
+        with open(self.get_fai_path(), "rt") as fai_file:
+            lengths = dict(yield_fai_contigs(fai_file))
+        return [
+            GenomeRegion(
+                region.chrom,
+                max(region.begin - self.window_padding, 0),
+                min(region.end + self.window_padding, lengths[region.chrom]),
+            )
+            for region in self.get_core_regions()
+        ]
+
+    @functools.lru_cache(maxsize=16)
+    def get_core_regions(self):
+        """Return the disjoint windows to process, without padding.
 
         This is constructed from the FAI (returned by ``get_fai_path()``), the window length (as
         returned by ``get_window_length()``, and the chromosomes to ignore
-        (``get_ignore_chroms()``).
+        (``get_ignore_chroms()``).  If ``get_window_balancing()`` is set, the windows are cut
+        such that they have roughly equal estimated cost rather than equal length.
         """
         self.logger.info("Loading regions from FAI at %s", self.get_fai_path())
         with open(self.get_fai_path(), "rt") as fai_file:
-            result = list(
-                yield_regions(
+            if self.get_window_balancing():
+                contigs = list(yield_fai_contigs(fai_file, self.get_ignore_chroms()))
+                fai_file.seek(0)
+                self.logger.info(
+                    "Balancing windows by %s from %s",
+                    self.get_window_balancing(),
+                    self.get_balancing_files(),
+                )
+                cost_bins = build_cost_bins(
+                    contigs, self.get_window_balancing(), self.get_balancing_files()
+                )
+                regions = yield_balanced_regions(
                     fai_file,
                     self.get_window_length(),
+                    cost_bins,
                     ignore_chroms=self.get_ignore_chroms(),
-                    padding=self.window_padding,
                 )
-            )
+            else:
+                regions = yield_regions(
+                    fai_file, self.get_window_length(), ignore_chroms=self.get_ignore_chroms()
+                )
+            result = list(regions)
         # Users can truncate to a number of tokens by specifying in the configuration.
         self.logger.debug("Raw region list is %s", result)
         if self._get_config().get("debug_trunc_tokens", 0):
@@ -476,30 +700,58 @@ class ParallelBaseWrapper:
         """Return preamble for Snakefile.
 
         The default preamble configure shell executable to bash, sets prefix to ``"set -ex;"``,
-        loads configuration, and starts with local rule ``all``.
+        loads configuration and region table, defines the params of the ``chunk`` rule, and
+        starts with local rule ``all``.
         """
         return (
             textwrap.dedent(
                 r"""
+            import json
+
             shell.executable("/bin/bash")
             shell.prefix("set -ex;")
 
             configfile: 'config.json'
 
+            with open('regions.json', 'rt') as inputf:
+                REGIONS = json.load(inputf)
+
+            # The ``args`` param of the chunk with number ``{{jobno}}``, updated for its region
+            def chunk_args(wildcards):
+                args = config['chunk_params'].get('args', {{}})
+                return dict(args, **REGIONS[int(wildcards.jobno)]['args'])
+
+            chunk_params = dict(config['chunk_params'], args=chunk_args)
+
             localrules: all
 
             rule all:
-                input: **{all_output}
+                input: {manifests}**{all_output}
         """
             )
             .lstrip()
-            .format(all_output=repr(self.get_all_output()))
+            .format(
+                all_output=repr(self.get_all_output()),
+                manifests=(
+                    "expand('job_out.{jobno}.d/manifest.json', jobno=range(len(REGIONS))), "
+                    if self.is_resumable()
+                    else ""
+                ),
+            )
         )
 
     def get_all_output(self):
         """Return overall output."""
         raise NotImplementedError("Override me!")
 
+    def get_chunk_params(self):
+        """Return params shared by all chunks, written to ``config.json``."""
+        return dict(self.snakemake.params)
+
+    def get_chunk_args(self, region):
+        """Return ``dict`` to update the ``args`` param with for the chunk of ``region``."""
+        return {"intervals": [region.human_readable()]}
+
     def construct_parallel_rules(self):
         """Construct parallel rules."""
         raise NotImplementedError("Override me!")
@@ -508,6 +760,25 @@ class ParallelBaseWrapper:
         """Construct rule for merging chunks."""
         raise NotImplementedError("Override me!")
 
+    def construct_manifest_rule(self):
+        """Construct local rule writing the manifest of a completed chunk for resumable runs."""
+        return textwrap.dedent(
+            r"""
+            localrules: chunk_manifest
+
+            rule chunk_manifest:
+                input: 'job_out.{jobno}.d/.done'
+                output: 'job_out.{jobno}.d/manifest.json'
+                wildcard_constraints:
+                    jobno=r'\d+'
+                run:
+                    from snappy_wrappers.wrapper_parallel import write_chunk_manifest
+                    write_chunk_manifest(
+                        output[0], REGIONS[int(wildcards.jobno)], config['chunk_params']
+                    )
+            """
+        ).lstrip()
+
     def construct_epilogue(self):
         """Return epilogue for Snakefile, default is to return empty string"""
         return ""
@@ -517,6 +788,7 @@ class ParallelBaseWrapper:
             itertools.chain(
                 ["# PREAMBLE", self.construct_preamble(), "# PARALLEL WORK"],
                 self.construct_parallel_rules(),
+                [self.construct_manifest_rule()] if self.is_resumable() else [],
                 [
                     "# JOIN PARALLEL RESULTS",
                     self.construct_merge_rule(),
@@ -536,10 +808,31 @@ class ParallelBaseWrapper:
             else:
                 return self.step_name
 
+    def is_resumable(self):
+        """Return whether to run in the persistent working directory ``get_resume_dir()``."""
+        return self._get_config().get("resumable", False)
+
+    def get_resume_dir(self):
+        """Return the working directory for resumable runs, derived from the first output file."""
+        output = os.path.realpath(self.snakemake.output[0])
+        return os.path.join(
+            os.path.dirname(output), ".{}.parallel_work.d".format(os.path.basename(output))
+        )
+
     def run(self):
         # The setup of the temporary directory depends on whether it is to be kept (for debugging
         # purposes) or not.
         keep_tmpdir = self._get_config().get("keep_tmpdir", "never")
+        # Resumable runs use a persistent directory that is kept on errors.
+        if self.is_resumable():
+            tmpdir = self.get_resume_dir()
+            self.logger.info("Running resumable in directory %s", tmpdir)
+            os.makedirs(tmpdir, exist_ok=True)
+            self._do_run(tmpdir)
+            if keep_tmpdir != "always":
+                self.logger.info("Ran through successfully, cleaning up %s...", tmpdir)
+                shutil.rmtree(tmpdir)
+            return self  # short-circuit
         # Either run with TemporaryDirectory as context manager and auto-cleanup on exit or
         # create temporary directory using mkdtemp().
         if keep_tmpdir == "never":
@@ -581,17 +874,62 @@ class ParallelBaseWrapper:
         """
         with in_working_dir(tmpdir, print_chdir=True):
             self._write_config_file()
+            self._write_region_table()
+            if self.is_resumable():
+                self._prepare_resume()
             self._write_snakefile()
             self._launch_execution()
 
     def _write_config_file(self):
-        """Write out the configuration file (dump of ``snakemake.config``)."""
+        """Write out the configuration file (dump of ``snakemake.config`` and chunk params)."""
+        config = to_plain_python(self.snakemake.config)
+        config["chunk_params"] = to_plain_python(self.get_chunk_params())
         with open("config.json", "wt") as configfile:
             self.logger.info(
                 "Writing config.json with content >>>%s<<<",
-                json.dumps(to_plain_python(self.snakemake.config), indent="  ", sort_keys=True),
+                json.dumps(config, indent="  ", sort_keys=True),
             )
-            json.dump(to_plain_python(self.snakemake.config), configfile)
+            json.dump(config, configfile)
+
+    def _write_region_table(self):
+        """Write out the region table by job number.
+
+        For each chunk, the table has the update of the ``args`` param (``"args"``) and the
+        window without padding (``"core"``).
+        """
+        table = [
+            {"args": self.get_chunk_args(region), "core": core.human_readable(False)}
+            for region, core in zip(self.get_regions(), self.get_core_regions())
+        ]
+        with open("regions.json", "wt") as regionfile:
+            json.dump(table, regionfile)
+
+    def _prepare_resume(self):
+        """Remove the results of chunks without valid manifest and of merging from earlier runs.
+
+        Thus, the nested Snakemake only runs the missing chunks and the merging.  The locks of an
+        earlier nested Snakemake that was killed together with the job are removed as well, the
+        directory is owned by this job.
+        """
+        if os.path.exists(os.path.join(".snakemake", "locks")):
+            self.logger.info("Removing stale locks of earlier run in .snakemake/locks")
+            shutil.rmtree(os.path.join(".snakemake", "locks"))
+        with open("config.json", "rt") as configfile:
+            chunk_params = json.load(configfile)["chunk_params"]
+        with open("regions.json", "rt") as regionfile:
+            table = json.load(regionfile)
+        num_done = 0
+        for jobno, region in enumerate(table):
+            chunk_dir = "job_out.{}.d".format(jobno)
+            manifest_path = os.path.join(chunk_dir, "manifest.json")
+            if check_chunk_manifest(manifest_path, region, chunk_params):
+                num_done += 1
+            elif os.path.exists(chunk_dir):
+                self.logger.info("Removing incomplete or outdated chunk %s", chunk_dir)
+                shutil.rmtree(chunk_dir)
+        for merge_dir in glob.glob("merge_out.*.d"):
+            shutil.rmtree(merge_dir)
+        self.logger.info("Resuming with %d of %d chunks completed", num_done, len(table))
 
     def _write_snakefile(self):
         with open("Snakefile", "wt") as snakefile:
@@ -607,6 +945,7 @@ class ParallelBaseWrapper:
             "drmaa_snippet": (
                 self._get_config()["drmaa_snippet"] or self._get_step_config()["drmaa_snippet"]
             ),
+            "rerun_incomplete": self.is_resumable(),
         }
         self.logger.info("Launching excecution with args: %s", repr(kwargs))
         run_snakemake(self._get_config(), **kwargs)
@@ -618,8 +957,15 @@ class ParallelVcfOutputBaseWrapper(ParallelBaseWrapper):
     #: The maximal number of files to merge in one go.  This must be lower than the maximal number
     #: of files that can be open on the system.  Thus, 1000 is a good default value.  We probably
     #: do not need to have a per-workflow or per-tool tuning algorithm in the step configuration.
+    #: ``get_merge_block_size()`` further limits this by the open file limit.
     merge_block_size = 1000
 
+    #: Whether to trim the chunks to their windows without padding in the parallel jobs and
+    #: concatenate them with ``bcftools concat --naive``, i.e., without recompression.  Otherwise,
+    #: the chunks are merged with ``bcftools concat --allow-overlaps``.  Wrappers whose chunks
+    #: have other files than the VCF file to merge must disable this.
+    merge_naive = True
+
     #: Relative path to wrapper to use.
     inner_wrapper = None
 
@@ -638,41 +984,177 @@ class ParallelVcfOutputBaseWrapper(ParallelBaseWrapper):
         """Return dict with overall output."""
         return {key: getattr(self.snakemake.output, key) for key in self.key_ext.keys()}
 
+    def get_chunk_input(self):
+        """Return input of the ``chunk`` rule, a list or a ``dict``."""
+        raise NotImplementedError("Override me!")
+
+    def construct_parallel_rules(self):
+        """Construct the rules for parallel processing.
+
+        A single rule ``chunk`` processes the window with number ``{jobno}``.  Its region is
+        read from the region table and the params shared by all chunks from ``config.json``.
+        Memory and time of the chunks are Snakemake resources depending on the attempt, the
+        cluster configuration refers to them.
+
+        With ``use_naive_merge()``, the rule ``trim_chunk`` trims the temporary result of the
+        chunk to its window without padding, such that merging is a plain concatenation.
+        """
+        input_ = self.get_chunk_input()
+        res_dicts = self.get_chunk_res_dicts()
+        trim = self.use_naive_merge()
+        out_dir = "untrimmed_out.{jobno}.d" if trim else "job_out.{jobno}.d"
+        output = {
+            key: "{out_dir}/out/tmp_{jobno}.{ext}".format(out_dir=out_dir, jobno="{jobno}", ext=ext)
+            for key, ext in self.key_ext.items()
+        }
+        if trim:
+            output_ = "**{%s}" % ", ".join("%r: temp(%r)" % item for item in output.items())
+        else:
+            output_ = 'touch("job_out.{jobno}.d/.done"),\n        **' + repr(output)
+        vals = {
+            "input_": ("**" if isinstance(input_, dict) else "") + repr(input_),
+            "output": output_,
+            "group": "\n    group: 'chunk'" if trim else "",
+            "wrapper_prefix": "file://" + self.wrapper_base_dir,
+            "inner_wrapper": self.inner_wrapper,
+            "res_dicts": repr(res_dicts),
+            "resources": repr(dict(res_dicts[0], mem="{resources.mem}", time="{resources.time}")),
+        }
+        yield textwrap.dedent(
+            r"""
+            from snappy_wrappers.wrapper_parallel import attempt_resource
+
+            # Resources of the chunk rule by attempt, memory and time are escalated on retries
+            CHUNK_RESOURCES = {res_dicts}
+
+            rule chunk:
+                input:
+                    {input_},
+                output:
+                    {output}
+                params:
+                    **chunk_params
+                resources:
+                    mem=attempt_resource(CHUNK_RESOURCES, 'mem', 'chunk'),
+                    time=attempt_resource(CHUNK_RESOURCES, 'time', 'chunk'),{group}
+                wildcard_constraints:
+                    jobno=r"\d+"
+                wrapper: '{wrapper_prefix}/snappy_wrappers/wrappers/{inner_wrapper}'
+
+            cluster_config['chunk'] = {resources}
+        """
+        ).format(**vals).lstrip()
+        if trim:
+            yield self._construct_trim_rule()
+
+    def _construct_trim_rule(self):
+        """Return rule ``trim_chunk`` that trims the result of chunk ``{jobno}`` to its window.
+
+        The rule is in the group of the ``chunk`` rule and has the same resources, such that
+        both run in one cluster job.
+        """
+        return textwrap.dedent(
+            r"""
+            rule trim_chunk:
+                input:
+                    vcf='untrimmed_out.{jobno}.d/out/tmp_{jobno}.vcf.gz',
+                output:
+                    touch('job_out.{jobno}.d/.done'),
+                    vcf='job_out.{jobno}.d/out/tmp_{jobno}.vcf.gz',
+                    tbi='job_out.{jobno}.d/out/tmp_{jobno}.vcf.gz.tbi',
+                params:
+                    core=lambda wildcards: REGIONS[int(wildcards.jobno)]['core'],
+                resources:
+                    mem=attempt_resource(CHUNK_RESOURCES, 'mem', 'trim_chunk'),
+                    time=attempt_resource(CHUNK_RESOURCES, 'time', 'trim_chunk'),
+                group: 'chunk'
+                wildcard_constraints:
+                    jobno=r"\d+"
+                shell:
+                    r'''
+                    set -euo pipefail  # inofficial Bash strict mode
+
+                    bcftools view --no-version -t {params.core} -O z -o {output.vcf} {input.vcf}
+                    tabix -f {output.vcf}
+                    '''
+            """
+        ).lstrip()
+
+    def get_merge_block_size(self):
+        """Return the fan-in of the merge tree, ``merge_block_size`` limited by the open file
+        limit.
+        """
+        soft_limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft_limit == resource.RLIM_INFINITY:
+            return self.merge_block_size
+        else:
+            return max(2, min(self.merge_block_size, soft_limit - MERGE_RESERVED_FILES))
+
+    def use_naive_merge(self):
+        """Return whether to concatenate with ``bcftools concat --naive``.
+
+        This is the case if ``merge_naive`` is set and the windows without padding are disjoint
+        and grouped by chromosome.
+        """
+        if not self.merge_naive:
+            return False
+        cores = self.get_core_regions()
+        pairs = list(zip(cores, cores[1:]))
+        num_runs = 1 + sum(1 for a, b in pairs if a.chrom != b.chrom)
+        return all(a.chrom != b.chrom or a.end <= b.begin for a, b in pairs) and (
+            not cores or num_runs == len({region.chrom for region in cores})
+        )
+
     def construct_merge_rule(self):
-        """Join the overall result files"""
+        """Join the overall result files
+
+        The chunks are merged in a tree with a fan-in of ``get_merge_block_size()``, the inner
+        nodes of all levels are numbered consecutively.
+        """
         # Get list of parallel result ``.done`` files and transform into ``*.vcf.gz``.
         merge_input = [
             os.path.join(os.path.dirname(p), "out", "tmp_{}.vcf.gz".format(i))
             for i, p in enumerate(self.construct_parallel_result_files())
         ]
-        # Distinguish cases of more than two levels, two levels, and one levels for merging.
-        if len(merge_input) > self.merge_block_size * self.merge_block_size:
-            # Too many files (>1M with merge_block_size of 1k)
-            raise Exception("Number of output file requires more than two mergin steps!")
-        elif len(merge_input) > self.merge_block_size:
-            # We need two merge passes.
-            merge_outputs = [
-                "merge_out.{}.d/out/out.vcf.gz".format(i)
-                for i in range(  # ceiled integer division below
-                    (len(merge_input) + self.merge_block_size - 1) // self.merge_block_size
-                )
-            ]
-            # Compute breaks (sequence of ``[start, end)`` for splitting merge_input into blocks).
-            breaks = list(range(0, len(merge_input), self.merge_block_size)) + [len(merge_input)]
-            return "\n\n".join(
-                itertools.chain(
-                    [
-                        self._construct_level_one_merge_rule(chunk_no, merge_input[start:end])
-                        for chunk_no, (start, end) in enumerate(zip(breaks, breaks[1:]))
-                    ],
-                    [self._construct_final_merge_rule(merge_outputs)],
+        block_size = self.get_merge_block_size()
+        rules = []
+        while len(merge_input) > block_size:
+            merge_outputs = []
+            for start in range(0, len(merge_input), block_size):
+                chunk_no = len(rules)
+                rules.append(
+                    self._construct_inner_merge_rule(
+                        chunk_no, merge_input[start : start + block_size]
+                    )
                 )
-            )
-        else:
-            # We can do with one merge pass.
-            return self._construct_final_merge_rule(merge_input)
+                merge_outputs.append("merge_out.{}.d/out/out.vcf.gz".format(chunk_no))
+            merge_input = merge_outputs
+        rules.append(self._construct_final_merge_rule(merge_input))
+        return "\n\n".join(rules)
+
+    def _construct_concat_command(self, output):
+        """Return Bash command for concatenating the files ``{input}`` of a merge rule to
+        ``output``.
 
-    def _construct_level_one_merge_rule(self, chunk_no, merge_input):
+        With ``use_naive_merge()``, the chunks have been trimmed to their windows without padding
+        by ``trim_chunk`` and are concatenated without recompression.
+        """
+        if self.use_naive_merge():
+            tpl = r"""
+                bcftools concat --naive -o {output} {{input}}
+                """
+        else:
+            tpl = r"""
+                bcftools concat \
+                    --allow-overlaps \
+                    -d none \
+                    -o {output} \
+                    -O z \
+                    {{input}}
+                """
+        return textwrap.dedent(tpl).strip().format(output=output)
+
+    def _construct_inner_merge_rule(self, chunk_no, merge_input):
         return (
             textwrap.dedent(
                 r"""
@@ -685,12 +1167,7 @@ class ParallelVcfOutputBaseWrapper(ParallelBaseWrapper):
                     r'''
                     set -euo pipefail  # inofficial Bash strict mode
 
-                    bcftools concat \
-                        --allow-overlaps \
-                        -d none \
-                        -o {{output.vcf}} \
-                        -O z \
-                        {{input}}
+                    {concat}
 
                     tabix -f {{output.vcf}}
                     '''
@@ -702,6 +1179,9 @@ class ParallelVcfOutputBaseWrapper(ParallelBaseWrapper):
             .format(
                 chunk_no=chunk_no,
                 chunk_input=repr(merge_input),
+                concat=textwrap.indent(
+                    self._construct_concat_command("{output.vcf}"), " " * 8
+                ).lstrip(),
                 resources=repr(self.res_converter(self.merge_resources).to_res_dict()),
             )
         )
@@ -725,12 +1205,7 @@ class ParallelVcfOutputBaseWrapper(ParallelBaseWrapper):
                     mkdir -p output
 
                     # Concatenate files ---------------------------------------------------
-                    bcftools concat \
-                        --allow-overlaps \
-                        -d none \
-                        -o output/out.vcf.gz \
-                        -O z \
-                        {{input}}
+                    {concat}
 
                     tabix -f output/out.vcf.gz
 
@@ -763,6 +1238,9 @@ class ParallelVcfOutputBaseWrapper(ParallelBaseWrapper):
                 all_input=repr(merge_input),
                 all_output=repr(self.get_all_output()),
                 all_log=repr(self.get_all_log_files()),
+                concat=textwrap.indent(
+                    self._construct_concat_command("output/out.vcf.gz"), " " * 8
+                ).lstrip(),
                 resources=repr(self.res_converter(self.merge_resources).to_res_dict()),
             )
         )
@@ -773,39 +1251,9 @@ class ParallelVariantCallingBaseWrapper(ParallelVcfOutputBaseWrapper):
 
     window_padding = 10000  # >=py36: 10_000
 
-    def construct_parallel_rules(self):
-        """Construct the rules for parallel processing to generate."""
-        for jobno, region in enumerate(self.get_regions()):
-            params = dict(self.snakemake.params)
-            params.setdefault("args", {}).update({"intervals": [region.human_readable()]})
-            output = {
-                key: "job_out.{jobno}.d/out/tmp_{jobno}.{ext}".format(jobno=jobno, ext=ext)
-                for key, ext in self.key_ext.items()
-            }
-            vals = {
-                "input_bam": repr(self.snakemake.input),
-                "jobno": jobno,
-                "params": repr(params),
-                "output": repr(output),
-                "wrapper_prefix": "file://" + self.wrapper_base_dir,
-                "inner_wrapper": self.inner_wrapper,
-                "resources": repr(self.res_converter(self.job_resources).to_res_dict()),
-            }
-            yield textwrap.dedent(
-                r"""
-                rule chunk_{jobno}:
-                    input:
-                        {input_bam},
-                    output:
-                        touch("job_out.{jobno}.d/.done"),
-                        **{output}
-                    params:
-                        **{params}
-                    wrapper: '{wrapper_prefix}/snappy_wrappers/wrappers/{inner_wrapper}'
-
-                cluster_config['chunk_{jobno}'] = {resources}
-            """
-            ).format(**vals).lstrip()
+    def get_chunk_input(self):
+        """Return input of the ``chunk`` rule, the input BAM files."""
+        return list(self.snakemake.input)
 
 
 class ParallelVariantAnnotationBaseWrapper(ParallelVcfOutputBaseWrapper):
@@ -814,46 +1262,12 @@ class ParallelVariantAnnotationBaseWrapper(ParallelVcfOutputBaseWrapper):
     #: Sensible padding when splitting along genome.
     window_padding = 1000  # >=py36: 1_000
 
-    def construct_parallel_rules(self):
-        """Construct the rules for parallel processing to generate."""
-        for jobno, region in enumerate(self.get_regions()):
-            params = dict(self.snakemake.params)
-            params.setdefault("args", {}).update({"intervals": [region.human_readable()]})
-            output = {
-                key: "job_out.{jobno}.d/out/tmp_{jobno}.{ext}".format(jobno=jobno, ext=ext)
-                for key, ext in self.key_ext.items()
-            }
-            vals = {
-                "input_": repr(
-                    {
-                        key: os.path.realpath(
-                            os.path.join(self.main_cwd, getattr(self.snakemake.input, key))
-                        )
-                        for key in ("vcf", "tbi", "ped")
-                    }
-                ),
-                "jobno": jobno,
-                "params": repr(params),
-                "output": repr(output),
-                "wrapper_prefix": "file://" + self.wrapper_base_dir,
-                "inner_wrapper": self.inner_wrapper,
-                "resources": repr(self.res_converter(self.job_resources).to_res_dict()),
-            }
-            yield textwrap.dedent(
-                r"""
-                rule chunk_{jobno}:
-                    input:
-                        **{input_},
-                    output:
-                        touch("job_out.{jobno}.d/.done"),
-                        **{output}
-                    params:
-                        **{params}
-                    wrapper: '{wrapper_prefix}/snappy_wrappers/wrappers/{inner_wrapper}'
-
-                cluster_config['chunk_{jobno}'] = {resources}
-            """
-            ).format(**vals).lstrip()
+    def get_chunk_input(self):
+        """Return input of the ``chunk`` rule, the input VCF and PED files."""
+        return {
+            key: os.path.realpath(os.path.join(self.main_cwd, getattr(self.snakemake.input, key)))
+            for key in ("vcf", "tbi", "ped")
+        }
 
 
 class ParallelSomaticVariantCallingBaseWrapper(ParallelVcfOutputBaseWrapper):
@@ -862,48 +1276,22 @@ class ParallelSomaticVariantCallingBaseWrapper(ParallelVcfOutputBaseWrapper):
     #: Sensible padding when splitting along genome.
     window_padding = 10000  # >=py36: 10_000
 
-    def construct_parallel_rules(self):
-        """Construct the rules for parallel processing to generate."""
-        for jobno, region in enumerate(self.get_regions()):
-            params = dict(self.snakemake.params)
-            params.setdefault("args", {}).update({"intervals": [region.human_readable()]})
-            # The parameters "normal_lib_name" and "tumor_lib_name" are only available for
-            # Mutect 2, thus the conditional assignment.
-            if hasattr(self.snakemake.params, "normal_lib_name"):
-                params["normal_lib_name"] = self.snakemake.params.normal_lib_name
-            if hasattr(self.snakemake.wildcards, "tumor_library"):
-                params["tumor_lib_name"] = self.snakemake.wildcards.tumor_library
-            output = {
-                key: "job_out.{jobno}.d/out/tmp_{jobno}.{ext}".format(jobno=jobno, ext=ext)
-                for key, ext in self.key_ext.items()
-            }
-            vals = {
-                "normal_bam": repr(self.snakemake.input.normal_bam),
-                "tumor_bam": repr(self.snakemake.input.tumor_bam),
-                "jobno": jobno,
-                "params": repr(params),
-                "output": repr(output),
-                "wrapper_prefix": "file://" + self.wrapper_base_dir,
-                "inner_wrapper": self.inner_wrapper,
-                "resources": repr(self.res_converter(self.job_resources).to_res_dict()),
-            }
-            yield textwrap.dedent(
-                r"""
-                rule chunk_{jobno}:
-                    input:
-                        tumor_bam={tumor_bam},
-                        normal_bam={normal_bam},
-                    output:
-                        touch("job_out.{jobno}.d/.done"),
-                        **{output}
-                    params:
-                        **{params}
-                    wrapper: '{wrapper_prefix}/snappy_wrappers/wrappers/{inner_wrapper}'
-
-
-                cluster_config['chunk_{jobno}'] = {resources}
-            """
-            ).format(**vals).lstrip()
+    def get_chunk_input(self):
+        """Return input of the ``chunk`` rule, the tumor and normal BAM files."""
+        return {
+            "tumor_bam": self.snakemake.input.tumor_bam,
+            "normal_bam": self.snakemake.input.normal_bam,
+        }
+
+    def get_chunk_params(self):
+        params = super().get_chunk_params()
+        # The parameters "normal_lib_name" and "tumor_lib_name" are only available for
+        # Mutect 2, thus the conditional assignment.
+        if hasattr(self.snakemake.params, "normal_lib_name"):
+            params["normal_lib_name"] = self.snakemake.params.normal_lib_name
+        if hasattr(self.snakemake.wildcards, "tumor_library"):
+            params["tumor_lib_name"] = self.snakemake.wildcards.tumor_library
+        return params
 
 
 class ParallelSomaticVariantAnnotationBaseWrapper(ParallelVcfOutputBaseWrapper):
@@ -912,43 +1300,9 @@ class ParallelSomaticVariantAnnotationBaseWrapper(ParallelVcfOutputBaseWrapper):
     #: Sensible padding when splitting along genome.
     window_padding = 1000  # >=py36: 1_000
 
-    def construct_parallel_rules(self):
-        """Construct the rules for parallel processing to generate."""
-        for jobno, region in enumerate(self.get_regions()):
-            params = dict(self.snakemake.params)
-            params.setdefault("args", {}).update({"intervals": [region.human_readable()]})
-            output = {
-                key: "job_out.{jobno}.d/out/tmp_{jobno}.{ext}".format(jobno=jobno, ext=ext)
-                for key, ext in self.key_ext.items()
-            }
-            vals = {
-                "input_": repr(
-                    {
-                        key: os.path.realpath(
-                            os.path.join(self.main_cwd, getattr(self.snakemake.input, key))
-                        )
-                        for key in ("vcf", "tbi")
-                    }
-                ),
-                "jobno": jobno,
-                "params": repr(params),
-                "output": repr(output),
-                "wrapper_prefix": "file://" + self.wrapper_base_dir,
-                "inner_wrapper": self.inner_wrapper,
-                "resources": repr(self.res_converter(self.job_resources).to_res_dict()),
-            }
-            yield textwrap.dedent(
-                r"""
-                rule chunk_{jobno}:
-                    input:
-                        **{input_},
-                    output:
-                        touch("job_out.{jobno}.d/.done"),
-                        **{output}
-                    params:
-                        **{params}
-                    wrapper: '{wrapper_prefix}/snappy_wrappers/wrappers/{inner_wrapper}'
-
-                cluster_config['chunk_{jobno}'] = {resources}
-            """
-            ).format(**vals).lstrip()
+    def get_chunk_input(self):
+        """Return input of the ``chunk`` rule, the input VCF files."""
+        return {
+            key: os.path.realpath(os.path.join(self.main_cwd, getattr(self.snakemake.input, key)))
+            for key in ("vcf", "tbi")
+        }
@@ -6,7 +6,6 @@ isort:skip_file
 
 import os
 import sys
-import textwrap
 
 from snakemake import shell
 
@@ -44,50 +43,15 @@ class ParallelEasyBayesFilterWrapper(ParallelVcfOutputBaseWrapper):
             duration=hours(4 * self.get_merge_mult_time()),
         )
 
-    def construct_parallel_rules(self):
-        """Construct the rules for parallel processing to generate."""
-        for jobno, region in enumerate(self.get_regions()):
-            params = dict(self.snakemake.params)
-            params.setdefault("args", {}).update({"interval": region.human_readable(False)})
-            output = {
-                key: "job_out.{jobno}.d/out/tmp_{jobno}.{ext}".format(jobno=jobno, ext=ext)
-                for key, ext in self.key_ext.items()
-            }
-            vals = {
-                "input_vcf": repr(
-                    os.path.realpath(os.path.join(self.main_cwd, self.snakemake.input.vcf))
-                ),
-                "input_bam": repr(
-                    os.path.realpath(os.path.join(self.main_cwd, self.snakemake.input.bam))
-                ),
-                "input_txt": repr(
-                    os.path.realpath(os.path.join(self.main_cwd, self.snakemake.input.txt))
-                ),
-                "jobno": jobno,
-                "params": repr(params),
-                "output": repr(output),
-                "wrapper_prefix": "file://" + self.wrapper_base_dir,
-                "inner_wrapper": self.inner_wrapper,
-                "resources": repr(self.res_converter(self.job_resources).to_res_dict()),
-            }
-            yield textwrap.dedent(
-                r"""
-                rule chunk_{jobno}:
-                    input:
-                        vcf={input_vcf},
-                        bam={input_bam},
-                        txt={input_txt},
-                    output:
-                        touch("job_out.{jobno}.d/.done"),
-                        **{output}
-                    params:
-                        **{params}
-                    wrapper: '{wrapper_prefix}/snappy_wrappers/wrappers/{inner_wrapper}'
+    def get_chunk_input(self):
+        """Return input of the ``chunk`` rule, the VCF, BAM, and background TXT files."""
+        return {
+            key: os.path.realpath(os.path.join(self.main_cwd, getattr(self.snakemake.input, key)))
+            for key in ("vcf", "bam", "txt")
+        }
 
-
-                cluster_config['chunk_{jobno}'] = {resources}
-            """
-            ).format(**vals).lstrip()
+    def get_chunk_args(self, region):
+        return {"interval": region.human_readable(False)}
 
 
 # Kick off execution using the wrapper class defined above.
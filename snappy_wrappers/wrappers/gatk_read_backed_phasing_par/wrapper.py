@@ -6,7 +6,6 @@ isort:skip_file
 
 import os
 import sys
-import textwrap
 
 from snakemake.shell import shell
 
@@ -54,44 +53,11 @@ class ParallelGaktReadBackedPhasingWrapper(ParallelVariantAnnotationBaseWrapper)
         else:
             return list(map(self._abs_path, list(path)))
 
-    def construct_parallel_rules(self):
-        """Construct the rules for parallel processing to generate."""
-        for jobno, region in enumerate(self.get_regions()):
-            params = dict(self.snakemake.params)
-            params.setdefault("args", {}).update({"intervals": [region.human_readable()]})
-            output = {
-                key: "job_out.{jobno}.d/out/tmp_{jobno}.{ext}".format(jobno=jobno, ext=ext)
-                for key, ext in self.key_ext.items()
-            }
-            vals = {
-                "input_": repr(
-                    {
-                        key: self._abs_path(getattr(self.snakemake.input, key))
-                        for key in ("vcf", "tbi", "bam")
-                    }
-                ),
-                "jobno": jobno,
-                "params": repr(params),
-                "output": repr(output),
-                "wrapper_prefix": "file://" + self.wrapper_base_dir,
-                "inner_wrapper": self.inner_wrapper,
-                "resources": repr(self.res_converter(self.job_resources).to_res_dict()),
-            }
-            yield textwrap.dedent(
-                r"""
-                rule chunk_{jobno}:
-                    input:
-                        **{input_},
-                    output:
-                        touch("job_out.{jobno}.d/.done"),
-                        **{output}
-                    params:
-                        **{params}
-                    wrapper: '{wrapper_prefix}/snappy_wrappers/wrappers/{inner_wrapper}'
-
-                cluster_config['chunk_{jobno}'] = {resources}
-            """
-            ).format(**vals).lstrip()
+    def get_chunk_input(self):
+        """Return input of the ``chunk`` rule, the VCF and BAM files."""
+        return {
+            key: self._abs_path(getattr(self.snakemake.input, key)) for key in ("vcf", "tbi", "bam")
+        }
 
 
 # Write out information about conda installation.
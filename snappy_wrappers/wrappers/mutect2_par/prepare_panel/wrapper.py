@@ -6,7 +6,6 @@ isort:skip_file
 
 import os
 import sys
-import textwrap
 
 from snakemake import shell
 
@@ -43,39 +42,9 @@ class ParallelMutect2Wrapper(ParallelVariantCallingBaseWrapper):
             duration=hours(4 * self.get_merge_mult_time()),
         )
 
-    def construct_parallel_rules(self):
-        """Construct the rules for parallel processing to generate."""
-        for jobno, region in enumerate(self.get_regions()):
-            params = dict(self.snakemake.params)
-            params.setdefault("args", {}).update({"intervals": [region.human_readable()]})
-            output = {
-                key: "job_out.{jobno}.d/out/tmp_{jobno}.{ext}".format(jobno=jobno, ext=ext)
-                for key, ext in self.key_ext.items()
-            }
-            vals = {
-                "input_bam": repr(self.snakemake.input.normal_bam),
-                "jobno": jobno,
-                "params": repr(params),
-                "output": repr(output),
-                "wrapper_prefix": "file://" + self.wrapper_base_dir,
-                "inner_wrapper": self.inner_wrapper,
-                "resources": repr(self.res_converter(self.job_resources).to_res_dict()),
-            }
-            yield textwrap.dedent(
-                r"""
-                rule chunk_{jobno}:
-                    input:
-                        {input_bam},
-                    output:
-                        touch("job_out.{jobno}.d/.done"),
-                        **{output}
-                    params:
-                        **{params}
-                    wrapper: '{wrapper_prefix}/snappy_wrappers/wrappers/{inner_wrapper}'
-
-                cluster_config['chunk_{jobno}'] = {resources}
-            """
-            ).format(**vals).lstrip()
+    def get_chunk_input(self):
+        """Return input of the ``chunk`` rule, the normal BAM file."""
+        return [self.snakemake.input.normal_bam]
 
 
 # Kick off execution using the wrapper class defined above.
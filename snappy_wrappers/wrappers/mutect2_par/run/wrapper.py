@@ -51,6 +51,9 @@ class ParallelMutect2Wrapper(ParallelSomaticVariantCallingBaseWrapper):
         "f1r2_md5": "f1r2_tar.tar.gz.md5",
     }
 
+    #: The merge rules below also merge the stats and F1R2 files, with ``--allow-overlaps``.
+    merge_naive = False
+
     def __init__(self, snakemake):
         super().__init__(snakemake)
         self.job_resources = ResourceUsage(
@@ -64,7 +67,7 @@ class ParallelMutect2Wrapper(ParallelSomaticVariantCallingBaseWrapper):
             duration=hours(1 * self.get_merge_mult_time()),
         )
 
-    def _construct_level_one_merge_rule(self, chunk_no, merge_input):
+    def _construct_inner_merge_rule(self, chunk_no, merge_input):
         return (
             textwrap.dedent(
                 r"""
@@ -92,18 +95,18 @@ class ParallelMutect2Wrapper(ParallelSomaticVariantCallingBaseWrapper):
 
                     # Concatenate stats ---------------------------------------------------
 
-                    chunks=$(echo "{{input}}" | sed -e "s/\.vcf\.gz/.vcf.stats/g" | sed -e "s/ / -stats /")
-                    gatk MergeMutectStats -stats $chunks -O {output.stats}
+                    chunks=$(echo "{{input}}" | sed -e "s/\.vcf\.gz/.vcf.stats/g" | sed -e "s/ / -stats /g")
+                    gatk MergeMutectStats -stats $chunks -O {{output.stats}}
 
                     # Concatenate f1r2 tar files ------------------------------------------
 
-                    tar_dir=$(dirname "{{output.vcf}}")
-                    tar_dir="${{tar_dir}}/out.f1r2_tar"
+                    tar_dir=$(dirname "{{output.vcf}}")/out.f1r2_tar
+
+                    # Absolute paths, the archives are extracted in $tar_dir
+                    chunks=$(realpath $(echo "{{input}}" | sed -e "s/\.vcf\.gz/.f1r2_tar.tar.gz/g"))
 
                     mkdir -p $tar_dir
                     pushd $tar_dir
-
-                    chunks=$(echo "{{input}}" | sed -e "s/\.vcf\.gz/.f1r2_tar.tar.gz/" | sed -re "s/job_out\.([0-9]+)\.d/..\/..\/job_out.\1.d/g")
                     for chunk in $chunks
                     do
                         tar -zxvf $chunk
@@ -162,10 +165,11 @@ class ParallelMutect2Wrapper(ParallelSomaticVariantCallingBaseWrapper):
 
                     tar_dir="output/out.f1r2_tar"
 
+                    # Absolute paths, the archives are extracted in $tar_dir
+                    chunks=$(realpath $(echo "{{input}}" | sed -e "s/\.vcf\.gz/.f1r2_tar.tar.gz/g"))
+
                     mkdir -p $tar_dir
                     pushd $tar_dir
-
-                    chunks=$(echo "{{input}}" | sed -e "s/\.vcf\.gz/.f1r2_tar.tar.gz/g" | sed -re "s/(job|merge)_out\.([0-9]+)\.d/..\/..\/\1_out.\2.d/g")
                     for chunk in $chunks
                     do
                         tar -zxvf $chunk
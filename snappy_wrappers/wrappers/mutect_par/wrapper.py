@@ -62,6 +62,9 @@ class ParallelMutectWrapper(ParallelSomaticVariantCallingBaseWrapper):
     step_name = "somatic_variant_calling"
     tool_name = "mutect"
 
+    #: The merge rule below also merges the text and WIG files of the chunks.
+    merge_naive = False
+
     def __init__(self, snakemake):
         super().__init__(snakemake)
         self.job_resources = ResourceUsage(
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Tests for ``snappy-benchmark-report`` app."""
+
+from snappy_pipeline.apps import snappy_benchmark_report
+
+#: Header of the Snakemake benchmark files
+HEADER = "s\th:m:s\tmax_rss\tmax_vms\tmax_uss\tmax_pss\tio_in\tio_out\tmean_load\tcpu_time\n"
+
+
+def write_benchmark(tmpdir, path, *rows):
+    tmpdir.join(path).write(HEADER + "".join("\t".join(row) + "\n" for row in rows), ensure=True)
+
+
+def test_benchmark_report(tmpdir, capsys):
+    row = ("10.0", "0:00:10", "100.0", "200.0", "90.0", "95.0", "1.0", "2.0", "150.0", "15.0")
+    write_benchmark(tmpdir, "ngs_mapping/work/bwa.P001/log/bwa.P001.bwa.run.benchmark.txt", row)
+    row = ("30.0", "0:00:30", "300.0", "400.0", "290.0", "295.0", "3.0", "4.0", "50.0", "15.0")
+    write_benchmark(tmpdir, "ngs_mapping/work/bwa.P002/log/bwa.P002.bwa.run.benchmark.txt", row)
+    row = ("5.0", "0:00:05", "-", "-", "-", "-", "-", "-", "-", "-")
+    write_benchmark(
+        tmpdir, "variant_calling/work/x/log/snakemake.gatk_hc.run.benchmark.txt", row, row
+    )
+    tmpdir.join("ngs_mapping/work/bwa.P001/log/bwa.P001.log").write("", ensure=True)
+    # Exercise code under test
+    assert snappy_benchmark_report.main([str(tmpdir)]) is None
+    # Check results
+    lines = [line.split("\t") for line in capsys.readouterr().out.splitlines()]
+    assert lines == [
+        list(snappy_benchmark_report.REPORT_HEADER),
+        [
+            "ngs_mapping",
+            "bwa.run",
+            "2",
+            "2",
+            "40.00",
+            "20.00",
+            "30.00",
+            "200.00",
+            "300.00",
+            "4.00",
+            "6.00",
+            "0.75",
+        ],
+        ["variant_calling", "gatk_hc.run", "1", "2", "10.00", "5.00", "5.00"]
+        + [".", ".", "0.00", "0.00", "."],
+    ]
+
+
+def test_get_rule_key_step_dir(tmpdir):
+    path = str(tmpdir.join("ngs_mapping/work/bwa.P001/log/bwa.P001.bwa.run.benchmark.txt"))
+    actual = snappy_benchmark_report.get_rule_key(str(tmpdir.join("ngs_mapping")), path)
+    assert actual == ("ngs_mapping", "bwa.run")
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Tests for ``snappy-job-telemetry``"""
+
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from snappy_pipeline.apps import snappy_job_telemetry
+from snappy_pipeline.apps.snappy_job_telemetry import ProcessTreeSampler, get_record_path
+
+__author__ = "Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>"
+
+#: Path to the job script template
+JOBSCRIPT = os.path.join(os.path.dirname(snappy_job_telemetry.__file__), "tpls", "jobscript.sh")
+
+
+def test_get_record_path():
+    properties = {"type": "single", "rule": "r", "jobid": 3, "log": ["work/x/log/x.log"]}
+    assert get_record_path(properties) == "work/x/log/x.telemetry.json"
+    properties = {"type": "group", "groupid": "g", "jobid": "1a2b"}
+    assert get_record_path(properties) == ".snappy_telemetry/group.g.1a2b.telemetry.json"
+
+
+def write_proc(proc_dir, pid, ppid, ticks, rss_pages, io=None):
+    fields = ["S", ppid] + [0] * 9 + list(ticks) + [0] * 6 + [rss_pages]
+    stat = "%d (name with spaces) %s\n" % (pid, " ".join(map(str, fields)))
+    proc_dir.join(str(pid), "stat").write(stat, ensure=True)
+    if io:
+        proc_dir.join(str(pid), "io").write("read_bytes: %d\nwrite_bytes: %d\n" % io)
+
+
+def test_process_tree_sampler(tmpdir):
+    ticks = os.sysconf("SC_CLK_TCK")
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    write_proc(tmpdir, 10, 1, (0, 0, ticks, 0), 1)
+    write_proc(tmpdir, 11, 10, (ticks, ticks, 0, 0), 2, io=(100, 200))
+    write_proc(tmpdir, 12, 11, (ticks, 0, 0, 0), 3, io=(1, 2))
+    write_proc(tmpdir, 13, 10, (100 * ticks, 0, 0, 0), 100)  # the sampler
+    write_proc(tmpdir, 20, 1, (100 * ticks, 0, 0, 0), 100)  # other process
+    sampler = ProcessTreeSampler(10, exclude_pid=13, proc_dir=str(tmpdir))
+    assert sampler.sample()
+    assert sampler.cpu_seconds == pytest.approx(4.0)
+    assert sampler.max_rss == 6 * page_size
+    # Process 12 terminates, its CPU time is accounted for by its parent
+    tmpdir.join("12").remove()
+    write_proc(tmpdir, 11, 10, (ticks, ticks, ticks, 0), 2, io=(300, 400))
+    assert sampler.sample()
+    assert sampler.cpu_seconds == pytest.approx(4.0)
+    assert sampler.max_rss == 6 * page_size
+    assert sampler.get_io() == (301, 402)
+    assert sampler.samples == 2
+    tmpdir.join("10").remove()
+    assert not sampler.sample()
+
+
+def test_run_sample_repeated(tmpdir, mocker):
+    """Check that the job is sampled until the exit status is written
+
+    Sleeping is replaced by writing the exit status on the second interval, such that the number
+    of samples does not depend on timing.
+    """
+    properties = {"type": "single", "rule": "r", "jobid": 1, "log": ["x.log"], "threads": 2}
+    tmpdir.join("jobscript.sh").write("#!/bin/bash\n# properties = %s\n" % json.dumps(properties))
+    status_file = tmpdir.join("status")
+    intervals = []
+
+    def fake_sleep(interval):
+        intervals.append(interval)
+        if len(intervals) == 2:
+            status_file.write("0\n")
+
+    mocker.patch("snappy_pipeline.apps.snappy_job_telemetry.time.sleep", fake_sleep)
+    with subprocess.Popen(["sleep", "60"]) as child:
+        try:
+            snappy_job_telemetry.main(
+                [
+                    "sample",
+                    "--jobscript",
+                    str(tmpdir.join("jobscript.sh")),
+                    "--pid",
+                    str(child.pid),
+                    "--status-file",
+                    str(status_file),
+                    "--interval",
+                    "0.5",
+                    "--output",
+                    str(tmpdir.join("x.telemetry.json")),
+                ]
+            )
+        finally:
+            child.kill()
+    record = json.loads(tmpdir.join("x.telemetry.json").read())
+    assert intervals == [0.5, 0.5]
+    # Samples before both intervals, after the second one, and the final sample
+    assert record["samples"] == 4
+    assert record["exit_status"] == 0
+    assert record["req_threads"] == 2
+    assert record["max_rss_mb"] > 0
+
+
+def test_collect(tmpdir, capsys):
+    record = {"rule": "r", "jobid": 1, "wall_s": 10.0, "cpu_s": 5.0, "exit_status": 0}
+    tmpdir.join("step/work/x/log/x.telemetry.json").write(json.dumps(record), ensure=True)
+    tmpdir.join("step/.snakemake/y.telemetry.json").write(json.dumps(record), ensure=True)
+    snappy_job_telemetry.main(["collect", str(tmpdir)])
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 2
+    values = dict(zip(lines[0].split("\t"), lines[1].split("\t")))
+    assert values["path"] == "step/work/x/log/x.telemetry.json"
+    assert values["wall_s"] == "10.00"
+    assert values["max_rss_mb"] == "."
+
+
+def test_jobscript_telemetry(tmpdir):
+    """Check that the job script samples the job and writes the record next to the log"""
+    bin_dir = tmpdir.join("bin")
+    bin_dir.join("snappy-job-telemetry").write(
+        '#!/bin/bash\nexec %s -m snappy_pipeline.apps.snappy_job_telemetry "$@"\n' % sys.executable,
+        ensure=True,
+    )
+    bin_dir.join("snappy-job-telemetry").chmod(0o755)
+    properties = {"type": "single", "rule": "r", "jobid": 1, "log": ["x.log"], "threads": 2}
+    with open(JOBSCRIPT, "rt") as inputf:
+        script = inputf.read().format(properties=json.dumps(properties), exec_job="sleep 0.5")
+    tmpdir.join("jobscript.sh").write(script)
+    env = dict(os.environ, SNAPPY_PIPELINE_TELEMETRY="0.1", SNAPPY_PIPELINE_SCRATCH="auto")
+    env["PATH"] = "%s:%s" % (bin_dir, env["PATH"])
+    env["SLURM_TMPDIR"] = str(tmpdir)
+    env["PYTHONPATH"] = os.pathsep.join(sys.path)
+    subprocess.run(["bash", "jobscript.sh"], cwd=str(tmpdir), env=env, check=True)
+    record = json.loads(tmpdir.join("x.telemetry.json").read())
+    assert record["rule"] == "r"
+    assert record["exit_status"] == 0
+    assert record["req_threads"] == 2
+    assert record["samples"] >= 1
+    assert record["wall_s"] >= 0.5
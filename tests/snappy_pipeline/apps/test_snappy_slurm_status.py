@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""Tests for ``snappy-slurm-status`` app."""
+
+import textwrap
+
+import pytest
+
+from snappy_pipeline.apps import snappy_slurm_status
+from snappy_pipeline.apps.snappy_slurm_status import (
+    UNKNOWN_MAX_AGE,
+    SlurmStatusCache,
+    parse_states,
+    to_snakemake_status,
+)
+
+
+@pytest.fixture
+def fake_slurm(tmpdir):
+    """Return directory with fake ``sacct`` and ``squeue`` scripts
+
+    The scripts log their arguments to ``calls.txt`` and print the contents of ``sacct.txt`` and
+    ``squeue.txt``.  They fail with exit code 1 if ``sacct.fail`` or ``squeue.fail`` exist.
+    """
+    for name in ("sacct", "squeue"):
+        tmpdir.join(name + ".txt").write("")
+        script = tmpdir.join(name)
+        script.write(
+            textwrap.dedent(
+                r"""
+                #!/bin/sh
+                echo "{name} $*" >>{dir}/calls.txt
+                if [ -e {dir}/{name}.fail ]; then
+                    echo "{name}: error" >&2
+                    exit 1
+                fi
+                cat {dir}/{name}.txt
+                """
+            )
+            .lstrip()
+            .format(name=name, dir=tmpdir)
+        )
+        script.chmod(0o755)
+    return tmpdir
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def get_calls(fake_slurm):
+    return fake_slurm.join("calls.txt").read().splitlines()
+
+
+def test_parse_states():
+    output = "1|RUNNING\n1.batch|RUNNING\n2|CANCELLED by 1234\n3|COMPLETED+\n"
+    assert parse_states(output) == {"1": "RUNNING", "2": "CANCELLED", "3": "COMPLETED"}
+
+
+def test_slurm_status_cache_batches_queries(fake_slurm):
+    clock = FakeClock()
+    cache = SlurmStatusCache(
+        str(fake_slurm.join("state.json")),
+        ttl=30,
+        sacct=str(fake_slurm.join("sacct")),
+        squeue=str(fake_slurm.join("squeue")),
+        clock=clock,
+    )
+    fake_slurm.join("sacct.txt").write("1|RUNNING\n2|PENDING\n")
+    assert cache.get_state("1") == "RUNNING"
+    assert cache.get_state("2") == "PENDING"
+    assert cache.get_state("1") == "RUNNING"  # from cache
+    assert get_calls(fake_slurm) == [
+        "sacct -j 1 -X -n -P -o JobIDRaw,State",
+        "sacct -j 1,2 -X -n -P -o JobIDRaw,State",
+    ]
+    # After the TTL, all unfinished jobs are updated with one call, finished ones are kept
+    clock.now += 30
+    fake_slurm.join("sacct.txt").write("1|COMPLETED\n2|RUNNING\n")
+    assert cache.get_state("2") == "RUNNING"
+    assert cache.get_state("1") == "COMPLETED"
+    clock.now += 30
+    assert cache.get_state("1") == "COMPLETED"
+    assert get_calls(fake_slurm)[2:] == ["sacct -j 1,2 -X -n -P -o JobIDRaw,State"]
+
+
+def make_cache(fake_slurm, clock):
+    return SlurmStatusCache(
+        str(fake_slurm.join("state.json")),
+        ttl=30,
+        sacct=str(fake_slurm.join("sacct")),
+        squeue=str(fake_slurm.join("squeue")),
+        clock=clock,
+    )
+
+
+def test_slurm_status_cache_squeue_fallback(fake_slurm):
+    cache = SlurmStatusCache(
+        str(fake_slurm.join("state.json")),
+        sacct=str(fake_slurm.join("sacct")),
+        squeue=str(fake_slurm.join("squeue")),
+    )
+    fake_slurm.join("squeue.txt").write("3|PENDING\n")
+    assert cache.get_state("3") == "PENDING"
+    assert cache.get_state("4") == "UNKNOWN"
+    assert get_calls(fake_slurm)[:2] == [
+        "sacct -j 3 -X -n -P -o JobIDRaw,State",
+        "squeue -h -j 3 -o %i|%T",
+    ]
+
+
+@pytest.mark.parametrize(
+    "sacct_output,expected",
+    [("5|COMPLETED\n", "success"), ("5|RUNNING\n", "running"), ("5|TIMEOUT\n", "failed")],
+)
+def test_slurm_status_main(fake_slurm, capsys, sacct_output, expected):
+    fake_slurm.join("sacct.txt").write(sacct_output)
+    argv = [
+        "--state-file",
+        str(fake_slurm.join("state.json")),
+        "--sacct",
+        str(fake_slurm.join("sacct")),
+        "--squeue",
+        str(fake_slurm.join("squeue")),
+        "5",
+    ]
+    assert snappy_slurm_status.main(argv) is None
+    assert capsys.readouterr().out == expected + "\n"
+
+
+def test_slurm_status_cache_unknown(fake_slurm):
+    """Check that jobs found by neither sacct nor squeue are queried again until the grace period"""
+    clock = FakeClock()
+    cache = make_cache(fake_slurm, clock)
+    assert cache.get_state("6") == "UNKNOWN"
+    assert to_snakemake_status("UNKNOWN") == "running"
+    clock.now += 30
+    fake_slurm.join("sacct.txt").write("6|RUNNING\n")
+    assert cache.get_state("6") == "RUNNING"
+    assert cache.get_state("7") == "UNKNOWN"
+    clock.now += UNKNOWN_MAX_AGE
+    assert cache.get_state("7") == "NOT_FOUND"
+    assert to_snakemake_status("NOT_FOUND") == "failed"
+
+
+def test_slurm_status_cache_failing_commands(fake_slurm):
+    """Check that failing sacct and squeue calls do not update the cached states"""
+    clock = FakeClock()
+    cache = make_cache(fake_slurm, clock)
+    fake_slurm.join("sacct.txt").write("1|RUNNING\n")
+    assert cache.get_state("1") == "RUNNING"
+    clock.now += 30
+    fake_slurm.join("sacct.fail").write("")
+    assert cache.get_state("1") == "RUNNING"
+    assert cache.get_state("2") is None
+    assert to_snakemake_status(None) == "running"
+    # squeue fails for jobs that have left the queue, the job stays unresolved
+    fake_slurm.join("sacct.fail").remove()
+    fake_slurm.join("squeue.fail").write("")
+    assert cache.get_state("2") is None
+    assert cache.get_state("1") == "RUNNING"
+    assert get_calls(fake_slurm)[-2:] == [
+        "sacct -j 1,2 -X -n -P -o JobIDRaw,State",
+        "squeue -h -j 2 -o %i|%T",
+    ]
+    # ... but only until the grace period has passed
+    clock.now += UNKNOWN_MAX_AGE
+    assert cache.get_state("2") == "NOT_FOUND"
+
+
+def test_slurm_status_main_sacct_fails(fake_slurm, capsys):
+    fake_slurm.join("sacct.fail").write("")
+    argv = [
+        "--state-file",
+        str(fake_slurm.join("state.json")),
+        "--sacct",
+        str(fake_slurm.join("sacct")),
+        "--squeue",
+        str(fake_slurm.join("squeue")),
+        "5",
+    ]
+    assert snappy_slurm_status.main(argv) is None
+    captured = capsys.readouterr()
+    assert captured.out == "running\n"
+    assert "Call of" in captured.err
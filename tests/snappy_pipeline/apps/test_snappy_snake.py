@@ -2,10 +2,20 @@
 """Tests for ``snappy-snake app``"""
 
 import os.path
+import subprocess
+import sys
 
 import pytest
 
 from snappy_pipeline.apps import snappy_snake
+from snappy_pipeline.base import (
+    JOB_GROUPS_ENV_VAR,
+    LOCAL_RESOURCES_ENV_VAR,
+    SCRATCH_ENV_VAR,
+    STAGE_INPUTS_ENV_VAR,
+    TELEMETRY_ENV_VAR,
+)
+from snappy_pipeline.profiling import get_dag_profiler
 import snappy_pipeline.workflows
 
 from ..workflows.conftest import patch_module_fs
@@ -56,3 +66,101 @@ def test_snappy_snake_list_output(germline_sheet_fake_project_ngs_mapping_fs, mo
             "mamba",
         ]
     )
+
+
+def test_snappy_snake_step_registry():
+    """Check that all registered step modules can be located without importing them"""
+    for step in snappy_snake.STEP_TO_MODULE:
+        path = snappy_snake.step_snakefile_path(step)
+        assert path.endswith(os.path.join("workflows", step, "Snakefile")), step
+        assert os.path.isdir(os.path.dirname(path)), step
+    module = snappy_snake.import_step_module("ngs_mapping")
+    assert module.__name__ == "snappy_pipeline.workflows.ngs_mapping"
+    assert hasattr(module, "DEFAULT_CONFIG")
+
+
+def test_snappy_snake_import_is_lazy():
+    """Check that importing ``snappy_snake`` does not import any workflow module"""
+    # Use a fresh interpreter with ``-X importtime`` so the import log is not polluted by this session
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import snappy_pipeline.apps.snappy_snake"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    imported = [line.split("|")[-1].strip() for line in proc.stderr.splitlines() if "|" in line]
+    assert "snappy_pipeline.apps.snappy_snake" in imported
+    assert not [name for name in imported if name.startswith("snappy_pipeline.workflows.")]
+
+
+def test_snappy_snake_profile_dag(tmpdir, mocker):
+    """Check that ``--snappy-profile-dag`` profiles the in-process snakemake call"""
+
+    def fake_snakemake_main(argv):
+        assert get_dag_profiler() is not None
+        return 0
+
+    mocker.patch("snappy_pipeline.apps.snappy_snake.binary_available", return_value=False)
+    mocker.patch("snappy_pipeline.apps.snappy_snake.snakemake_main", fake_snakemake_main)
+    argv = ["--step", "ngs_mapping", "-d", str(tmpdir), "-n", "--snappy-profile-dag"]
+    assert 0 == snappy_snake.main(argv)
+    assert get_dag_profiler() is None
+    assert tmpdir.join("snappy_profile_dag.tsv").check()
+    assert tmpdir.join("snappy_profile_dag.json").check()
+
+
+def test_snappy_snake_local_resources(tmpdir, mocker, monkeypatch):
+    """Check that ``--snappy-local-resources`` limits the memory of the local jobs"""
+    monkeypatch.setenv(LOCAL_RESOURCES_ENV_VAR, "0")  # restored after the test
+    snakemake_main = mocker.patch(
+        "snappy_pipeline.apps.snappy_snake.snakemake_main", return_value=0
+    )
+    mocker.patch("snappy_pipeline.apps.snappy_snake.binary_available", return_value=False)
+    argv = ["--step", "ngs_mapping", "-d", str(tmpdir), "--cores", "8"]
+    assert 0 == snappy_snake.main(argv + ["--snappy-local-resources", "1000"])
+    snakemake_argv = snakemake_main.call_args[0][0]
+    assert snakemake_argv[snakemake_argv.index("--resources") + 1] == "mem_mb=1000"
+    assert os.environ[LOCAL_RESOURCES_ENV_VAR] == "1"
+    # Without size, the physical memory is used
+    mocker.patch("snappy_pipeline.apps.snappy_snake.physical_memory_mb", return_value=2000)
+    assert 0 == snappy_snake.main(argv + ["--snappy-local-resources"])
+    snakemake_argv = snakemake_main.call_args[0][0]
+    assert snakemake_argv[snakemake_argv.index("--resources") + 1] == "mem_mb=2000"
+
+
+def test_snappy_snake_job_groups(tmpdir, mocker, monkeypatch):
+    """Check that ``--snappy-job-groups`` and ``--snappy-job-group`` set the environment"""
+    monkeypatch.setenv(JOB_GROUPS_ENV_VAR, "")  # restored after the test
+    mocker.patch("snappy_pipeline.apps.snappy_snake.snakemake_main", return_value=0)
+    mocker.patch("snappy_pipeline.apps.snappy_snake.binary_available", return_value=False)
+    argv = ["--step", "ngs_mapping", "-d", str(tmpdir)]
+    assert 0 == snappy_snake.main(argv + ["--snappy-job-groups", "--snappy-job-group", "a_run=5"])
+    assert os.environ[JOB_GROUPS_ENV_VAR] == "20,a_run=5"
+    with pytest.raises(SystemExit):
+        snappy_snake.main(argv + ["--snappy-job-group", "a_run"])
+
+
+def test_snappy_snake_stage_inputs(tmpdir, mocker, monkeypatch):
+    """Check that ``--snappy-stage-inputs`` enables node-local scratch for the job script"""
+    monkeypatch.setenv(SCRATCH_ENV_VAR, "")  # restored after the test
+    monkeypatch.setenv(STAGE_INPUTS_ENV_VAR, "")
+    mocker.patch("snappy_pipeline.apps.snappy_snake.snakemake_main", return_value=0)
+    mocker.patch("snappy_pipeline.apps.snappy_snake.binary_available", return_value=False)
+    argv = ["--step", "ngs_mapping", "-d", str(tmpdir)]
+    assert 0 == snappy_snake.main(argv + ["--snappy-scratch", "/local"])
+    assert os.environ[SCRATCH_ENV_VAR] == "/local"
+    assert os.environ[STAGE_INPUTS_ENV_VAR] == ""
+    assert 0 == snappy_snake.main(argv + ["--snappy-stage-inputs"])
+    assert os.environ[SCRATCH_ENV_VAR] == "auto"
+    assert os.environ[STAGE_INPUTS_ENV_VAR] == "1"
+
+
+def test_snappy_snake_telemetry(tmpdir, mocker, monkeypatch):
+    """Check that ``--snappy-telemetry`` passes the sampling interval to the job script"""
+    monkeypatch.setenv(TELEMETRY_ENV_VAR, "")  # restored after the test
+    mocker.patch("snappy_pipeline.apps.snappy_snake.snakemake_main", return_value=0)
+    mocker.patch("snappy_pipeline.apps.snappy_snake.binary_available", return_value=False)
+    argv = ["--step", "ngs_mapping", "-d", str(tmpdir), "--snappy-telemetry"]
+    assert 0 == snappy_snake.main(argv)
+    assert os.environ[TELEMETRY_ENV_VAR] == "10.0"
@@ -1,17 +1,34 @@
 # -*- coding: utf-8 -*-
 """Tests for base module code"""
 
+from collections import OrderedDict
+import os
+
 import pytest
 
+from snappy_pipeline import base
 from snappy_pipeline.base import (
+    CONFIG_CACHE_ENV_VAR,
+    CONFIG_CACHE_FILE_NAME,
+    ConfigCache,
     InvalidConfiguration,
     MissingConfiguration,
     UnknownFiltrationSourceException,
     UnsupportedActionException,
+    expand_ref,
+    get_config_cache,
+    hash_data,
     merge_kwargs,
+    parse_job_groups,
 )
 
 
+def test_parse_job_groups():
+    assert parse_job_groups("") == (None, {})
+    assert parse_job_groups("20") == (20, {})
+    assert parse_job_groups("rule_a=5, 10,rule_b=2") == (10, {"rule_a": 5, "rule_b": 2})
+
+
 def test_merge_kwargs():
     """Tests dictionary merger for shortcut sheet keyword arguments."""
     # Initialise variables
@@ -67,3 +84,65 @@ def test_unknown_filtration_source_exception():
     with pytest.raises(Exception) as exec_info:
         raise UnknownFiltrationSourceException(error_msg)
     assert exec_info.value.args[0] == error_msg
+
+
+def test_hash_data():
+    assert hash_data({"a": 1, "b": [1, 2]}) == hash_data(OrderedDict([("a", 1), ("b", [1, 2])]))
+    assert hash_data({"a": 1, "b": [1, 2]}) != hash_data({"a": 1, "b": [1, 3]})
+
+
+def test_config_cache_returns_copies_and_checks_files(tmpdir):
+    path_included = tmpdir.join("included.yaml")
+    path_included.write("a: 1\n")
+    calls = []
+
+    def factory():
+        calls.append(True)
+        return {"value": [len(calls)]}, (str(path_included),)
+
+    cache = ConfigCache()
+    first = cache.get("key", factory)
+    first["value"].append("modified")
+    assert cache.get("key", factory) == {"value": [1]}
+    assert len(calls) == 1
+    # Changing the included file invalidates the entry
+    path_included.write("a: 2\n")
+    assert cache.get("key", factory) == {"value": [2]}
+    # Missing files are never considered current
+    path_included.remove()
+    assert cache.get("key", factory) == {"value": [3]}
+    assert cache.get("key", factory) == {"value": [4]}
+
+
+def test_config_cache_persisted(tmpdir, mocker, monkeypatch):
+    mocker.patch.dict(base._CONFIG_CACHES, clear=True)
+    monkeypatch.setenv(CONFIG_CACHE_ENV_VAR, "1")
+    cache = get_config_cache(str(tmpdir))
+    assert cache.path == str(tmpdir.join(CONFIG_CACHE_FILE_NAME))
+    assert get_config_cache(str(tmpdir)) is cache
+    cache.get("key", lambda: ("value", ()))
+    assert ConfigCache(cache.path).get("key", lambda: ("other", ())) == "value"
+    monkeypatch.delenv(CONFIG_CACHE_ENV_VAR)
+    assert get_config_cache(str(tmpdir)).path is None
+
+
+def test_expand_ref_cached(tmpdir, mocker):
+    mocker.patch.dict(base._CONFIG_CACHES, clear=True)
+    tmpdir.join("included.yaml").write("static_data_config:\n  key: first\n")
+    tmpdir.join("config.yaml").write("$ref: 'file://included.yaml'\nstep_config: {}\n")
+    config = OrderedDict([("$ref", "file://included.yaml"), ("step_config", {})])
+    spy = mocker.spy(base, "_expand_ref")
+    with tmpdir.as_cwd():
+        path_config = str(tmpdir.join("config.yaml"))
+        resolved, lookup_paths, config_paths = expand_ref(path_config, config, [str(tmpdir)])
+        assert resolved["static_data_config"]["key"] == "first"
+        assert str(tmpdir.join("included.yaml")) in config_paths
+        resolved["static_data_config"]["key"] = "modified"
+        assert expand_ref(path_config, config, [str(tmpdir)])[0]["static_data_config"] == {
+            "key": "first"
+        }
+        assert spy.call_count == 1
+        tmpdir.join("included.yaml").write("static_data_config:\n  key: second\n")
+        resolved = expand_ref(path_config, config, [str(tmpdir)])[0]
+        assert resolved["static_data_config"]["key"] == "second"
+        assert spy.call_count == 2
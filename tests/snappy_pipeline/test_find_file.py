@@ -3,15 +3,22 @@
 
 import copy
 import json
+import os
+import shutil
+import time
 from unittest.mock import MagicMock, patch
 
 from pyfakefs import fake_filesystem
 import pytest
 
-from snappy_pipeline.find_file import FileSystemCrawler, FileSystemCrawlerResult, PatternSet
-
-# TODO: test the invalidation_paths parameter/feature
-
+from snappy_pipeline.find_file import (
+    CACHE_MAGIC,
+    FileSystemCrawler,
+    FileSystemCrawlerResult,
+    PatternSet,
+    _compile_pattern,
+    walk_dirs,
+)
 
 # Test PatternSet ---------------------------------------------------------------------------------
 
@@ -60,6 +67,49 @@ def test_file_system_crawler_result_with_names():
     )
 
 
+# Test walk_dirs ----------------------------------------------------------------------------------
+
+
+@pytest.fixture
+def dir_tree(tmp_path):
+    for name in ("P001", "P002"):
+        for flowcell in ("flowcell1", "flowcell2"):
+            (tmp_path / "root" / name / flowcell).mkdir(parents=True)
+            for read in ("R1", "R2"):
+                (tmp_path / "root" / name / flowcell / f"{name}_{read}.fastq.gz").touch()
+    (tmp_path / "other" / "P003").mkdir(parents=True)
+    (tmp_path / "other" / "P003" / "P003_R1.fastq.gz").touch()
+    (tmp_path / "root" / "P003").symlink_to(tmp_path / "other" / "P003")
+    return str(tmp_path / "root")
+
+
+@pytest.mark.parametrize("num_threads", [1, 4])
+def test_walk_dirs_same_as_os_walk(dir_tree, num_threads):
+    expected = sorted(
+        (root, os.path.getmtime(root), sorted(files))
+        for root, _, files in os.walk(dir_tree, followlinks=True)
+    )
+    result = [
+        (root, mtime, sorted(files)) for root, mtime, files in walk_dirs(dir_tree, num_threads)
+    ]
+    assert result == expected
+
+
+def test_walk_dirs_symlink_cycle(dir_tree):
+    os.symlink(dir_tree, os.path.join(dir_tree, "P001", "flowcell1", "loop"))
+    result = [root[len(dir_tree) :] for root, _, _ in walk_dirs(dir_tree, 4)]
+    assert result == [
+        "",
+        "/P001",
+        "/P001/flowcell1",
+        "/P001/flowcell2",
+        "/P002",
+        "/P002/flowcell1",
+        "/P002/flowcell2",
+        "/P003",
+    ]
+
+
 # Test FileSystemCrawler --------------------------------------------------------------------------
 
 # Path to test file
@@ -68,6 +118,20 @@ CACHE_PATH = "/tmp/cache_file"
 
 @pytest.fixture
 def sample_cache_dict():
+    return {
+        "cache_version": 2,
+        "root_dirs": {
+            "/path": [
+                ["P001", "flowcell", "lane", "P001_R1.fastq.gz"],
+                ["P001", "flowcell", "lane", "P001_R2.fastq.gz"],
+            ]
+        },
+        "dir_mtimes": {},
+    }
+
+
+@pytest.fixture
+def sample_cache_dict_v1():
     return {
         "cache_version": 1,
         "root_dirs": {
@@ -132,6 +196,11 @@ def test_file_system_crawler_invalidate_cache(sample_cache_dict):
     assert not crawler_second.cache_invalidated
 
 
+def _as_tuples(root_dirs):
+    """Convert lists of path components in ``root_dirs`` to tuples"""
+    return {root_dir: tuple(map(tuple, paths)) for root_dir, paths in root_dirs.items()}
+
+
 def test_file_system_crawler_construct_existing_cache(sample_cache_dict):
     fake_fs = fake_filesystem.FakeFilesystem()
     fake_fs.create_file(
@@ -143,10 +212,16 @@ def test_file_system_crawler_construct_existing_cache(sample_cache_dict):
     with patch("snappy_pipeline.find_file.os", fake_os), patch(
         "snappy_pipeline.find_file.InterProcessLock", mock_lock
     ), patch("snappy_pipeline.find_file.open", fake_open, create=True):
+        FileSystemCrawler(CACHE_PATH, []).save_cache()  # migrate
         crawler = FileSystemCrawler(CACHE_PATH, [])
         crawler.save_cache()
+        # Cache entries are only decompressed on first use
+        assert crawler.cache == {"cache_version": 3, "root_dirs": {}, "dir_mtimes": {}}
+        assert set(crawler.blobs) == {"/path"}
+        crawler._load_root_dir("/path")
     assert crawler.cache_path == CACHE_PATH
-    assert crawler.cache == sample_cache_dict
+    assert crawler.cache["root_dirs"] == _as_tuples(sample_cache_dict["root_dirs"])
+    assert not crawler.blobs
     assert crawler.invalidation_paths == []
     assert not crawler.cache_dirty
     assert crawler.lock_timeout == 60
@@ -163,14 +238,196 @@ def test_file_system_crawler_construct_no_existing_cache():
     ), patch("snappy_pipeline.find_file.open", fake_open, create=True):
         crawler = FileSystemCrawler(CACHE_PATH, [])
         crawler.save_cache()
+        reloaded = FileSystemCrawler(CACHE_PATH, [])
     assert crawler.cache_path == CACHE_PATH
-    empty_cache = {"cache_version": 1, "root_dirs": {}}
+    empty_cache = {"cache_version": 3, "root_dirs": {}, "dir_mtimes": {}}
     assert crawler.cache == empty_cache
     assert crawler.invalidation_paths == []
     assert crawler.cache_dirty
     assert crawler.lock_timeout == 60
     assert fake_os.path.exists(CACHE_PATH)
-    assert json.loads(fake_open(CACHE_PATH).read()) == empty_cache
+    assert fake_open(CACHE_PATH, "rb").read().startswith(CACHE_MAGIC)
+    assert reloaded.cache == empty_cache
+    assert not reloaded.blobs
+
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_file_system_crawler_migrate_cache_json(version, sample_cache_dict, sample_cache_dict_v1):
+    legacy_cache = {1: sample_cache_dict_v1, 2: sample_cache_dict}[version]
+    fake_fs = fake_filesystem.FakeFilesystem()
+    fake_fs.create_file(CACHE_PATH, contents=json.dumps(legacy_cache), create_missing_dirs=True)
+    fake_os = fake_filesystem.FakeOsModule(fake_fs)
+    fake_open = fake_filesystem.FakeFileOpen(fake_fs)
+    mock_lock = MagicMock()
+    with patch("snappy_pipeline.find_file.os", fake_os), patch(
+        "snappy_pipeline.find_file.InterProcessLock", mock_lock
+    ), patch("snappy_pipeline.find_file.open", fake_open, create=True):
+        crawler = FileSystemCrawler(CACHE_PATH, [])
+        crawler.save_cache()
+        reloaded = FileSystemCrawler(CACHE_PATH, [])
+        reloaded._load_root_dir("/path")
+    expected = {
+        "cache_version": 3,
+        "root_dirs": _as_tuples(legacy_cache["root_dirs"]),
+        "dir_mtimes": {},
+    }
+    assert crawler.cache == expected
+    assert crawler.cache_dirty
+    assert fake_open(CACHE_PATH, "rb").read().startswith(CACHE_MAGIC)
+    assert reloaded.cache == expected
+    assert not reloaded.cache_dirty
+
+
+def test_file_system_crawler_lazy_loading(tmp_path):
+    """Only the queried root directories are decompressed, others are written back as they are"""
+    pattern_set = PatternSet(("*/*/*_R1.fastq.gz", "*/*/*_R2.fastq.gz"), ("left", "right"))
+    cache_path = str(tmp_path / "cache_file")
+    for root in ("path1", "path2"):
+        (tmp_path / root / "P001" / "flowcell" / "lane").mkdir(parents=True)
+        for read in ("R1", "R2"):
+            (tmp_path / root / "P001" / "flowcell" / "lane" / f"P001_{read}.fastq.gz").touch()
+    crawler = FileSystemCrawler(cache_path, [])
+    for root in ("path1", "path2"):
+        assert len(list(crawler.run(str(tmp_path / root), "P001", (pattern_set,), False))) == 1
+    crawler.save_cache()
+
+    crawler = FileSystemCrawler(cache_path, [])
+    with patch.object(crawler, "_walk_into") as walk_into:
+        res = list(crawler.run(str(tmp_path / "path1"), "P001", (pattern_set,), False))
+    assert len(res) == 1
+    assert walk_into.call_count == 0
+    assert list(crawler.cache["root_dirs"]) == [str(tmp_path / "path1")]
+    assert list(crawler.blobs) == [str(tmp_path / "path2")]
+
+
+def test_file_system_crawler_reads_only_queried_entry(tmp_path):
+    """Only the header and the entries of queried root directories are read from the cache file"""
+    pattern_set = PatternSet(("*/*/*_R1.fastq.gz", "*/*/*_R2.fastq.gz"), ("left", "right"))
+    cache_path = str(tmp_path / "cache_file")
+    for root in ("path1", "path2"):
+        (tmp_path / root / "P001" / "flowcell" / "lane").mkdir(parents=True)
+        for read in ("R1", "R2"):
+            (tmp_path / root / "P001" / "flowcell" / "lane" / f"P001_{read}.fastq.gz").touch()
+    crawler = FileSystemCrawler(cache_path, [])
+    for root in ("path1", "path2"):
+        assert len(list(crawler.run(str(tmp_path / root), "P001", (pattern_set,), False))) == 1
+    crawler.save_cache()
+    data = (tmp_path / "cache_file").read_bytes()
+
+    crawler = FileSystemCrawler(cache_path, [])
+    offset, length = crawler.blobs[str(tmp_path / "path1")]
+    assert crawler.cache_file.tell() == data.index(b"\n", len(CACHE_MAGIC)) + 1
+    # Replacing the cache file, as done on saving, does not affect the loaded one
+    (tmp_path / "cache_file.tmp").write_bytes(CACHE_MAGIC + b"garbage")
+    os.replace(cache_path + ".tmp", cache_path)
+    with patch.object(
+        FileSystemCrawler, "_read_blob", wraps=FileSystemCrawler._read_blob
+    ) as read_blob:
+        res = list(crawler.run(str(tmp_path / "path1"), "P001", (pattern_set,), False))
+    assert len(res) == 1
+    read_blob.assert_called_once_with(crawler.cache_file, (offset, length))
+    assert offset + length < len(data)
+    assert list(crawler.blobs) == [str(tmp_path / "path2")]
+
+
+def test_file_system_crawler_save_merges_other_writers(tmp_path):
+    """Saving keeps the root directories written by another crawler in the meantime"""
+    pattern_set = PatternSet(("*/*/*_R1.fastq.gz", "*/*/*_R2.fastq.gz"), ("left", "right"))
+    cache_path = str(tmp_path / "cache_file")
+    for root in ("path1", "path2"):
+        (tmp_path / root / "P001" / "flowcell" / "lane").mkdir(parents=True)
+        for read in ("R1", "R2"):
+            (tmp_path / root / "P001" / "flowcell" / "lane" / f"P001_{read}.fastq.gz").touch()
+    first = FileSystemCrawler(cache_path, [])
+    second = FileSystemCrawler(cache_path, [])
+    for crawler, root in ((first, "path1"), (second, "path2")):
+        assert len(list(crawler.run(str(tmp_path / root), "P001", (pattern_set,), False))) == 1
+        crawler.save_cache()
+
+    reloaded = FileSystemCrawler(cache_path, [])
+    assert sorted(reloaded.blobs) == [str(tmp_path / "path1"), str(tmp_path / "path2")]
+
+
+def test_file_system_crawler_update_changed_dirs(tmp_path):
+    """Invalidation only re-crawls the directories whose modification time changed
+
+    Uses the real file system as pyfakefs does not update directory modification times.
+    """
+    root = str(tmp_path / "path")
+    cache_path = str(tmp_path / "cache_file")
+    invalidation_paths = [str(tmp_path / "sheet.tsv")]
+    pattern_set = PatternSet(("*/*/*_R1.fastq.gz", "*/*/*_R2.fastq.gz"), ("left", "right"))
+    for name in ("P001", "P002", "P003"):
+        (tmp_path / "path" / name / "flowcell" / "lane").mkdir(parents=True)
+        for read in ("R1", "R2"):
+            (tmp_path / "path" / name / "flowcell" / "lane" / f"{name}_{read}.fastq.gz").touch()
+    (tmp_path / "sheet.tsv").touch()
+    crawler = FileSystemCrawler(cache_path, invalidation_paths)
+    assert len(list(crawler.run(root, "P001", (pattern_set,), False))) == 1
+    crawler.save_cache()
+    # New flow cell for P001, removal of P003, and touching the sheet afterwards.
+    (tmp_path / "path" / "P001" / "flowcell2" / "lane").mkdir(parents=True)
+    for read in ("R1", "R2"):
+        (tmp_path / "path" / "P001" / "flowcell2" / "lane" / f"P001_{read}.fastq.gz").touch()
+    shutil.rmtree(str(tmp_path / "path" / "P003"))
+    time.sleep(0.01)
+    (tmp_path / "sheet.tsv").write_text("changed")
+
+    crawler = FileSystemCrawler(cache_path, invalidation_paths)
+    with patch.object(crawler, "_walk_into", wraps=crawler._walk_into) as walk_into:
+        res = list(crawler.run(root, "P001", (pattern_set,), False))
+        res_p003 = list(crawler.run(root, "P003", (pattern_set,), False))
+    crawler.save_cache()
+
+    assert crawler.cache_invalidated
+    assert [call[0][1] for call in walk_into.call_args_list] == ["P001/flowcell2"]
+    assert [r.files for r in res] == [
+        (
+            root + "/P001/flowcell/lane/P001_R1.fastq.gz",
+            root + "/P001/flowcell/lane/P001_R2.fastq.gz",
+        ),
+        (
+            root + "/P001/flowcell2/lane/P001_R1.fastq.gz",
+            root + "/P001/flowcell2/lane/P001_R2.fastq.gz",
+        ),
+    ]
+    assert not res_p003
+    saved = FileSystemCrawler(cache_path, invalidation_paths)
+    saved._load_root_dir(root)
+    assert len(saved.cache["root_dirs"][root]) == 6
+    assert sorted(saved.cache["dir_mtimes"][root]) == [
+        "",
+        "P001",
+        "P001/flowcell",
+        "P001/flowcell/lane",
+        "P001/flowcell2",
+        "P001/flowcell2/lane",
+        "P002",
+        "P002/flowcell",
+        "P002/flowcell/lane",
+    ]
+
+
+def test_file_system_crawler_update_symlink_cycle(tmp_path):
+    """Incremental updates skip symlink cycles to ancestors of the changed directories as a full
+    crawl does
+    """
+    root = str(tmp_path / "path")
+    (tmp_path / "path" / "P001" / "fc" / "lane").mkdir(parents=True)
+    (tmp_path / "path" / "P001" / "fc" / "lane" / "P001_R1.fastq.gz").touch()
+    crawler = FileSystemCrawler(str(tmp_path / "cache_file"), [])
+    crawler._build_cache(root)
+    # Cycle in a changed directory and in a new directory.
+    os.symlink("..", str(tmp_path / "path" / "P001" / "loop"))
+    (tmp_path / "path" / "P001" / "fc2").mkdir()
+    os.symlink("../..", str(tmp_path / "path" / "P001" / "fc2" / "loop"))
+    crawler._update_cache(root)
+
+    full = FileSystemCrawler(str(tmp_path / "cache_file2"), [])
+    full._build_cache(root)
+    assert crawler.cache["root_dirs"][root] == full.cache["root_dirs"][root]
+    assert crawler.cache["root_dirs"][root] == (("P001", "fc", "lane", "P001_R1.fastq.gz"),)
+    assert sorted(crawler.cache["dir_mtimes"][root]) == sorted(full.cache["dir_mtimes"][root])
 
 
 def test_file_system_crawler_crawl_existing_cache(sample_cache_dict):
@@ -385,3 +642,47 @@ def test_file_system_crawler_se_data_pe_pattern_bad_pe_se(sample_cache_dict_pe_s
         with pytest.raises(ValueError) as excinfo:
             list(crawler.run("/path", "P001", (pattern_set,), True))
         assert str(excinfo.value).startswith("Must have the same number of matches per pattern,")
+
+
+# Crawling of large archives.
+
+
+def _count_crawler_matches(tmp_path, num_libraries, num_lookups=100):
+    """Return number of pattern matches for ``num_lookups`` calls of ``FileSystemCrawler.run()``
+    on a synthetic cache with ``num_libraries`` libraries
+    """
+    pattern_set = PatternSet(("*/*/*_R1.fastq.gz", "*/*/*_R2.fastq.gz"), ("left", "right"))
+    crawler = FileSystemCrawler(str(tmp_path / "cache_{}".format(num_libraries)), [])
+    crawler.cache["root_dirs"]["/path"] = tuple(
+        ("P{:05d}".format(i), "flowcell", "lane", "P{:05d}_{}.fastq.gz".format(i, read))
+        for i in range(num_libraries)
+        for read in ("R1", "R2")
+    )
+    calls = []
+
+    def compile_pattern(pattern):
+        match = _compile_pattern(pattern)
+
+        def counting_match(path):
+            calls.append(path)
+            return match(path)
+
+        return counting_match
+
+    step = max(1, num_libraries // num_lookups)
+    names = ["P{:05d}".format(i) for i in range(0, num_libraries, step)][:num_lookups]
+    with patch("snappy_pipeline.find_file._compile_pattern", compile_pattern):
+        for name in names:
+            res = list(crawler.run("/path", name, (pattern_set,), False))
+            assert len(res) == 1
+    # The index is built once for the root directory only.
+    assert list(crawler.path_index) == ["/path"]
+    return len(calls)
+
+
+def test_file_system_crawler_lookup_scales(tmp_path):
+    """The paths matched per lookup must not grow with the number of libraries in the cache"""
+    small = _count_crawler_matches(tmp_path, 100)
+    large = _count_crawler_matches(tmp_path, 10_000)
+    # Two files with two patterns each per lookup, a linear scan would match all paths.
+    assert small == large == 100 * 2 * 2
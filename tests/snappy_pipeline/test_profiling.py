@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Tests for the DAG construction profiler"""
+
+import inspect
+import json
+
+from snappy_pipeline.profiling import (
+    REPORT_HEADER,
+    DagProfiler,
+    get_dag_profiler,
+    start_dag_profiling,
+    stop_dag_profiling,
+)
+
+
+class FakeClock:
+    """Clock that advances by one second on each call"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += 1.0
+        return self.now
+
+
+def test_dag_profiler_wrap_keeps_signature():
+    def params_function(wildcards, input, threads):
+        return {"threads": threads}
+
+    wrapped = DagProfiler().wrap("step", "part", "run", "get_params", params_function)
+    assert list(inspect.signature(wrapped).parameters) == ["wildcards", "input", "threads"]
+    assert wrapped({"x": 1}, input=[], threads=4) == {"threads": 4}
+
+
+def test_dag_profiler_counts(tmpdir):
+    profiler = DagProfiler(clock=FakeClock())
+
+    def slow(wildcards):
+        profiler.clock()  # consume another second
+        profiler.record_cache_hit()
+        return wildcards["x"]
+
+    fast = profiler.wrap("step", "fast", "run", "get_input_files", lambda wildcards: None)
+    slow = profiler.wrap("step", "slow", "run", "get_input_files", slow)
+    for x in (1, 2, 1):
+        slow({"x": x})
+    fast({"x": 1})
+    profiler.record_cache_hit()  # outside of wrapped functions, ignored
+
+    report = profiler.get_report()
+    assert [entry["step_part"] for entry in report] == ["slow", "fast"]
+    assert report[0]["calls"] == 3
+    assert report[0]["repeated_calls"] == 1
+    assert report[0]["cache_hits"] == 3
+    assert report[0]["total_seconds"] == 6.0
+    assert report[0]["mean_seconds"] == 2.0
+    assert report[1]["cache_hits"] == 0
+
+    path_tsv, path_json = profiler.write_report(str(tmpdir.join("profile")))
+    with open(path_tsv, "rt") as inputf:
+        lines = inputf.read().splitlines()
+    assert lines[0].split("\t") == list(REPORT_HEADER)
+    assert lines[1].split("\t")[:7] == ["step", "slow", "run", "get_input_files", "3", "1", "3"]
+    with open(path_json, "rt") as inputf:
+        assert json.load(inputf) == report
+
+
+def test_start_stop_dag_profiling():
+    assert get_dag_profiler() is None
+    profiler = start_dag_profiling()
+    assert get_dag_profiler() is profiler
+    assert stop_dag_profiling() is profiler
+    assert get_dag_profiler() is None
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Tests for the history-based resource model"""
+
+import pytest
+
+from snappy_pipeline.resource_model import (
+    HISTORY_FILE_NAME,
+    ResourceModel,
+    fit_linear,
+    format_time,
+    parse_time,
+)
+
+__author__ = "Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>"
+
+#: Header of the Snakemake benchmark files
+HEADER = "s\th:m:s\tmax_rss\tmax_vms\tmax_uss\tmax_pss\tio_in\tio_out\tmean_load\tcpu_time\n"
+
+
+def test_fit_linear():
+    assert fit_linear([1, 2, 3], [3, 5, 7]) == pytest.approx((1.0, 2.0, 0.0))
+    assert fit_linear([1, 2, 3], [3, 6, 7]) == pytest.approx((4 / 3, 2.0, 2 / 3))
+    assert fit_linear([5, 5], [1, 3]) == pytest.approx((2.0, 0.0, 1.0))
+
+
+@pytest.mark.parametrize(
+    "value,seconds",
+    [("04:00", 4 * 3600), ("3:59:00", 3 * 3600 + 59 * 60), ("1-02:00", 26 * 3600)],
+)
+def test_parse_time(value, seconds):
+    assert parse_time(value) == seconds
+
+
+def test_format_time():
+    assert format_time(26 * 3600 + 61.2) == "26:01:01"
+
+
+def write_job(work_dir, name, input_bytes, seconds, max_rss):
+    path = "work/{name}/log/{name}.bwa.run.benchmark.txt".format(name=name)
+    row = (seconds, "-", max_rss, "-", "-", "-", "-", "-", "-", "-")
+    work_dir.join(path).write(HEADER + "\t".join(map(str, row)) + "\n", ensure=True)
+    with work_dir.join(HISTORY_FILE_NAME).open("at") as outputf:
+        print("ngs_mapping_bwa_run", path, input_bytes, sep="\t", file=outputf)
+
+
+def test_resource_model_predict(tmpdir):
+    model = ResourceModel(str(tmpdir), margin=2.0)
+    model.set_fallback("__default__", "mem", 4096)
+    model.set_fallback("ngs_mapping_bwa_run", "time", "12:00")
+    write_job(tmpdir, "P001", 1000, 1000.0, 100.0)
+    write_job(tmpdir, "P002", 2000, 2000.0, 200.0)
+    # Too few records, use the static values
+    assert model.predict("ngs_mapping_bwa_run", "mem", 3000) == 4096
+    assert model.predict("ngs_mapping_bwa_run", "time", 3000) == "12:00"
+    # Fit with the third record, minimal memory is enforced
+    write_job(tmpdir, "P003", 3000, 3000.0, 300.0)
+    model = ResourceModel(str(tmpdir), margin=2.0)
+    assert model.predict("ngs_mapping_bwa_run", "mem", 10000) == 2000
+    assert model.predict("ngs_mapping_bwa_run", "mem", 10) == 256
+    assert model.predict("ngs_mapping_bwa_run", "time", 10000) == "5:33:20"
+    assert model.predict("ngs_mapping_bwa_run", "time", None) is None
+
+
+def test_resource_model_history(tmpdir):
+    model = ResourceModel(str(tmpdir))
+    model.add_record("rule_a", "work/a/log/a.benchmark.txt", 10)
+    model.add_record("rule_b", "work/b/log/b.benchmark.txt", 20)
+    model.save_history()
+    model.add_record("rule_a", "work/a/log/a.benchmark.txt", 15)
+    model.save_history()
+    expected = "rule_a\twork/a/log/a.benchmark.txt\t15\nrule_b\twork/b/log/b.benchmark.txt\t20\n"
+    assert tmpdir.join(HISTORY_FILE_NAME).read() == expected
+    assert list(ResourceModel(str(tmpdir)).get_history().values()) == [
+        ("rule_a", 15),
+        ("rule_b", 20),
+    ]
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Tests for the staging of input files to node-local scratch"""
+
+import os
+import subprocess
+
+from snappy_pipeline.staging import get_staged_path, stage_files, wrap_input_function
+
+__author__ = "Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>"
+
+#: Path to the job script template
+JOBSCRIPT = os.path.join(
+    os.path.dirname(__file__), "..", "..", "snappy_pipeline", "apps", "tpls", "jobscript.sh"
+)
+
+
+def test_stage_files(tmpdir):
+    tmpdir.join("data/x.bam").write("bam", ensure=True)
+    tmpdir.join("data/x.bam.bai").write("bai")
+    tmpdir.join("data/x.vcf.gz").write("vcf")
+    stage_dir = str(tmpdir.join("stage"))
+    bam, vcf, missing = (str(tmpdir.join("data", name)) for name in ("x.bam", "x.vcf.gz", "y.bam"))
+    result = stage_files({"bam": bam, "vcf": [vcf, missing]}, stage_dir)
+    # Only existing BAM files are copied, together with their index
+    assert result == {"bam": get_staged_path(bam, stage_dir), "vcf": [vcf, missing]}
+    assert open(result["bam"]).read() == "bam"
+    assert open(result["bam"] + ".bai").read() == "bai"
+    assert os.path.basename(result["bam"]) == "x.bam"
+
+
+def test_wrap_input_function(tmpdir):
+    tmpdir.join("x.cram").write("cram")
+    stage_dir = str(tmpdir.join("stage"))
+
+    def input_function(wildcards):
+        return [str(tmpdir.join(wildcards + ".cram"))]
+
+    wrapper = wrap_input_function(input_function, stage_dir)
+    assert wrapper.__name__ == "input_function"
+    assert wrapper("x") == [get_staged_path(str(tmpdir.join("x.cram")), stage_dir)]
+
+
+def test_jobscript_scratch(tmpdir):
+    """Check that the job script puts TMPDIR on scratch and removes it at the end"""
+    with open(JOBSCRIPT, "rt") as inputf:
+        script = inputf.read().format(
+            properties="{}", exec_job='echo "$TMPDIR $SNAPPY_PIPELINE_STAGE_DIR"; exit 3'
+        )
+    env = dict(os.environ, SNAPPY_PIPELINE_SCRATCH="auto", SLURM_TMPDIR=str(tmpdir))
+    env["SNAPPY_PIPELINE_STAGE_INPUTS"] = "1"
+    proc = subprocess.run(["bash", "-c", script], env=env, stdout=subprocess.PIPE, text=True)
+    assert proc.returncode == 3
+    tmp_dir, stage_dir = proc.stdout.split()
+    assert os.path.dirname(tmp_dir) == str(tmpdir)
+    assert stage_dir == tmp_dir + "/staged_inputs"
+    assert not os.path.exists(tmp_dir)
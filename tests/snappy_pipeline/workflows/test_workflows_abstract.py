@@ -2,20 +2,35 @@
 """Code for testing the code in the "abstract" workflow
 """
 
+import os
 import textwrap
 
-from biomedsheets.shortcuts import GenericSampleSheet
+from biomedsheets.shortcuts import GenericSampleSheet, GermlineCaseSheet
 import pytest
 import ruamel.yaml as yaml
+from snakemake.common import Mode
 from snakemake.io import Wildcards
-
-from snappy_pipeline.base import MissingConfiguration
+from snakemake.workflow import Workflow
+
+from snappy_pipeline.base import (
+    JOB_GROUPS_ENV_VAR,
+    LOCAL_RESOURCES_ENV_VAR,
+    RESOURCE_MODEL_ENV_VAR,
+    SUB_WORKFLOW_MANIFESTS_ENV_VAR,
+    MissingConfiguration,
+)
+from snappy_pipeline.profiling import start_dag_profiling, stop_dag_profiling
+from snappy_pipeline.workflows import abstract
 from snappy_pipeline.workflows.abstract import (
     BaseStep,
+    BaseStepPart,
     DataSetInfo,
     LinkInPathGenerator,
     LinkInStep,
     LinkOutStepPart,
+    ManifestSubWorkflow,
+    OutputManifest,
+    symlink_files,
 )
 
 from .conftest import patch_module_fs
@@ -92,6 +107,49 @@ def test_data_set_info_load_cancer_tsv(cancer_sheet_fake_fs, config_lookup_paths
     assert actual == expected
 
 
+def test_data_set_info_persistent_sheet_cache(germline_sheet_fake_fs, config_lookup_paths, mocker):
+    # Patch out the file system related things in the abstract workflow module
+    patch_module_fs("snappy_pipeline.workflows.abstract", germline_sheet_fake_fs, mocker)
+    read_sheet = mocker.spy(abstract.io_tsv, "read_germline_tsv_sheet")
+
+    def load_info():
+        # Clear in-process caches such that the cache file is used
+        abstract._SHEET_CACHE_ENTRIES.clear()
+        abstract._cached_read_germline_tsv_sheet.cache_clear()
+        return DataSetInfo(
+            "first_batch",
+            "sheet.tsv",
+            config_lookup_paths,
+            ["/path"],
+            [{"left": "*_R1.fastq.gz", "right": "*_R2.fastq.gz"}],
+            "germline_variants",
+            False,
+            "secondary_id_pk",
+            False,
+            None,
+            None,
+        )
+
+    # Exercise the code under test
+    first = load_info()
+    shortcut = first.get_shortcut_sheet(GermlineCaseSheet, (), {})
+    assert germline_sheet_fake_fs.os.path.exists("/work/config/.sheet.tsv.snappy_cache")
+    second = load_info()
+    second_shortcut = second.get_shortcut_sheet(GermlineCaseSheet, (), {})
+    # Check results, the sheet is only parsed again after changing it
+    assert read_sheet.call_count == 1
+    assert sorted(second.sheet.bio_entities) == sorted(first.sheet.bio_entities)
+    assert second_shortcut.sheet is second.sheet
+    assert list(second_shortcut.index_ngs_library_to_pedigree) == list(
+        shortcut.index_ngs_library_to_pedigree
+    )
+    with germline_sheet_fake_fs.open("/work/config/sheet.tsv", "at") as f:
+        f.write("P007\t.\t.\tF\tY\tWGS\tAgilent SureSelect Human All Exon V6\tP007\t.\n")
+    third = load_info()
+    assert read_sheet.call_count == 2
+    assert "P007" in third.sheet.bio_entities
+
+
 # Test LinkInPathGenerator ------------------------------------------------------------------------
 
 
@@ -121,6 +179,37 @@ def test_link_in_path_generator(germline_sheet_fake_fs, config_lookup_paths, wor
     assert list(generator.run("P001")) == expected
 
 
+def test_link_in_path_generator_memoized(
+    germline_sheet_fake_fs, config_lookup_paths, work_dir, mocker
+):
+    # Patch out the file system related things in the abstract workflow module
+    patch_module_fs("snappy_pipeline.workflows.abstract", germline_sheet_fake_fs, mocker)
+    # Exercise the code under test
+    info = DataSetInfo(
+        "first_batch",
+        "sheet.tsv",
+        config_lookup_paths,
+        ["/path"],
+        [{"left": "*/*/*_R1.fastq.gz", "right": "*/*/*_R2.fastq.gz"}],
+        "germline_variants",
+        False,
+        "secondary_id_pk",
+        False,
+        None,
+        None,
+    )
+    generator = LinkInPathGenerator(work_dir, [info], [], cache_file_name="_cache_file")
+    crawler_run = mocker.spy(generator.crawler, "run")
+    first = list(generator.run("P001"))
+    second = list(generator.run("P001"))
+    left = list(generator.run("P001", ("left",)))
+    # Check results
+    assert first == second
+    assert left == first[:1]
+    assert crawler_run.call_count == 2
+    assert (generator.cache_hits, generator.cache_misses) == (1, 2)
+
+
 # Test LinkInStep ------------------------------------------------------------------------
 
 
@@ -245,6 +334,25 @@ def test_link_in_step_part_get_shell_cmd_double_link_in_regression(
     assert actual == expected
 
 
+def test_link_in_step_part_batch(germline_sheet_fake_fs, dummy_generic_step):
+    donors = ["P00{}".format(i) for i in range(1, 7)]
+    expected = ["work/input_links/{}-N1-DNA1-WGS1/.done".format(donor) for donor in donors]
+    assert list(dummy_generic_step.get_output_files("link_in", "batch")) == expected
+    # Exercise code under test
+    germline_sheet_fake_fs.os.chdir("/work")
+    dummy_generic_step.substep_dispatch("link_in", "run", "batch", Wildcards())
+    # Check results
+    fake_os = germline_sheet_fake_fs.os
+    for donor in donors:
+        link_dir = "/work/work/input_links/{}-N1-DNA1-WGS1/FCXXXXXX/L001".format(donor)
+        for i in (1, 2):
+            filename = "{}_R{}.fastq.gz".format(donor, i)
+            path = fake_os.path.join(link_dir, filename)
+            assert fake_os.path.islink(path)
+            expected = "../../../../../../path/{}/FCXXXXXX/L001/{}".format(donor, filename)
+            assert fake_os.readlink(path) == expected
+
+
 # Tests for LinkOutStepPart -----------------------------------------------------------------------
 
 
@@ -257,6 +365,23 @@ def test_link_out_step_part_get_input_files(dummy_generic_step):
     assert actual == expected
 
 
+def test_link_out_step_part_get_input_files_profiled(dummy_generic_step):
+    profiler = start_dag_profiling()
+    try:
+        func = dummy_generic_step.get_input_files("link_out", "run")
+        wildcards = Wildcards(fromdict={"path": "path", "file": "file", "ext": "txt"})
+        assert func(wildcards) == "work/path/file.txt"
+        assert func(wildcards) == "work/path/file.txt"
+    finally:
+        stop_dag_profiling()
+    assert func.__wrapped__.__name__ == "input_function"
+    (entry,) = profiler.get_report()
+    assert (entry["step"], entry["step_part"], entry["action"]) == ("dummy", "link_out", "run")
+    assert (entry["function"], entry["calls"], entry["repeated_calls"]) == ("get_input_files", 2, 1)
+    assert callable(dummy_generic_step.get_input_files("link_out", "run"))
+    assert not hasattr(dummy_generic_step.get_input_files("link_out", "run"), "__wrapped__")
+
+
 def test_link_out_step_part_get_output_files(dummy_generic_step):
     expected = "output/{path}/{file}.{ext}"
     actual = dummy_generic_step.get_output_files("link_out", "run")
@@ -277,6 +402,84 @@ def test_link_out_step_part_get_shell_cmd(dummy_generic_step):
     assert actual == expected
 
 
+def test_link_out_step_part_batch(dummy_generic_step, mocker):
+    result_files = ["output/a/a.vcf.gz", "output/a/a.vcf.gz.tbi", "output/b/x.txt", "other.txt"]
+    mocker.patch.object(dummy_generic_step, "get_result_files", return_value=result_files)
+    dummy_generic_step.sub_steps["link_out"].disable_patterns = ["work/b/*"]
+    expected = ["work/a/a.vcf.gz", "work/a/a.vcf.gz.tbi"]
+    assert dummy_generic_step.get_input_files("link_out", "batch") == expected
+    expected = ["output/a/a.vcf.gz", "output/a/a.vcf.gz.tbi"]
+    assert dummy_generic_step.get_output_files("link_out", "batch") == expected
+
+
+@pytest.mark.parametrize("mode,defined", [(Mode.default, True), (Mode.cluster, False)])
+def test_batch_links_rules(dummy_generic_step, tmpdir, mocker, mode, defined):
+    mocker.patch.object(dummy_generic_step, "get_result_files", return_value=["output/a/a.txt"])
+    mocker.patch.object(dummy_generic_step, "use_batch_links", True)
+    batch_names = mocker.patch.object(LinkInStep, "_get_batch_library_names")
+    rules_path = os.path.join(os.path.dirname(abstract.__file__), "batch_links.rules")
+    snakefile = tmpdir.join("Snakefile")
+    snakefile.write(
+        textwrap.dedent(
+            """
+            rule dummy_link_out_run:
+                output:
+                    "output/{{path}}/{{file}}.txt",
+                shell:
+                    "true"
+
+            include: {!r}
+            """
+        ).format(rules_path)
+    )
+    workflow = Workflow(snakefile=str(snakefile), mode=mode)
+    workflow.globals["wf"] = dummy_generic_step
+    # Exercise code under test
+    workflow.include(str(snakefile))
+    # Check results
+    assert workflow.is_rule("link_out_batch_run") == defined
+    assert not workflow.is_rule("link_in_batch_run")
+    assert not batch_names.called
+    if defined:
+        rule = workflow.get_rule("link_out_batch_run")
+        assert list(rule.output) == ["output/a/a.txt"]
+        assert workflow.is_local(rule)
+        assert rule > workflow.get_rule("dummy_link_out_run")
+
+
+def test_base_step_part_get_benchmark_file(dummy_generic_step):
+    class LogStepPart(BaseStepPart):
+        name = "log_part"
+
+        def _get_log_file(self, action):
+            if action == "dict":
+                return {
+                    "conda_info": "work/{x}/log/{x}.conda_info.txt",
+                    "log": "work/{x}/log/{x}.log",
+                }
+            else:
+                return "work/{x}/log/snakemake.log"
+
+    step_part = LogStepPart(dummy_generic_step)
+    expected = "work/{x}/log/{x}.log_part.dict.benchmark.txt"
+    assert step_part.get_benchmark_file("dict") == expected
+    expected = "work/{x}/log/snakemake.log_part.run.benchmark.txt"
+    assert step_part.get_benchmark_file("run") == expected
+
+
+def test_symlink_files(tmpdir):
+    tmpdir.join("work", "a.txt").write("a", ensure=True)
+    pairs = [
+        (str(tmpdir.join("work", "a.txt")), str(tmpdir.join("output", "a", "a.txt"))),
+        (str(tmpdir.join("work", "a.txt")), str(tmpdir.join("output", "b.txt"))),
+    ]
+    assert symlink_files(pairs) == 2
+    assert tmpdir.join("output", "a", "a.txt").readlink() == "../../work/a.txt"
+    assert tmpdir.join("output", "b.txt").read() == "a"
+    # Existing links are kept
+    assert symlink_files(pairs) == 0
+
+
 # Tests for BaseStep ------------------------------------------------------------------------------
 
 
@@ -284,3 +487,176 @@ def test_base_step_ensure_w_config(dummy_generic_step):
     dummy_generic_step.ensure_w_config(("step_config", "dummy", "key"), "should be OK")
     with pytest.raises(MissingConfiguration):
         dummy_generic_step.ensure_w_config(("step_config", "dummy", "foo"), "should fail")
+
+
+def test_base_step_ngs_library_folder_name_index(dummy_generic_step):
+    expected = {"P00{}-N1-DNA1-WGS1".format(i): "P00{}".format(i) for i in range(1, 7)}
+    assert dummy_generic_step.ngs_library_to_folder_name == expected
+    assert dummy_generic_step.get_ngs_library_folder_name("P004-N1-DNA1-WGS1") == "P004"
+    with pytest.raises(ValueError):
+        dummy_generic_step.get_ngs_library_folder_name("P007-N1-DNA1-WGS1")
+
+
+def test_base_step_update_config_cached(dummy_generic_step, mocker):
+    spy = mocker.spy(abstract, "merge_dicts")
+    config = {"step_config": {"dummy": {"key": "other"}}}
+    first = dummy_generic_step._update_config(config)
+    assert first["step_config"]["dummy"]["key"] == "other"
+    num_calls = spy.call_count
+    first["step_config"]["dummy"]["key"] = "modified"
+    second = dummy_generic_step._update_config(config)
+    assert second["step_config"]["dummy"]["key"] == "other"
+    assert spy.call_count == num_calls
+
+
+# Tests for OutputManifest and ManifestSubWorkflow ------------------------------------------------
+
+
+def test_output_manifest_round_trip(tmpdir):
+    tmpdir.join("output", "a.txt").write("a", ensure=True)
+    manifest = OutputManifest.from_result_files("step", ["output/a.txt"], str(tmpdir))
+    assert manifest.complete
+    manifest.save(str(tmpdir))
+    loaded = OutputManifest.load(str(tmpdir))
+    assert loaded.step == "step"
+    assert loaded.complete
+    assert loaded.files == {"output/a.txt": tmpdir.join("output", "a.txt").mtime()}
+    manifest = OutputManifest.from_result_files("step", ["output/a.txt", "missing"], str(tmpdir))
+    assert not manifest.complete
+    assert OutputManifest.load(str(tmpdir.join("missing"))) is None
+
+
+def test_base_step_register_sub_workflow_manifest(dummy_generic_step, monkeypatch):
+    manifest = OutputManifest("ngs_mapping", {"output/bwa.P001/out/bwa.P001.bam": 1.0}, True)
+    manifest.save("/work")
+    monkeypatch.setenv(SUB_WORKFLOW_MANIFESTS_ENV_VAR, "1")
+    dummy_generic_step.register_sub_workflow("ngs_mapping", "/work")
+    dummy_generic_step.workflow.subworkflow.assert_not_called()
+    sub_workflow = dummy_generic_step.sub_workflows["ngs_mapping"]
+    assert isinstance(sub_workflow, ManifestSubWorkflow)
+    assert (
+        sub_workflow("output/bwa.P001/out/bwa.P001.bam") == "/work/output/bwa.P001/out/bwa.P001.bam"
+    )
+    assert sub_workflow(["output/other"]) == ["/work/output/other"]
+    assert sub_workflow.unknown_paths == {"output/other"}
+
+
+def test_base_step_register_sub_workflow_manifest_fallback(dummy_generic_step, monkeypatch):
+    OutputManifest("ngs_mapping", {}, False).save("/work")
+    monkeypatch.setenv(SUB_WORKFLOW_MANIFESTS_ENV_VAR, "1")
+    dummy_generic_step.register_sub_workflow("ngs_mapping", "/work")
+    dummy_generic_step.workflow.subworkflow.assert_called_once()
+    assert not isinstance(dummy_generic_step.sub_workflows["ngs_mapping"], ManifestSubWorkflow)
+
+
+def test_base_step_resource_model(
+    dummy_generic_step,
+    dummy_workflow,
+    dummy_config,
+    dummy_cluster_config,
+    config_lookup_paths,
+    config_paths,
+    work_dir,
+    monkeypatch,
+):
+    monkeypatch.setenv(RESOURCE_MODEL_ENV_VAR, "2.0")
+    step = type(dummy_generic_step)(
+        dummy_workflow,
+        dummy_config,
+        dummy_cluster_config,
+        config_lookup_paths,
+        config_paths,
+        work_dir,
+    )
+    # The static values are replaced by the predicted resources
+    assert step.resource_model.margin == 2.0
+    assert dict(step.cluster_config["__default__"]) == {
+        "mem": "{resources.snappy_mem}",
+        "time": "{resources.snappy_time}",
+        "ntasks": 1,
+    }
+    assert step.resource_model.get_fallback("dummy_rule", "mem") == 4096
+    # The resource functions record the input size and fall back to the static values
+    parsed = dict(
+        call.args for call in dummy_workflow.default_resources.parsed.__setitem__.mock_calls
+    )
+    rule = dummy_workflow.get_rule.return_value
+    rule.benchmark.apply_wildcards.return_value = "work/x/log/x.dummy.run.benchmark.txt"
+    wildcards = Wildcards(fromdict={"x": "x"})
+    assert parsed["snappy_mem"](wildcards, ["/work/config/sheet.tsv"], "dummy_rule") == 4096
+    assert parsed["snappy_time"](wildcards, [], "dummy_rule") == "12:00"
+    assert step.resource_model.get_history()["work/x/log/x.dummy.run.benchmark.txt"] == (
+        "dummy_rule",
+        0,
+    )
+
+
+def test_base_step_local_resources(
+    dummy_generic_step,
+    dummy_workflow,
+    dummy_config,
+    dummy_cluster_config,
+    config_lookup_paths,
+    config_paths,
+    work_dir,
+    monkeypatch,
+):
+    monkeypatch.setenv(LOCAL_RESOURCES_ENV_VAR, "1")
+    step = type(dummy_generic_step)(
+        dummy_workflow,
+        dummy_config,
+        dummy_cluster_config,
+        config_lookup_paths,
+        config_paths,
+        work_dir,
+    )
+    step.cluster_config["dummy_rule"] = {"mem": 1000, "ntasks": 8}
+    parsed = dict(
+        call.args for call in dummy_workflow.default_resources.parsed.__setitem__.mock_calls
+    )
+    wildcards = Wildcards(fromdict={})
+    assert parsed["mem_mb"](wildcards, [], "dummy_rule") == 1000
+    assert parsed["_cores"](wildcards, [], "dummy_rule") == 8
+    assert parsed["mem_mb"](wildcards, [], "other_rule") == 4096
+    assert parsed["_cores"](wildcards, [], "other_rule") == 1
+
+
+def test_base_step_job_groups(
+    dummy_generic_step,
+    dummy_workflow,
+    dummy_config,
+    dummy_cluster_config,
+    config_lookup_paths,
+    config_paths,
+    work_dir,
+    monkeypatch,
+):
+    class ShortStepPart(BaseStepPart):
+        name = "short"
+        bundle_actions = ("run",)
+
+        def update_cluster_config(self, cluster_config):
+            cluster_config["dummy_short_run"] = {"mem": 1024, "time": "00:10", "ntasks": 1}
+
+    monkeypatch.setenv(JOB_GROUPS_ENV_VAR, "10,dummy_other_run=3,dummy_single_run=1")
+    dummy_workflow.overwrite_groups = {}
+    dummy_workflow.group_components = {}
+    step = type(dummy_generic_step)(
+        dummy_workflow,
+        dummy_config,
+        dummy_cluster_config,
+        config_lookup_paths,
+        config_paths,
+        work_dir,
+    )
+    step.register_sub_step_classes((ShortStepPart,))
+    # Each rule gets a group of its own name, groups of size one are not registered
+    assert step.job_groups == {"dummy_short_run": 10, "dummy_other_run": 3}
+    assert dummy_workflow.overwrite_groups == {
+        "dummy_short_run": "dummy_short_run",
+        "dummy_other_run": "dummy_other_run",
+    }
+    assert dummy_workflow.group_components == step.job_groups
+    # The running time of the group jobs is multiplied with the group size
+    assert step.cluster_config["dummy_short_run"] == {"mem": 1024, "time": "1:40:00", "ntasks": 1}
+    assert step.cluster_config["dummy_other_run"] == {"mem": 4096, "time": "36:00:00", "ntasks": 1}
@@ -530,6 +530,10 @@ def test_ngs_mapping_workflow_steps(ngs_mapping_workflow):
     ]
     actual = list(sorted(ngs_mapping_workflow.sub_steps.keys()))
     assert actual == expected
+    # Check that the step parts share the link-in path generator
+    path_gen = ngs_mapping_workflow.link_in_path_generator
+    for name in ("bwa", "external", "link_in", "minimap2", "ngmlr", "star"):
+        assert ngs_mapping_workflow.sub_steps[name].path_gen is path_gen
 
 
 def test_ngs_mapping_workflow_files(ngs_mapping_workflow):
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""Tests for the Snakefile generation of the parallel wrappers"""
+
+import logging
+import os
+import subprocess
+import textwrap
+from types import SimpleNamespace
+
+from snakemake.io import Log, Namedlist, Wildcards, is_flagged
+from snakemake.utils import format as snakemake_format
+from snakemake.workflow import Workflow
+
+from snappy_wrappers.wrapper_parallel import (
+    ParallelVariantCallingBaseWrapper,
+    ResourceUsage,
+    SgeResourceUsageConverter,
+    check_chunk_manifest,
+    gib,
+    hours,
+    in_working_dir,
+    write_chunk_manifest,
+)
+
+
+#: Path to the wrappers
+WRAPPERS_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "snappy_wrappers", "wrappers")
+
+
+class FakeWrapper(ParallelVariantCallingBaseWrapper):
+    inner_wrapper = "fake"
+    step_name = "variant_calling"
+    tool_name = "fake"
+    window_padding = 100
+
+
+def make_wrapper(tmpdir, window_length=1000, wrapper_class=FakeWrapper, input_=None):
+    tmpdir.join("ref.fa.fai").write("1\t2500\t3\t60\t61\n2\t1000\t3000\t60\t61\n")
+    tmpdir.join("in.bam").write("bam")
+    log = Log(
+        fromdict={
+            key: str(tmpdir.join(key))
+            for key in ("log", "conda_list", "conda_info", "conda_list_md5", "conda_info_md5")
+        }
+    )
+    config = {
+        "static_data_config": {"reference": {"path": str(tmpdir.join("ref.fa"))}},
+        "step_config": {
+            wrapper_class.step_name: {
+                wrapper_class.tool_name: {"window_length": window_length, "ignore_chroms": []}
+            }
+        },
+    }
+    snakemake_ = SimpleNamespace(
+        config=config,
+        input=input_ or Namedlist([str(tmpdir.join("in.bam"))]),
+        output=Namedlist(
+            fromdict={
+                key: str(tmpdir.join("out." + ext)) for key, ext in wrapper_class.key_ext.items()
+            }
+        ),
+        params=Namedlist(fromdict={"args": {"intervals": [], "y": 1}, "x": "z"}),
+        wildcards=Namedlist(),
+        log=log,
+    )
+    wrapper = wrapper_class(snakemake_)
+    wrapper.job_resources = ResourceUsage()
+    wrapper.merge_resources = ResourceUsage()
+    return wrapper
+
+
+def test_construct_parallel_rules(tmpdir):
+    wrapper = make_wrapper(tmpdir)
+    rules = list(wrapper.construct_parallel_rules())
+    assert len(rules) == 2
+    assert "rule chunk:" in rules[0]
+    assert "cluster_config['chunk']" in rules[0]
+    assert "rule trim_chunk:" in rules[1]
+    wrapper.merge_naive = False
+    rules = list(wrapper.construct_parallel_rules())
+    assert len(rules) == 1
+    assert 'touch("job_out.{jobno}.d/.done")' in rules[0]
+
+
+def test_chunk_rule(tmpdir):
+    """Check that the single ``chunk`` rule gets the region of the job from the region table"""
+    wrapper = make_wrapper(tmpdir)
+    work_dir = tmpdir.join("work").ensure(dir=True)
+    with in_working_dir(str(work_dir)):
+        wrapper._write_config_file()
+        wrapper._write_region_table()
+        with open("Snakefile", "wt") as snakefile:
+            print(wrapper.construct_preamble(), file=snakefile)
+            print("\n".join(wrapper.construct_parallel_rules()), file=snakefile)
+        workflow = Workflow(snakefile=str(work_dir.join("Snakefile")))
+        workflow.include("Snakefile")
+    logging.shutdown()
+    rule = workflow.get_rule("chunk")
+    assert rule.wildcard_names == {"jobno"}
+    assert workflow.globals["REGIONS"] == [
+        {"args": {"intervals": ["1:1-1,100"]}, "core": "1:1-1000"},
+        {"args": {"intervals": ["1:901-2,100"]}, "core": "1:1001-2000"},
+        {"args": {"intervals": ["1:1,901-2,500"]}, "core": "1:2001-2500"},
+        {"args": {"intervals": ["2:1-1,000"]}, "core": "2:1-1000"},
+    ]
+    params = workflow.globals["chunk_params"]
+    assert params["x"] == "z"
+    args = params["args"](Wildcards(fromdict={"jobno": "2"}))
+    assert args == {"intervals": ["1:1,901-2,500"], "y": 1}
+
+
+def load_workflow(wrapper, work_dir, run_local=True):
+    """Write the Snakefile of ``wrapper`` to ``work_dir`` and return the loaded workflow"""
+    with in_working_dir(str(work_dir)):
+        wrapper._write_config_file()
+        wrapper._write_region_table()
+        wrapper._write_snakefile()
+        workflow = Workflow(snakefile=str(work_dir.join("Snakefile")), run_local=run_local)
+        workflow.include("Snakefile")
+    logging.shutdown()
+    return workflow
+
+
+def test_merge_tree(tmpdir):
+    wrapper = make_wrapper(tmpdir, window_length=500)  # 7 chunks
+    wrapper.merge_block_size = 2
+    assert wrapper.use_naive_merge()
+    workflow = load_workflow(wrapper, tmpdir.join("work").ensure(dir=True))
+    rules = {rule.name: rule for rule in workflow.rules}
+    assert sorted(rules) == ["all", "chunk", "merge_all"] + [
+        "merge_chunk_%d" % i for i in range(6)
+    ] + ["trim_chunk"]
+    assert list(rules["merge_chunk_3"].input) == ["job_out.6.d/out/tmp_6.vcf.gz"]
+    assert list(rules["merge_chunk_5"].input) == [
+        "merge_out.2.d/out/out.vcf.gz",
+        "merge_out.3.d/out/out.vcf.gz",
+    ]
+    assert list(rules["merge_all"].input) == [
+        "merge_out.4.d/out/out.vcf.gz",
+        "merge_out.5.d/out/out.vcf.gz",
+    ]
+    # The chunks have been trimmed in the parallel jobs, all levels only concatenate
+    for name in ("merge_chunk_0", "merge_chunk_4", "merge_all"):
+        assert "bcftools concat --naive" in rules[name].shellcmd
+        assert "bcftools view" not in rules[name].shellcmd
+
+
+def load_wrapper_class(path, name):
+    """Return wrapper class ``name`` from ``wrapper.py`` at ``path`` without running it"""
+    with open(path, "rt") as inputf:
+        source = inputf.read().split("# Kick off execution")[0]
+    namespace = {"__file__": path, "__name__": "wrapper"}
+    exec(compile(source, path, "exec"), namespace)
+    return namespace[name]
+
+
+def test_mutect2_merge_tree(tmpdir):
+    """Check that the F1R2 archives are found on all levels of the merge tree of MuTect 2"""
+    wrapper_class = load_wrapper_class(
+        os.path.join(WRAPPERS_DIR, "mutect2_par", "run", "wrapper.py"), "ParallelMutect2Wrapper"
+    )
+    input_ = Namedlist(fromdict={"tumor_bam": "tumor.bam", "normal_bam": "normal.bam"})
+    wrapper = make_wrapper(tmpdir, 1000, wrapper_class, input_)
+    wrapper.merge_block_size = 2  # 4 chunks
+    work_dir = tmpdir.join("work").ensure(dir=True)
+    workflow = load_workflow(wrapper, work_dir)
+    # Fake tools that create their output files
+    fake_tool = textwrap.dedent(
+        r"""
+        #!/bin/bash
+        if [[ $(basename $0) == tabix ]]; then touch "${@: -1}.tbi"; fi
+        while [[ $# -gt 0 ]]; do
+            if [[ $1 == -o || $1 == -O ]]; then touch "$2"; fi
+            shift
+        done
+        """
+    ).lstrip()
+    for name in ("gatk", "bcftools", "tabix", "conda"):
+        tmpdir.join("bin", name).write(fake_tool, ensure=True)
+        tmpdir.join("bin", name).chmod(0o755)
+    env = dict(os.environ, PATH="%s:%s" % (tmpdir.join("bin"), os.environ["PATH"]))
+    for jobno in range(4):
+        chunk_dir = work_dir.join("job_out.%d.d/out" % jobno).ensure(dir=True)
+        chunk_dir.join("f1r2_%d.txt" % jobno).write("x")
+        subprocess.run(
+            ["tar", "-zcf", "tmp_%d.f1r2_tar.tar.gz" % jobno, "f1r2_%d.txt" % jobno],
+            cwd=str(chunk_dir),
+            check=True,
+        )
+    for name in ("merge_chunk_0", "merge_chunk_1", "merge_all"):
+        rule = workflow.get_rule(name)
+        output = Namedlist(fromdict={key: str(value) for key, value in rule.output.items()})
+        log = Namedlist(fromdict={key: str(value) for key, value in rule.log.items()})
+        cmd = snakemake_format(rule.shellcmd, input=rule.input, output=output, log=log)
+        subprocess.run(
+            ["bash", "-c", cmd], cwd=str(work_dir), env=env, check=True, stdout=subprocess.DEVNULL
+        )
+    result = subprocess.run(
+        ["tar", "-ztf", str(tmpdir.join("out.f1r2_tar.tar.gz"))],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    assert sorted(result.stdout.split()) == ["f1r2_%d.txt" % jobno for jobno in range(4)]
+
+
+def test_merge_overlapping(tmpdir):
+    wrapper = make_wrapper(tmpdir)
+    wrapper.merge_naive = False
+    workflow = load_workflow(wrapper, tmpdir.join("work").ensure(dir=True))
+    assert "--allow-overlaps" in workflow.get_rule("merge_all").shellcmd
+
+
+def test_trim_chunk(tmpdir):
+    """Check that each chunk is trimmed to its window in the cluster job of the chunk"""
+    tmpdir.join("bin/bcftools").write(
+        '#!/bin/bash\necho "$@" >>%s\n' % tmpdir.join("calls"), ensure=True
+    )
+    tmpdir.join("bin/bcftools").chmod(0o755)
+    tmpdir.join("bin/tabix").write("#!/bin/bash\n")
+    tmpdir.join("bin/tabix").chmod(0o755)
+    wrapper = make_wrapper(tmpdir)
+    workflow = load_workflow(wrapper, tmpdir.join("work").ensure(dir=True), run_local=False)
+    chunk, trim = workflow.get_rule("chunk"), workflow.get_rule("trim_chunk")
+    assert chunk.group == trim.group == "chunk"
+    assert all(is_flagged(path, "temp") for path in chunk.output)
+    assert [path.replace(",\\d+", "") for path in trim.output] == [
+        "job_out.{jobno}.d/.done",
+        "job_out.{jobno}.d/out/tmp_{jobno}.vcf.gz",
+        "job_out.{jobno}.d/out/tmp_{jobno}.vcf.gz.tbi",
+    ]
+    wildcards = Wildcards(fromdict={"jobno": "2"})
+    cmd = snakemake_format(
+        trim.shellcmd,
+        input=Namedlist(fromdict={"vcf": "in.vcf.gz"}),
+        output=Namedlist(fromdict={"vcf": "out.vcf.gz"}),
+        params=Namedlist(fromdict={"core": trim.params.core(wildcards)}),
+    )
+    env = dict(os.environ, PATH="%s:%s" % (tmpdir.join("bin"), os.environ["PATH"]))
+    subprocess.run(["bash", "-c", cmd], env=env, check=True)
+    assert tmpdir.join("calls").read().splitlines() == [
+        "view --no-version -t 1:2001-2500 -O z -o out.vcf.gz in.vcf.gz"
+    ]
+
+
+def test_chunk_manifest(tmpdir):
+    tmpdir.join("job_out.0.d/out/tmp_0.vcf.gz").write("vcf", ensure=True)
+    tmpdir.join("job_out.0.d/.done").write("")
+    path = str(tmpdir.join("job_out.0.d/manifest.json"))
+    region = {"args": {"intervals": ["1:1-1,000"]}, "core": "1:1-1000"}
+    write_chunk_manifest(path, region, {"x": "z"})
+    assert check_chunk_manifest(path, region, {"x": "z"})
+    assert not check_chunk_manifest(path, region, {"x": "y"})
+    assert not check_chunk_manifest(path, dict(region, core="1:1-900"), {"x": "z"})
+    # Corrupted file of the same size
+    tmpdir.join("job_out.0.d/out/tmp_0.vcf.gz").write("VCF")
+    assert not check_chunk_manifest(path, region, {"x": "z"})
+    assert not check_chunk_manifest(str(tmpdir.join("missing.json")), region, {"x": "z"})
+
+
+def test_resume(tmpdir):
+    """Check that a resumed run only keeps the chunks with valid manifest"""
+    wrapper = make_wrapper(tmpdir)
+    wrapper._get_config()["resumable"] = True
+    work_dir = tmpdir.join(".out.vcf.gz.parallel_work.d")
+    assert wrapper.get_resume_dir() == str(work_dir)
+    workflow = load_workflow(wrapper, work_dir.ensure(dir=True))
+    assert "job_out.3.d/manifest.json" in workflow.get_rule("all").input
+    assert workflow.get_rule("chunk_manifest").is_run
+    with in_working_dir(str(work_dir)):
+        for jobno in range(3):
+            work_dir.join("job_out.%d.d/out/tmp_%d.vcf.gz" % (jobno, jobno)).write("x", ensure=True)
+            write_chunk_manifest(
+                "job_out.%d.d/manifest.json" % jobno,
+                workflow.globals["REGIONS"][jobno],
+                workflow.config["chunk_params"],
+            )
+        work_dir.join("job_out.1.d/out/tmp_1.vcf.gz").write("truncated")
+        work_dir.join("job_out.3.d/.done").write("", ensure=True)  # no manifest yet
+        work_dir.join("merge_out.0.d/out/out.vcf.gz").write("x", ensure=True)
+        # Lock left behind by the nested Snakemake of a killed job
+        work_dir.join(".snakemake/locks/0.input.lock").write("x", ensure=True)
+        work_dir.join(".snakemake/incomplete/x").write("", ensure=True)
+        wrapper._prepare_resume()
+    logging.shutdown()
+    assert work_dir.join("job_out.0.d/manifest.json").exists()
+    assert not work_dir.join("job_out.1.d").exists()
+    assert work_dir.join("job_out.2.d/manifest.json").exists()
+    assert not work_dir.join("job_out.3.d").exists()
+    assert not work_dir.join("merge_out.0.d").exists()
+    assert not work_dir.join(".snakemake/locks").exists()
+    assert work_dir.join(".snakemake/incomplete/x").exists()
+
+
+def test_resource_escalation():
+    res_usage = ResourceUsage(
+        memory=gib(4),
+        duration=hours(2),
+        retry_mult_memory=2,
+        retry_mult_time=1.5,
+        max_memory=gib(10),
+    )
+    assert SgeResourceUsageConverter(res_usage).to_res_dicts(4) == [
+        {"ntasks": 1, "time": "02:00", "mem": 4096},
+        {"ntasks": 1, "time": "03:00", "mem": 8192},
+        {"ntasks": 1, "time": "04:30", "mem": 10240},
+        {"ntasks": 1, "time": "06:45", "mem": 10240},
+    ]
+
+
+def test_chunk_resources_by_attempt(tmpdir, caplog):
+    """Check that memory and time of the ``chunk`` rule are escalated on each attempt"""
+    wrapper = make_wrapper(tmpdir)
+    wrapper.job_resources = ResourceUsage(memory=gib(4), duration=hours(2))
+    wrapper._get_config().update(
+        {
+            "restart_times": 2,
+            "job_retry_mult_memory": 2,
+            "job_retry_mult_time": 2,
+            "job_retry_max_time": 3,
+        }
+    )
+    workflow = load_workflow(wrapper, tmpdir.join("work").ensure(dir=True))
+    assert workflow.globals["cluster_config"]["chunk"] == {
+        "ntasks": 1,
+        "time": "{resources.time}",
+        "mem": "{resources.mem}",
+    }
+    rule = workflow.get_rule("chunk")
+    wildcards = Wildcards(fromdict={"jobno": "1"})
+    caplog.set_level(logging.INFO)
+    resources = [rule.expand_resources(wildcards, [], attempt) for attempt in (1, 2, 3, 4)]
+    assert [res.mem for res in resources] == [4096, 8192, 16384, 16384]
+    assert [res.time for res in resources] == ["02:00", "03:00", "03:00", "03:00"]
+    assert "Escalating mem of chunk (jobno=1) to 8192 on attempt 2" in caplog.text
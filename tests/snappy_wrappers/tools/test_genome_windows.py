@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 """Tests for ``snappy_wrappers.tools.vcf_first_header``"""
 
+import gzip
+import struct
 import textwrap
 
 import pytest
@@ -46,3 +48,96 @@ def test_genome_windows(capsys, ref_fasta_fake_fs, mocker):
         ).lstrip()
     )
     assert err == ""
+
+
+def test_yield_fasta_gaps(tmpdir):
+    tmpdir.join("ref.fasta").write(">1 desc\nACGNN\nNNACN\n>2\nNNNN\nAC\n")
+    with open(str(tmpdir.join("ref.fasta")), "rt") as inputf:
+        assert list(genome_windows.yield_fasta_gaps(inputf)) == [
+            ("1", 3, 7),
+            ("1", 9, 10),
+            ("2", 0, 4),
+        ]
+
+
+def test_split_balanced():
+    # Cost is concentrated in the first half, the cut is placed in the cheap bin 1 (a gap)
+    bins = [40.0, 0.0, 45.0, 5.0, 5.0, 5.0]
+    windows = list(genome_windows.split_balanced(60, bins, 10, 50.0))
+    assert windows == [(0, 15), (15, 60)]
+    # Without cost variation, the windows have about the same length
+    windows = list(genome_windows.split_balanced(100, [1.0] * 10, 10, 5.0))
+    assert windows == [(0, 45), (45, 100)]
+
+
+def test_yield_balanced_regions_targets(tmpdir):
+    tmpdir.join("ref.fasta.fai").write("1\t100000\t3\t60\t61\n2\t100000\t100000\t60\t61\n")
+    tmpdir.join("targets.bed").write("track name=x\n1\t1000\t9000\n1\t20000\t28000\n")
+    with open(str(tmpdir.join("ref.fasta.fai")), "rt") as fai_file:
+        contigs = list(genome_windows.yield_fai_contigs(fai_file))
+        fai_file.seek(0)
+        cost_bins = genome_windows.build_cost_bins(
+            contigs, "targets", [str(tmpdir.join("targets.bed"))], bin_size=1000
+        )
+        regions = list(
+            genome_windows.yield_balanced_regions(fai_file, 50000, cost_bins, bin_size=1000)
+        )
+    # The targets are split evenly, the second window ends between them, and chromosome 2
+    # without targets is not split
+    assert [(r.chrom, r.begin, r.end) for r in regions] == [
+        ("1", 0, 5500),
+        ("1", 5500, 19500),
+        ("1", 19500, 24500),
+        ("1", 24500, 100000),
+        ("2", 0, 100000),
+    ]
+
+
+def _write_bam_and_bai(tmpdir):
+    """Write BAM header and BAI file with leaf bins for 2 reference sequences"""
+    header = b"BAM\1" + struct.pack("<i", 0) + struct.pack("<i", 2)
+    for name in (b"1", b"2"):
+        header += struct.pack("<i", len(name) + 1) + name + b"\0" + struct.pack("<i", 1000000)
+    with gzip.open(str(tmpdir.join("x.bam")), "wb") as outputf:
+        outputf.write(header)
+    index = b"BAI\1" + struct.pack("<i", 2)
+    # reference 1: leaf bins 0 and 5 with 2000 compressed bytes each, plus a non-leaf bin
+    bins = [(4681, [(0, 2000 << 16)]), (4686, [(5000 << 16, 7000 << 16)]), (0, [(0, 1 << 30)])]
+    index += struct.pack("<i", len(bins))
+    for bin_no, chunks in bins:
+        index += struct.pack("<Ii", bin_no, len(chunks))
+        for beg, end in chunks:
+            index += struct.pack("<QQ", beg, end)
+    index += struct.pack("<i", 1) + struct.pack("<Q", 0)
+    # reference 2: no reads
+    index += struct.pack("<i", 0) + struct.pack("<i", 0)
+    tmpdir.join("x.bam.bai").write_binary(index)
+
+
+def test_yield_bam_index_costs(tmpdir):
+    _write_bam_and_bai(tmpdir)
+    assert list(genome_windows.yield_bam_index_costs(str(tmpdir.join("x.bam")))) == [
+        ("1", 0, 16384, 2000.0),
+        ("1", 5 * 16384, 6 * 16384, 2000.0),
+    ]
+
+
+def test_genome_windows_balanced(capsys, tmpdir):
+    _write_bam_and_bai(tmpdir)
+    tmpdir.join("ref.fasta.fai").write("1\t1000000\t3\t60\t61\n2\t1000000\t100000\t60\t61\n")
+    genome_windows.main(
+        [
+            "--fai-file",
+            str(tmpdir.join("ref.fasta.fai")),
+            "--window-size",
+            "1000000",
+            "--balance-by",
+            "bam_index",
+            "--balance-file",
+            str(tmpdir.join("x.bam")),
+        ]
+    )
+    out, err = capsys.readouterr()
+    # Two windows as with fixed windows, cut between the two bins with reads on chromosome 1
+    assert out.splitlines() == ["1:1-24,576", "1:24,577-1,000,000", "2:1-1,000,000"]
+    assert err == ""
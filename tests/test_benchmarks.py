@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""Smoke tests for the benchmark suites in ``benchmarks``, using the smallest cohort"""
+
+import pytest
+
+from benchmarks.__main__ import run_suite
+from benchmarks.bench_workflows import SUITES
+from benchmarks.synthetic import SyntheticProject, cancer_sheet_tsv, germline_sheet_tsv
+
+__author__ = "Manuel Holtgrewe <manuel.holtgrewe@bihealth.de>"
+
+
+def test_germline_sheet_tsv():
+    lines = germline_sheet_tsv(4).splitlines()
+    assert len(lines) == 2 + 4
+    assert lines[2].split("\t")[:3] == ["D00000", "D00001", "D00002"]
+    assert lines[5].split("\t")[:3] == ["D00003", ".", "."]
+
+
+def test_cancer_sheet_tsv():
+    lines = cancer_sheet_tsv(3).splitlines()
+    assert len(lines) == 1 + 2 * 3
+    assert lines[2].split("\t") == ["D00000", "T1", "Y", "WGS", "D00000-T1-DNA1-WGS1"]
+
+
+def test_synthetic_project(tmpdir):
+    project = SyntheticProject(5, "matched_cancer", root=str(tmpdir))
+    assert tmpdir.join("raw", "D00004-T1-DNA1-WGS1", "FCXXXXXX", "L001").check(dir=True)
+    project.cleanup()
+    assert tmpdir.check(dir=True)
+
+
+@pytest.mark.parametrize("suite_class", SUITES, ids=lambda suite_class: suite_class.__name__)
+def test_benchmark_suite(suite_class):
+    suite = suite_class()
+    suite.setup(10)
+    try:
+        assert suite.calls
+    finally:
+        suite.teardown(10)
+    names = [name for name, _ in run_suite(suite_class, 10, 1)]
+    assert names == ["time_construct", "time_get_result_files", "time_input_functions"]
+
+
+def test_benchmark_input_functions_fresh_workflow(mocker):
+    """The input function benchmark times a fresh object constructed outside of the timing"""
+    suite_class = SUITES[0]
+    suite = suite_class()
+    suite.setup(10)
+    try:
+        construct = mocker.patch.object(suite.project, "construct")
+        suite.time_input_functions(10)
+        assert not construct.called
+    finally:
+        suite.teardown(10)
+    setup = mocker.spy(suite_class, "setup")
+    names = [name for name, _ in run_suite(suite_class, 10, 2)]
+    assert len(names) == 3
+    # Once for the suite and once for the second run of ``time_input_functions``
+    assert setup.call_count == 2